@@ -0,0 +1,255 @@
+"""
+Kontrola przyjmowania żądań: limity klientów i odrzucanie nadmiaru ruchu.
+
+Trzy niezależne progi, sprawdzane zanim żądanie zajmie wątek z puli:
+
+1. Kubełek tokenów na klienta (klucz API z nagłówka X-API-Key, jeśli jest na
+   liście API_KEYS, inaczej adres IP) - po jego wyczerpaniu odpowiedź 429
+   z Retry-After. Nieznany klucz nie daje osobnego kubełka, więc losowy klucz
+   w każdym żądaniu nie omija limitu adresu.
+2. Limit równoczesnych wykonań dla kosztownych ścieżek (ROUTE_CONCURRENCY);
+   nadmiarowe żądania czekają w krótkiej kolejce, a gdy i ona jest pełna -
+   503 z Retry-After.
+3. Liczba żądań w toku w całym procesie - powyżej progu (pula wątków minus
+   zapas) kolejne żądania dostają od razu 503, zamiast ustawiać się w kolejce
+   do nasyconej puli i spowalniać wszystkich.
+
+Stan kubełków jest domyślnie w pamięci procesu. Przy kilku workerach można go
+współdzielić przez lokalny plik SQLite: ADMISSION_STORE=file:/tmp/admission.db
+(odczyt i zapis pliku idą w osobnych wątkach, poza pętlą zdarzeń i pulą endpointów).
+Limity równoczesności zawsze dotyczą jednego procesu - chronią jego pulę wątków.
+"""
+
+import asyncio
+import math
+import os
+import sqlite3
+import threading
+import time
+
+import anyio
+import anyio.to_thread
+from starlette.responses import JSONResponse
+
+# Kubełek klienta: średnio RATE żądań na sekundę, chwilowo do BURST
+RATE = float(os.environ.get("RATE_LIMIT_PER_SECOND", "20"))
+BURST = float(os.environ.get("RATE_LIMIT_BURST", "40"))
+
+# Ścieżka -> maksymalna liczba równoczesnych wykonań w procesie
+ROUTE_CONCURRENCY = {
+    "/initiatives": 16,
+    "/statistics": 4,
+}
+
+# Ile żądań może czekać na wolne miejsce danej ścieżki i jak długo
+ROUTE_QUEUE_FACTOR = 2
+ROUTE_QUEUE_TIMEOUT = 2.0
+
+# Ile wątków puli zostawiamy wolnych (zapisy, outbox, strumienie)
+THREAD_RESERVE = 8
+
+# "memory" albo "file:ścieżka" (stan kubełków współdzielony przez workery)
+STORE_URL = os.environ.get("ADMISSION_STORE", "memory")
+
+# Znane klucze API (po przecinku) - tylko one dostają własny kubełek
+API_KEYS = frozenset(key.strip() for key in os.environ.get("API_KEYS", "").split(",") if key.strip())
+
+# Wątki dla kubełków w pliku (osobne od puli endpointów)
+STORE_THREADS = 4
+
+# Bez limitów: /ready (sondy), strumienie SSE (długie połączenia) i żądania
+# wykonywane wewnątrz procesu (rozgrzewka)
+EXEMPT_PATHS = {"/ready"}
+EXEMPT_SUFFIXES = ("/events",)
+INTERNAL_CLIENTS = {"warmup"}
+
+
+class MemoryStore:
+    """Kubełki tokenów w pamięci procesu"""
+
+    # take() nie czeka na wejście/wyjście - można je wołać w pętli zdarzeń
+    blocking = False
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def take(self, key, now=None):
+        """Pobierz token; zwraca (czy przyjęto, sekundy do kolejnego tokenu)"""
+        now = now or time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            # Pełne kubełki niczego nie wnoszą - nie trzymamy ich w nieskończoność
+            if len(self._buckets) > 10000:
+                self._buckets = {k: v for k, v in self._buckets.items()
+                                 if v[0] + (now - v[1]) * self.rate < self.burst}
+        return allowed, 0.0 if allowed else (1 - tokens) / self.rate
+
+
+class FileStore:
+    """Kubełki tokenów w lokalnym pliku SQLite, wspólne dla workerów na jednej maszynie"""
+
+    # take() czeka na plik (busy timeout) - wywoływane w osobnym wątku
+    blocking = True
+
+    def __init__(self, path, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.path = path
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, isolation_level=None, timeout=0.05)
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = OFF")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS buckets (
+                    key TEXT PRIMARY KEY,
+                    tokens REAL NOT NULL,
+                    updated REAL NOT NULL,
+                    allowed INTEGER NOT NULL
+                )
+            """)
+            self._local.conn = conn
+        return conn
+
+    def take(self, key, now=None):
+        now = now or time.time()
+        refill = "MIN(:burst, tokens + (:now - updated) * :rate)"
+        try:
+            row = self._connection().execute(f"""
+                INSERT INTO buckets (key, tokens, updated, allowed)
+                VALUES (:key, :burst - 1, :now, 1)
+                ON CONFLICT(key) DO UPDATE SET
+                    tokens = CASE WHEN {refill} >= 1 THEN {refill} - 1 ELSE {refill} END,
+                    allowed = {refill} >= 1,
+                    updated = :now
+                RETURNING tokens, allowed
+            """, {"key": key, "now": now, "rate": self.rate, "burst": self.burst}).fetchone()
+        except sqlite3.OperationalError:
+            # Plik chwilowo zablokowany - lepiej przepuścić żądanie niż je zatrzymać
+            return True, 0.0
+        tokens, allowed = row
+        return bool(allowed), 0.0 if allowed else (1 - tokens) / self.rate
+
+
+def store_from_url(url, rate=RATE, burst=BURST):
+    if url.startswith("file:"):
+        return FileStore(url[len("file:"):], rate, burst)
+    return MemoryStore(rate, burst)
+
+
+def client_key(scope, api_keys=API_KEYS):
+    """Klucz klienta: znany klucz API, a bez niego adres IP"""
+    for name, value in scope["headers"]:
+        if name == b"x-api-key" and value:
+            key = value.decode("latin-1")
+            if key in api_keys:
+                return "key:" + key
+            break
+    client = scope.get("client")
+    return "ip:" + (client[0] if client else "unknown")
+
+
+def _reject(status_code, retry_after, detail):
+    return JSONResponse({"detail": detail}, status_code=status_code,
+                        headers={"Retry-After": str(max(1, math.ceil(retry_after)))})
+
+
+class _RouteLimit:
+    def __init__(self, limit):
+        self.limit = limit
+        self.max_waiting = limit * ROUTE_QUEUE_FACTOR
+        self.semaphore = asyncio.Semaphore(limit)
+        self.waiting = 0
+
+
+class AdmissionMiddleware:
+    """Middleware ASGI: limity klientów, limity ścieżek i odrzucanie nadmiaru"""
+
+    def __init__(self, app, store=None, route_concurrency=None, max_in_flight=None, api_keys=None):
+        self.app = app
+        self.store = store or store_from_url(STORE_URL)
+        self.api_keys = API_KEYS if api_keys is None else frozenset(api_keys)
+        self._store_limiter = anyio.CapacityLimiter(STORE_THREADS)
+        self.routes = {path: _RouteLimit(limit)
+                       for path, limit in (route_concurrency or ROUTE_CONCURRENCY).items()}
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+
+    def _exempt(self, scope):
+        path = scope["path"]
+        client = scope.get("client")
+        return (path in EXEMPT_PATHS or path.endswith(EXEMPT_SUFFIXES)
+                or (client is not None and client[0] in INTERNAL_CLIENTS))
+
+    def _in_flight_limit(self):
+        if self.max_in_flight is None:
+            threads = anyio.to_thread.current_default_thread_limiter().total_tokens
+            self.max_in_flight = max(1, int(threads) - THREAD_RESERVE)
+        return self.max_in_flight
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or self._exempt(scope):
+            await self.app(scope, receive, send)
+            return
+
+        if self.store.rate > 0:
+            key = client_key(scope, self.api_keys)
+            if self.store.blocking:
+                allowed, retry_after = await anyio.to_thread.run_sync(
+                    self.store.take, key, limiter=self._store_limiter)
+            else:
+                allowed, retry_after = self.store.take(key)
+            if not allowed:
+                await _reject(429, retry_after, "Zbyt wiele żądań - spróbuj ponownie później")(
+                    scope, receive, send)
+                return
+
+        if self.in_flight >= self._in_flight_limit():
+            await _reject(503, 1, "Serwer jest przeciążony - spróbuj ponownie za chwilę")(
+                scope, receive, send)
+            return
+
+        route = self.routes.get(scope["path"])
+        if route is None:
+            await self._run(scope, receive, send)
+            return
+
+        if route.semaphore.locked() and route.waiting >= route.max_waiting:
+            await _reject(503, 1, "Serwer jest przeciążony - spróbuj ponownie za chwilę")(
+                scope, receive, send)
+            return
+
+        route.waiting += 1
+        try:
+            # Anulowane acquire() oddaje przydzielone już miejsce (wait_for w 3.11 mógł je zgubić)
+            async with asyncio.timeout(ROUTE_QUEUE_TIMEOUT):
+                await route.semaphore.acquire()
+        except TimeoutError:
+            await _reject(503, 1, "Serwer jest przeciążony - spróbuj ponownie za chwilę")(
+                scope, receive, send)
+            return
+        finally:
+            route.waiting -= 1
+
+        try:
+            await self._run(scope, receive, send)
+        finally:
+            route.semaphore.release()
+
+    async def _run(self, scope, receive, send):
+        self.in_flight += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.in_flight -= 1
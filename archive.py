@@ -0,0 +1,183 @@
+"""
+Archiwizacja zakończonych inicjatyw i ich uczestnictw.
+
+Inicjatywy o statusie completed/cancelled zakończone przed datą graniczną są
+przenoszone (razem z uczestnictwami) do osobnego pliku bazy dołączanego przez
+ATTACH. Dzięki temu tabele initiatives i participations zawierają tylko bieżące
+dane. Odczyty obejmujące archiwum korzystają z widoków all_initiatives
+i all_participations - zapytania historyczne muszą o nie poprosić jawnie.
+
+Uruchomienie: python archive.py --older-than-days 365
+"""
+
+import argparse
+import os
+import time
+from datetime import datetime, timedelta
+
+import queries
+
+ARCHIVE_PATH = os.environ.get("VOLUNTEER_ARCHIVE_DB", "volunteer_archive.db")
+
+# Domyślnie archiwizujemy inicjatywy zakończone ponad rok temu
+ARCHIVE_AFTER_DAYS = 365
+
+# Liczba inicjatyw przenoszonych w jednej transakcji
+BATCH_SIZE = 200
+
+ARCHIVED_TABLES = ("initiatives", "participations")
+
+
+def _columns(conn, schema, table):
+    return [row[1] for row in conn.execute(f"PRAGMA {schema}.table_info({table})")]
+
+
+def _ensure_schema(conn):
+    """Utwórz lub uzupełnij tabele archiwum tak, by miały kolumny tabel bieżących"""
+    for table in ARCHIVED_TABLES:
+        main_columns = _columns(conn, "main", table)
+        archive_columns = _columns(conn, "archive", table)
+
+        if not archive_columns:
+            sql = conn.execute("SELECT sql FROM main.sqlite_master WHERE type = 'table' AND name = ?",
+                               (table,)).fetchone()[0]
+            conn.execute(sql.replace(f"CREATE TABLE {table}", f"CREATE TABLE archive.{table}", 1))
+            continue
+
+        # Kolumny dodane migracjami po utworzeniu archiwum
+        types = {row[1]: row[2] for row in conn.execute(f"PRAGMA main.table_info({table})")}
+        for column in main_columns:
+            if column not in archive_columns:
+                conn.execute(f"ALTER TABLE archive.{table} ADD COLUMN {column} {types[column]}")
+
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS archive.idx_archive_participations_volunteer
+        ON participations(volunteer_id)
+    """)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS archive.idx_archive_participations_initiative
+        ON participations(initiative_id)
+    """)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS archive.idx_archive_initiatives_organization
+        ON initiatives(organization_id)
+    """)
+    conn.commit()
+
+
+def _create_views(conn):
+    for table in ARCHIVED_TABLES:
+        columns = ", ".join(_columns(conn, "main", table))
+        conn.execute(f"""
+            CREATE TEMP VIEW IF NOT EXISTS all_{table} AS
+            SELECT {columns} FROM main.{table}
+            UNION ALL
+            SELECT {columns} FROM archive.{table}
+        """)
+
+
+def attach(conn):
+    """Dołącz bazę archiwum i widoki all_initiatives / all_participations"""
+    databases = {row[1] for row in conn.execute("PRAGMA database_list")}
+    if "archive" not in databases:
+        conn.execute("ATTACH DATABASE ? AS archive", (ARCHIVE_PATH,))
+        _ensure_schema(conn)
+        _create_views(conn)
+    return conn
+
+
+def table_names(include_archived):
+    """Nazwy tabel (inicjatywy, uczestnictwa) z archiwum lub bez - bez podłączania bazy"""
+    if include_archived:
+        return "all_initiatives", "all_participations"
+    return "initiatives", "participations"
+
+
+def tables(conn, include_archived):
+    """Nazwy tabel (inicjatywy, uczestnictwa) dla zapytania z archiwum lub bez"""
+    if include_archived:
+        attach(conn)
+    return table_names(include_archived)
+
+
+def archive_finished(conn, older_than_days=ARCHIVE_AFTER_DAYS, batch_size=BATCH_SIZE, pause=0.0):
+    """Przenieś zakończone inicjatywy (i ich uczestnictwa) do archiwum partiami"""
+    attach(conn)
+    cutoff = (datetime.now() - timedelta(days=older_than_days)).strftime("%Y-%m-%d")
+    initiative_columns = ", ".join(_columns(conn, "main", "initiatives"))
+    participation_columns = ", ".join(_columns(conn, "main", "participations"))
+
+    moved_initiatives = 0
+    moved_participations = 0
+    cursor = conn.cursor()
+
+    while True:
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            cursor.execute("""
+                SELECT id FROM main.initiatives
+                WHERE status IN ('completed', 'cancelled') AND end_date < ?
+                ORDER BY id
+                LIMIT ?
+            """, (cutoff, batch_size))
+            ids = [row[0] for row in cursor.fetchall()]
+            if not ids:
+                conn.commit()
+                break
+
+            # Jeden parametr JSON zamiast listy "?, ?, ..." - ten sam tekst SQL dla każdej partii
+            batch = (queries.array(ids),)
+            cursor.execute(f"""
+                INSERT OR REPLACE INTO archive.initiatives ({initiative_columns})
+                SELECT {initiative_columns} FROM main.initiatives
+                WHERE id IN (SELECT value FROM json_each(?))
+            """, batch)
+            cursor.execute(f"""
+                INSERT OR REPLACE INTO archive.participations ({participation_columns})
+                SELECT {participation_columns} FROM main.participations
+                WHERE initiative_id IN (SELECT value FROM json_each(?))
+            """, batch)
+            cursor.execute("""
+                DELETE FROM main.participations
+                WHERE initiative_id IN (SELECT value FROM json_each(?))
+            """, batch)
+            moved_participations += cursor.rowcount
+            cursor.execute("DELETE FROM main.initiatives WHERE id IN (SELECT value FROM json_each(?))",
+                           batch)
+            moved_initiatives += cursor.rowcount
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+        # Krótka przerwa między partiami pozwala wejść innym zapisom
+        if pause:
+            time.sleep(pause)
+
+    return {
+        "cutoff": cutoff,
+        "initiatives": moved_initiatives,
+        "participations": moved_participations
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Archiwizacja zakończonych inicjatyw")
+    parser.add_argument("--older-than-days", type=int, default=ARCHIVE_AFTER_DAYS)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--pause", type=float, default=0.05,
+                        help="przerwa między partiami w sekundach")
+    args = parser.parse_args()
+
+    from database import get_db
+
+    conn = get_db()
+    result = archive_finished(conn, args.older_than_days, args.batch_size, args.pause)
+    conn.close()
+
+    print(f"✓ Zarchiwizowano {result['initiatives']} inicjatyw i "
+          f"{result['participations']} uczestnictw (zakończone przed {result['cutoff']})")
+
+
+if __name__ == "__main__":
+    main()
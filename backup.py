@@ -0,0 +1,231 @@
+"""
+Kopie zapasowe bazy działającej aplikacji.
+
+Kopia jest robiona przez API kopii zapasowych SQLite (sqlite3.Connection.backup)
+małymi krokami po PAGES_PER_STEP stron, z krótką przerwą między krokami.
+Źródło jest czytane w jednej transakcji odczytu - w trybie WAL zapisy z
+endpointów idą w tym czasie normalnie, a kopia i tak odpowiada jednej chwili
+(kopiowanie nie zaczyna się od nowa po każdym zapisie innego połączenia).
+
+Gotowa kopia jest kompresowana (gzip) do katalogu BACKUP_DIR pod nazwą
+volunteer-RRRRMMDD-GGMMSS.db.gz; starsze niż KEEP_BACKUPS najnowszych są usuwane.
+Przywrócenie rozpakowuje kopię obok bazy, sprawdza ją (PRAGMA integrity_check)
+i dopiero wtedy przepisuje do bazy docelowej tym samym API - przez blokady
+SQLite, a nie podmianę pliku, więc pliki -wal/-shm pozostają spójne. Na koniec
+zapisuje nowe pokolenie bazy (database_generation): katalog inicjatyw, pamięć
+kont i rankingi działającego serwera widzą je przy najbliższym żądaniu
+i wczytują dane od nowa, zamiast uznać cofnięte numery zmian za starszą migawkę.
+
+Uruchomienie:
+    python backup.py                       # kopia + usunięcie najstarszych
+    python backup.py --list
+    python backup.py --restore backups/volunteer-20250101-120000.db.gz
+"""
+
+import argparse
+import gzip
+import os
+import shutil
+import sqlite3
+import time
+from datetime import datetime
+
+import database
+
+BACKUP_DIR = os.environ.get("VOLUNTEER_BACKUP_DIR", "backups")
+
+# Ile najnowszych kopii zostawiać w katalogu
+KEEP_BACKUPS = int(os.environ.get("BACKUP_KEEP", "7"))
+
+# Stron kopiowanych w jednym kroku (4 KB strona -> ok. 1 MB) i przerwa między krokami
+PAGES_PER_STEP = 256
+STEP_PAUSE_SECONDS = 0.005
+
+PREFIX = "volunteer-"
+SUFFIX = ".db.gz"
+
+# Rozmiar bloku przy (de)kompresji
+COPY_BUFFER = 1024 * 1024
+
+
+class BackupError(Exception):
+    pass
+
+
+def _copy(source, target, pause=STEP_PAUSE_SECONDS):
+    """Skopiuj bazę krokami; zwraca liczbę stron"""
+    pages = []
+
+    def progress(status, remaining, total):
+        pages[:] = [total]
+        # Przerwa oddaje dysk i blokady innym połączeniom między krokami
+        if remaining and pause:
+            time.sleep(pause)
+
+    source.backup(target, pages=PAGES_PER_STEP, progress=progress)
+    return pages[0] if pages else 0
+
+
+def _integrity_errors(path):
+    conn = sqlite3.connect(path)
+    try:
+        rows = [row[0] for row in conn.execute("PRAGMA integrity_check")]
+    finally:
+        conn.close()
+    return [] if rows == ["ok"] else rows
+
+
+def _new_generation(conn):
+    """Oznacz przywróconą bazę nowym pokoleniem; None dla kopii sprzed migracji 14"""
+    generation = time.time_ns()
+    try:
+        with conn:
+            conn.execute("UPDATE database_generation SET generation = ?", (generation,))
+    except sqlite3.OperationalError:
+        # Brak tabeli - serwer i tak wymaga migracji (i restartu) przed użyciem tej bazy
+        return None
+    return generation
+
+
+def list_backups(directory=None):
+    """Kopie w katalogu od najnowszej: [{name, path, size, created_at}]"""
+    directory = directory or BACKUP_DIR
+    if not os.path.isdir(directory):
+        return []
+    backups = []
+    for name in sorted(os.listdir(directory), reverse=True):
+        if name.startswith(PREFIX) and name.endswith(SUFFIX):
+            path = os.path.join(directory, name)
+            stat = os.stat(path)
+            backups.append({
+                "name": name,
+                "path": path,
+                "size": stat.st_size,
+                "created_at": datetime.fromtimestamp(stat.st_mtime).isoformat(timespec="seconds")
+            })
+    return backups
+
+
+def prune(directory=None, keep=KEEP_BACKUPS):
+    """Usuń kopie poza `keep` najnowszymi; zwraca nazwy usuniętych"""
+    removed = []
+    for backup in list_backups(directory)[keep:]:
+        os.remove(backup["path"])
+        removed.append(backup["name"])
+    return removed
+
+
+def backup(source_path=None, directory=None, keep=KEEP_BACKUPS, pause=STEP_PAUSE_SECONDS):
+    """Zrób skompresowaną kopię bazy i usuń najstarsze; zwraca raport"""
+    source_path = source_path or database.DATABASE_PATH
+    directory = directory or BACKUP_DIR
+    os.makedirs(directory, exist_ok=True)
+
+    started = time.time()
+    name = f"{PREFIX}{datetime.now().strftime('%Y%m%d-%H%M%S')}{SUFFIX}"
+    path = os.path.join(directory, name)
+    raw_path = path[:-len(".gz")] + ".part"
+
+    source = sqlite3.connect(source_path, isolation_level=None)
+    target = sqlite3.connect(raw_path)
+    try:
+        source.execute(f"PRAGMA busy_timeout = {database.BUSY_TIMEOUT_MS}")
+        # Transakcja odczytu ustala migawkę, z której powstaje cała kopia
+        source.execute("BEGIN")
+        source.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+        pages = _copy(source, target, pause)
+        source.execute("COMMIT")
+    finally:
+        target.close()
+        source.close()
+
+    try:
+        with open(raw_path, "rb") as raw, gzip.open(path + ".part", "wb") as compressed:
+            shutil.copyfileobj(raw, compressed, COPY_BUFFER)
+        os.replace(path + ".part", path)
+    finally:
+        for leftover in (raw_path, path + ".part"):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+
+    return {
+        "name": name,
+        "path": path,
+        "pages": pages,
+        "size": os.path.getsize(path),
+        "duration_ms": round((time.time() - started) * 1000, 1),
+        "removed": prune(directory, keep)
+    }
+
+
+def restore(backup_path, target_path=None, pause=STEP_PAUSE_SECONDS):
+    """Przywróć bazę z kopii po sprawdzeniu jej spójności; zwraca raport"""
+    target_path = target_path or database.DATABASE_PATH
+    if not os.path.exists(backup_path):
+        raise BackupError(f"Nie ma pliku kopii: {backup_path}")
+
+    # Rozpakowana kopia leży obok bazy docelowej (ten sam dysk, bez /tmp)
+    raw_path = f"{target_path}.restore"
+    try:
+        try:
+            with gzip.open(backup_path, "rb") as compressed, open(raw_path, "wb") as raw:
+                shutil.copyfileobj(compressed, raw, COPY_BUFFER)
+        except (OSError, EOFError) as e:
+            raise BackupError(f"Nie można rozpakować kopii: {e}")
+
+        try:
+            errors = _integrity_errors(raw_path)
+        except sqlite3.DatabaseError as e:
+            errors = [str(e)]
+        if errors:
+            raise BackupError("Kopia nie przeszła PRAGMA integrity_check: " + "; ".join(errors[:10]))
+
+        source = sqlite3.connect(raw_path)
+        target = sqlite3.connect(target_path)
+        try:
+            target.execute(f"PRAGMA busy_timeout = {database.BUSY_TIMEOUT_MS}")
+            pages = _copy(source, target, pause)
+            schema_version = target.execute("PRAGMA user_version").fetchone()[0]
+            generation = _new_generation(target)
+        finally:
+            target.close()
+            source.close()
+    finally:
+        if os.path.exists(raw_path):
+            os.remove(raw_path)
+
+    return {"path": target_path, "pages": pages, "schema_version": schema_version,
+            "generation": generation}
+
+
+def backup_job(cursor, today, limit):
+    """Zadanie harmonogramu (BACKUP_INTERVAL_SECONDS): kopia w osobnych połączeniach"""
+    backup()
+    return 1, set()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Kopie zapasowe bazy wolontariatu")
+    parser.add_argument("--database", default=database.DATABASE_PATH, help="plik bazy")
+    parser.add_argument("--dir", default=BACKUP_DIR, help="katalog kopii")
+    parser.add_argument("--keep", type=int, default=KEEP_BACKUPS, help="ile najnowszych kopii zostawić")
+    parser.add_argument("--list", action="store_true", help="pokaż zapisane kopie")
+    parser.add_argument("--restore", metavar="PLIK", help="przywróć bazę z kopii (.db.gz)")
+    args = parser.parse_args()
+
+    if args.list:
+        for item in list_backups(args.dir):
+            print(f"{item['name']}  {item['size'] / 1024:.0f} KB  {item['created_at']}")
+    elif args.restore:
+        try:
+            result = restore(args.restore, args.database)
+        except BackupError as e:
+            raise SystemExit(f"❌ {e}")
+        print(f"✅ Przywrócono {result['pages']} stron do {result['path']} "
+              f"(wersja schematu {result['schema_version']})")
+    else:
+        result = backup(args.database, args.dir, args.keep)
+        print(f"✅ Kopia {result['path']}: {result['pages']} stron, "
+              f"{result['size'] / 1024:.0f} KB, {result['duration_ms']} ms")
+        for name in result["removed"]:
+            print(f"   usunięto {name}")
@@ -0,0 +1,134 @@
+"""
+Żądania zbiorcze: POST /batch wykonuje kilka odczytów GET w jednym żądaniu HTTP.
+
+Ekran panelu (np. koordynatora: uczniowie, raporty, statystyki) pobiera
+wszystkie potrzebne dane jednym żądaniem. Podżądania są wykonywane wewnątrz
+procesu, równolegle, przez całą aplikację ASGI (te same walidacje, błędy
+i limity klienta co przy osobnych żądaniach) i widzą jeden stan bazy:
+wszystkie korzystają z jednego połączenia z otwartą transakcją odczytu
+(migawka WAL), więc zapisy wykonane w trakcie nie rozjadą się między częściami
+odpowiedzi.
+
+Dozwolone są tylko odczyty GET - bez strumieni SSE i bez zagnieżdżonych /batch.
+"""
+
+import asyncio
+import json
+
+from starlette.concurrency import run_in_threadpool
+
+import archive
+import database
+
+# Maksymalna liczba podżądań w jednym żądaniu zbiorczym
+MAX_REQUESTS = 20
+
+METHODS = {"GET"}
+
+# Ścieżki, które nie kończą się jedną odpowiedzią albo prowadzą do samego /batch
+EXCLUDED_SUFFIXES = ("/events", "/batch")
+
+# Nagłówki przekazywane podżądaniom (klucz API - ten sam limit klienta)
+FORWARDED_HEADERS = {b"x-api-key", b"authorization", b"accept-language"}
+
+
+def _error(request_id, path, status_code, detail):
+    return {"id": request_id, "path": path, "status": status_code, "body": {"detail": detail}}
+
+
+def _open_snapshot():
+    """Połączenie z otwartą transakcją odczytu - wspólna migawka dla podżądań"""
+    conn = database.pool.acquire()
+    try:
+        # ATTACH nie jest możliwy w transakcji - archiwum dołączamy przed nią
+        archive.attach(conn)
+        conn.execute("BEGIN")
+        # Migawka powstaje przy pierwszym odczycie każdego pliku bazy
+        conn.execute("SELECT COUNT(*) FROM main.sqlite_master").fetchone()
+        conn.execute("SELECT COUNT(*) FROM archive.sqlite_master").fetchone()
+    except BaseException:
+        conn.close()
+        raise
+    return conn
+
+
+def _close_snapshot(conn):
+    conn.rollback()
+    conn.close()
+
+
+def _decode(headers, body):
+    content_type = headers.get(b"content-type", b"").decode("latin-1")
+    if content_type.startswith("application/json"):
+        try:
+            return json.loads(body)
+        except ValueError:
+            pass
+    return body.decode("utf-8", errors="replace")
+
+
+async def _call(app, scope, request_id, method, path):
+    """Wykonaj jedno podżądanie wewnątrz procesu i zwróć jego wynik"""
+    path, _, query = path.partition("?")
+    sub_scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "scheme": scope.get("scheme", "http"),
+        "server": scope.get("server"),
+        "client": scope.get("client"),
+        "root_path": scope.get("root_path", ""),
+        "method": method,
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": query.encode(),
+        "headers": [(b"host", b"batch")] + [(name, value) for name, value in scope["headers"]
+                                             if name in FORWARDED_HEADERS],
+    }
+    response = {"status": None, "headers": {}, "body": []}
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+            response["headers"] = dict(message.get("headers", []))
+        elif message["type"] == "http.response.body":
+            response["body"].append(message.get("body", b""))
+
+    await app(sub_scope, receive, send)
+    return {"id": request_id, "path": path + ("?" + query if query else ""),
+            "status": response["status"],
+            "body": _decode(response["headers"], b"".join(response["body"]))}
+
+
+async def execute(app, scope, requests):
+    """Wykonaj podżądania (lista słowników id/method/path) na wspólnej migawce bazy"""
+    results = [None] * len(requests)
+    calls = []
+    for position, item in enumerate(requests):
+        request_id = item.get("id") or str(position)
+        method = (item.get("method") or "GET").upper()
+        path = item["path"]
+        if method not in METHODS:
+            results[position] = _error(request_id, path, 405,
+                                       "W żądaniu zbiorczym dozwolone są tylko odczyty GET")
+        elif not path.startswith("/") or path.partition("?")[0].rstrip("/").endswith(EXCLUDED_SUFFIXES):
+            results[position] = _error(request_id, path, 400,
+                                       "Tej ścieżki nie można użyć w żądaniu zbiorczym")
+        else:
+            calls.append((position, request_id, method, path))
+
+    if calls:
+        conn = await run_in_threadpool(_open_snapshot)
+        try:
+            with database.pinned(conn):
+                # Zadania dziedziczą kontekst, więc get_db() w każdym zwróci to samo połączenie
+                responses = await asyncio.gather(*(_call(app, scope, request_id, method, path)
+                                                   for _, request_id, method, path in calls))
+        finally:
+            await run_in_threadpool(_close_snapshot, conn)
+        for (position, *_), response in zip(calls, responses):
+            results[position] = response
+    return results
@@ -0,0 +1,203 @@
+"""
+Katalog aktywnych inicjatyw w pamięci procesu.
+
+GET /initiatives dla aktywnych inicjatyw nie odpytuje bazy z JOIN-em do users,
+tylko przecina zbiory identyfikatorów z indeksów odwrotnych (kategoria,
+dzielnica, organizacja, data) i sortuje wynik po dacie rozpoczęcia. Źródłem prawdy
+pozostaje SQLite: triggery zapisują identyfikatory zmienionych inicjatyw
+w initiative_changes, a katalog przed każdym zapytaniem dociąga tylko zmiany
+nowsze niż ostatnio widziany numer sekwencyjny. Po przywróceniu kopii bazy
+(backup.restore zmienia pokolenie w database_generation) katalog jest
+wczytywany od nowa - numery zmian w kopii są starsze niż te, które już widział.
+"""
+
+import bisect
+import threading
+
+import queries
+
+# Powyżej tylu zmian naraz taniej jest przeładować cały katalog
+MAX_INCREMENTAL_CHANGES = 1000
+
+# Klucz sortowania inicjatyw bez dnia rozpoczęcia (data zapisana przed walidacją dat):
+# na końcu listy i poza każdym filtrem dat, jak NULL w zapytaniu SQL
+NO_DAY = float("-inf")
+
+CATALOG_QUERY = """
+    SELECT i.*, u.name as organization_name, u.email as organization_email,
+           d.name as district_name
+    FROM initiatives i
+    JOIN users u ON i.organization_id = u.id
+    LEFT JOIN districts d ON i.district_id = d.id
+"""
+
+
+class CatalogEntry:
+    """Inicjatywa w katalogu: pola indeksowane + wartości kolumn w krotce"""
+
+    __slots__ = ("id", "category", "district_id", "organization_id",
+                 "start_day", "end_day", "values")
+
+    def __init__(self, row):
+        self.id = row['id']
+        self.category = row['category']
+        self.district_id = row['district_id']
+        self.organization_id = row['organization_id']
+        self.start_day = row['start_day']
+        self.end_day = row['end_day']
+        self.values = tuple(row)
+
+    @property
+    def sort_key(self):
+        return (self.start_day if self.start_day is not None else NO_DAY, self.id)
+
+
+class InitiativeCatalog:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.columns = ()
+        self.entries = {}
+        self.by_category = {}
+        self.by_district = {}
+        self.by_organization = {}
+        # Posortowane klucze (start_day, id) - kolejność wyników i zakresy dat
+        self.by_date = []
+        self.last_seq = None
+        self.generation = None
+
+    # === Indeksy ===
+
+    def _add(self, entry):
+        self.entries[entry.id] = entry
+        self.by_category.setdefault(entry.category, set()).add(entry.id)
+        self.by_district.setdefault(entry.district_id, set()).add(entry.id)
+        self.by_organization.setdefault(entry.organization_id, set()).add(entry.id)
+        bisect.insort(self.by_date, entry.sort_key)
+
+    def _discard(self, index, key, initiative_id):
+        ids = index.get(key)
+        if ids is not None:
+            ids.discard(initiative_id)
+            if not ids:
+                del index[key]
+
+    def _remove(self, initiative_id):
+        entry = self.entries.pop(initiative_id, None)
+        if entry is None:
+            return
+        self._discard(self.by_category, entry.category, entry.id)
+        self._discard(self.by_district, entry.district_id, entry.id)
+        self._discard(self.by_organization, entry.organization_id, entry.id)
+        position = bisect.bisect_left(self.by_date, entry.sort_key)
+        if position < len(self.by_date) and self.by_date[position] == entry.sort_key:
+            del self.by_date[position]
+
+    # === Synchronizacja z bazą ===
+
+    def _load_rows(self, cursor, rows):
+        if cursor.description:
+            self.columns = tuple(column[0] for column in cursor.description)
+        for row in rows:
+            if row['status'] == 'active':
+                self._add(CatalogEntry(row))
+
+    def _full_reload(self, cursor, seq, generation):
+        self._reset()
+        cursor.execute(CATALOG_QUERY + " WHERE i.status = 'active'")
+        self._load_rows(cursor, cursor.fetchall())
+        self.last_seq = seq
+        self.generation = generation
+
+    def sync(self, conn):
+        """Dociągnij zmiany z initiative_changes (wywoływane pod blokadą)"""
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT MIN(seq) as first_seq, MAX(seq) as last_seq,
+                   (SELECT generation FROM database_generation) as generation
+            FROM initiative_changes
+        """)
+        bounds = cursor.fetchone()
+        first_seq = bounds['first_seq'] or 0
+        last_seq = bounds['last_seq'] or 0
+        generation = bounds['generation']
+
+        # Pierwsze użycie albo baza przywrócona z kopii (numery zmian cofnęły się)
+        if generation != self.generation:
+            self._full_reload(cursor, last_seq, generation)
+            return
+        if self.last_seq == last_seq:
+            return
+        # Odczyt ze starszej migawki (np. żądanie zbiorcze) - katalog jest już nowszy
+        if last_seq < self.last_seq:
+            return
+        # Część dziennika zmian została już usunięta
+        if self.last_seq < first_seq - 1:
+            self._full_reload(cursor, last_seq, generation)
+            return
+
+        cursor.execute("""
+            SELECT DISTINCT initiative_id FROM initiative_changes
+            WHERE seq > ? AND seq <= ?
+        """, (self.last_seq, last_seq))
+        changed = [row['initiative_id'] for row in cursor.fetchall()]
+        if len(changed) > MAX_INCREMENTAL_CHANGES:
+            self._full_reload(cursor, last_seq, generation)
+            return
+
+        for initiative_id in changed:
+            self._remove(initiative_id)
+
+        cursor.execute(CATALOG_QUERY + " WHERE i.id IN (SELECT value FROM json_each(?))",
+                       (queries.array(changed),))
+        self._load_rows(cursor, cursor.fetchall())
+        self.last_seq = last_seq
+
+    # === Zapytania ===
+
+    def _overlapping_ids(self, from_day, to_day):
+        """Inicjatywy trwające choć jeden dzień w przedziale [from_day, to_day]"""
+        start = bisect.bisect_right(self.by_date, (NO_DAY, float("inf")))
+        end = len(self.by_date)
+        if to_day is not None:
+            end = bisect.bisect_right(self.by_date, (to_day, float("inf")))
+        if from_day is None:
+            return {key[1] for key in self.by_date[start:end]}
+        return {key[1] for key in self.by_date[start:end]
+                if self.entries[key[1]].end_day is not None and self.entries[key[1]].end_day >= from_day}
+
+    def _matching_ids(self, category, district_id, organization_id, from_day, to_day):
+        candidates = []
+        if category:
+            candidates.append(self.by_category.get(category, set()))
+        if district_id:
+            candidates.append(self.by_district.get(district_id, set()))
+        if organization_id:
+            candidates.append(self.by_organization.get(organization_id, set()))
+        if from_day is not None or to_day is not None:
+            candidates.append(self._overlapping_ids(from_day, to_day))
+
+        if not candidates:
+            return None
+        candidates.sort(key=len)
+        return candidates[0].intersection(*candidates[1:])
+
+    def query(self, conn, category=None, district_id=None, organization_id=None,
+              from_day=None, to_day=None):
+        """Aktywne inicjatywy spełniające filtry, od najpóźniejszej daty rozpoczęcia"""
+        with self._lock:
+            self.sync(conn)
+            ids = self._matching_ids(category, district_id, organization_id, from_day, to_day)
+
+            if ids is None:
+                ordered = [key[1] for key in reversed(self.by_date)]
+            else:
+                ordered = sorted(ids, key=lambda i: self.entries[i].sort_key, reverse=True)
+
+            columns = self.columns
+            return [dict(zip(columns, self.entries[i].values)) for i in ordered]
+
+
+catalog = InitiativeCatalog()
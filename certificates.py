@@ -0,0 +1,93 @@
+"""
+Zaświadczenia: zwarty, kanoniczny zapis i weryfikacja po skrócie.
+
+certificate_data przechowuje tylko poświadczane fakty (kto, gdzie, kiedy, ile
+godzin) i identyfikatory powiązanych rekordów - w postaci kanonicznego JSON-a
+(posortowane klucze, bez spacji). Skrót SHA-256 tego tekstu jest zapisywany
+w content_hash z unikalnym indeksem, więc szkoła weryfikuje zaświadczenie
+jednym odczytem: GET /certificates/verify/{hash}.
+"""
+
+import hashlib
+import json
+
+# Wersja formatu zapisu - zmiana pól wymaga nowej wersji, stare skróty pozostają ważne
+PAYLOAD_VERSION = 1
+
+SOURCE_QUERY = """
+    SELECT p.id as participation_id, p.volunteer_id, p.initiative_id, p.hours_completed,
+           i.organization_id, i.title as initiative_title, i.category,
+           i.start_date, i.end_date, v.name as volunteer_name, o.name as organization_name
+    FROM {participations} p
+    JOIN {initiatives} i ON p.initiative_id = i.id
+    JOIN users v ON p.volunteer_id = v.id
+    JOIN users o ON i.organization_id = o.id
+    WHERE p.id = ? AND p.status = 'completed'
+"""
+
+
+def completed_participation(cursor, participation_id,
+                            initiatives="initiatives", participations="participations"):
+    """Ukończone uczestnictwo z danymi potrzebnymi do zaświadczenia albo None"""
+    cursor.execute(SOURCE_QUERY.format(initiatives=initiatives, participations=participations),
+                   (participation_id,))
+    return cursor.fetchone()
+
+
+def payload(row, issued_date):
+    """Poświadczane dane uczestnictwa (wiersz z danymi inicjatywy i wolontariusza)"""
+    return {
+        "v": PAYLOAD_VERSION,
+        "participation_id": row['participation_id'],
+        "volunteer_id": row['volunteer_id'],
+        "volunteer_name": row['volunteer_name'],
+        "initiative_id": row['initiative_id'],
+        "initiative_title": row['initiative_title'],
+        "category": row['category'],
+        "organization_id": row['organization_id'],
+        "organization_name": row['organization_name'],
+        "start_date": row['start_date'],
+        "end_date": row['end_date'],
+        "hours": row['hours_completed'],
+        "issued_date": issued_date
+    }
+
+
+def encode(data):
+    """Kanoniczny tekst zapisu i jego skrót SHA-256 (hex)"""
+    text = json.dumps(data, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return text, hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def insert(cursor, row, issued_date):
+    """Zapisz zaświadczenie dla uczestnictwa; zwraca (id, skrót)"""
+    text, content_hash = encode(payload(row, issued_date))
+    cursor.execute("""
+        INSERT INTO certificates
+        (participation_id, volunteer_id, organization_id, issued_date,
+         hours_completed, certificate_data, content_hash)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, (row['participation_id'], row['volunteer_id'], row['organization_id'],
+          issued_date, row['hours_completed'], text, content_hash))
+    return cursor.lastrowid, content_hash
+
+
+def verify(cursor, content_hash):
+    """Zaświadczenie o podanym skrócie albo None (odczyt po unikalnym indeksie)"""
+    cursor.execute("""
+        SELECT id, issued_date, certificate_data, content_hash
+        FROM certificates
+        WHERE content_hash = ?
+    """, (content_hash.lower(),))
+    row = cursor.fetchone()
+    if row is None:
+        return None
+
+    # Zapis musi nadal odpowiadać skrótowi - inaczej został zmieniony po wydaniu
+    _, actual_hash = encode(json.loads(row['certificate_data']))
+    return {
+        "certificate_id": row['id'],
+        "valid": actual_hash == row['content_hash'],
+        "issued_date": row['issued_date'],
+        "certificate": json.loads(row['certificate_data'])
+    }
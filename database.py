@@ -0,0 +1,159 @@
+"""
+Połączenia z bazą SQLite.
+
+Endpointy pobierają połączenie przez get_db() i oddają je przez close(), tak jak
+wcześniej - z tą różnicą, że close() zwraca połączenie do puli zamiast je
+zamykać. Dzięki temu plik bazy, pamięć podręczna stron i skompilowane
+zapytania (statement cache) pozostają ciepłe między żądaniami.
+
+Każde połączenie działa w trybie WAL z busy_timeout, a transakcje zapisu
+zaczynają się od BEGIN IMMEDIATE - kilka procesów może więc współdzielić jeden
+plik bazy: czytelnicy nie blokują piszących, a piszący czekają na swoją kolej
+zamiast zgłaszać "database is locked".
+"""
+
+import contextvars
+import os
+import queue
+import sqlite3
+from contextlib import contextmanager
+from datetime import date
+
+import tracing
+
+DATABASE_PATH = os.environ.get("VOLUNTEER_DB", "volunteer.db")
+
+# Liczba połączeń utrzymywanych w puli; przy większym ruchu tworzone są dodatkowe
+POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "8"))
+
+# Jak długo (ms) czekać na blokadę zapisu trzymaną przez inny proces
+BUSY_TIMEOUT_MS = int(os.environ.get("DB_BUSY_TIMEOUT_MS", "5000"))
+
+# Pojemność pamięci podręcznej skompilowanych zapytań każdego połączenia; musi
+# pomieścić wszystkie teksty SQL aplikacji (test_queries.py), domyślnie sqlite3 ma 128
+CACHED_STATEMENTS = int(os.environ.get("DB_CACHED_STATEMENTS", "512"))
+
+# Kolumny *_day przechowują daty jako liczbę dni od 1970-01-01
+EPOCH = date(1970, 1, 1)
+
+# Połączenie przypięte do bieżącego kontekstu (rozgrzewka, wspólny odczyt)
+_pinned = contextvars.ContextVar("pinned_connection", default=None)
+
+
+def to_day(value):
+    """Data (date lub tekst ISO) jako numer dnia używany w kolumnach *_day"""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = date.fromisoformat(value[:10])
+    return (value - EPOCH).days
+
+
+class PooledConnection(sqlite3.Connection):
+    """Połączenie, którego close() oddaje je do puli"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pool = None
+
+    def cursor(self, factory=sqlite3.Cursor):
+        # W śledzonym żądaniu kursor zapisuje spany zapytań (tracing.py)
+        return super().cursor(tracing.cursor_factory(factory))
+
+    def close(self):
+        if _pinned.get() is self:
+            return
+        if self.pool is not None:
+            self.pool.release(self)
+        else:
+            super().close()
+
+    def dispose(self):
+        """Faktycznie zamknij połączenie"""
+        sqlite3.Connection.close(self)
+
+
+def connect(path=None):
+    """Otwórz nowe połączenie skonfigurowane dla aplikacji"""
+    conn = sqlite3.connect(path or DATABASE_PATH, factory=PooledConnection,
+                           check_same_thread=False, isolation_level="IMMEDIATE",
+                           cached_statements=CACHED_STATEMENTS)
+    conn.row_factory = sqlite3.Row
+    conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    return conn
+
+
+class ConnectionPool:
+    def __init__(self, path, size):
+        self.path = path
+        self.size = size
+        self._idle = queue.LifoQueue(maxsize=size)
+
+    def _new_connection(self):
+        conn = connect(self.path)
+        conn.pool = self
+        return conn
+
+    def acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return self._new_connection()
+
+    def release(self, conn):
+        # Niezatwierdzone zmiany nie mogą przejść do następnego żądania
+        if conn.in_transaction:
+            conn.rollback()
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.dispose()
+
+    def open(self):
+        """Otwórz z góry wszystkie połączenia puli"""
+        while not self._idle.full():
+            conn = self._new_connection()
+            try:
+                self._idle.put_nowait(conn)
+            except queue.Full:
+                # Połączenie oddane w międzyczasie przez inny wątek zapełniło pulę
+                conn.dispose()
+                break
+
+    def drain(self):
+        """Pobierz wszystkie bezczynne połączenia (do rozgrzewki lub zamknięcia)"""
+        connections = []
+        while True:
+            try:
+                connections.append(self._idle.get_nowait())
+            except queue.Empty:
+                return connections
+
+    def close_all(self):
+        for conn in self.drain():
+            conn.dispose()
+
+
+pool = ConnectionPool(DATABASE_PATH, POOL_SIZE)
+
+
+def get_db():
+    pinned = _pinned.get()
+    if pinned is not None:
+        return pinned
+    if tracing.current() is None:
+        return pool.acquire()
+    with tracing.span("db.acquire"):
+        return pool.acquire()
+
+
+@contextmanager
+def pinned(conn):
+    """Przypnij połączenie - get_db() w tym kontekście zwraca zawsze je"""
+    token = _pinned.set(conn)
+    try:
+        yield conn
+    finally:
+        _pinned.reset(token)
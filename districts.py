@@ -0,0 +1,91 @@
+"""
+Dzielnice Krakowa jako słownik lokalizacji.
+
+Inicjatywy mają oprócz tekstowej lokalizacji identyfikator dzielnicy
+(district_id). Tekst wpisany przez organizację jest przy zapisie
+rozpoznawany przez tabelę aliasów (district_aliases) - po normalizacji
+(małe litery, bez polskich znaków), więc "Nowa Huta", "nowa huta"
+i "Kraków-Nowa Huta" trafiają do tej samej dzielnicy. Filtr lokalizacji
+w GET /initiatives korzysta z indeksu po district_id zamiast LIKE '%...%'.
+"""
+
+import re
+import unicodedata
+
+import queries
+
+# (nazwa, szerokość, długość geograficzna środka, dodatkowe aliasy)
+DISTRICTS = [
+    ("Stare Miasto", 50.0614, 19.9372, ["Rynek Główny", "Dzielnica I"]),
+    ("Kazimierz", 50.0519, 19.9464, []),
+    ("Podgórze", 50.0345, 19.9495, ["Dzielnica XIII"]),
+    ("Krowodrza", 50.0836, 19.9155, ["Dzielnica V"]),
+    ("Nowa Huta", 50.0705, 20.0340, ["Dzielnica XVIII"]),
+    ("Dębniki", 50.0431, 19.9053, ["Dzielnica VIII"]),
+    ("Prądnik Biały", 50.0957, 19.9395, ["Dzielnica IV"]),
+]
+
+# Litery, których NFKD nie rozkłada na literę bazową i znak diakrytyczny
+_TRANSLITERATION = str.maketrans({"ł": "l", "Ł": "l"})
+
+# Najdłuższy alias w słowach - dłuższych fragmentów tekstu lokalizacji nie szukamy
+MAX_ALIAS_WORDS = 5
+
+# Przedrostki pomijane przy rozpoznawaniu: "Kraków-Podgórze", "Kraków, Kazimierz"
+_CITY_PREFIX = re.compile(r"^krakow\s*[-,]?\s*")
+
+
+def normalize(text):
+    """Klucz aliasu: małe litery, bez polskich znaków i nadmiarowych spacji"""
+    text = unicodedata.normalize("NFKD", text.translate(_TRANSLITERATION))
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    text = re.sub(r"[\s\-_]+", " ", text.lower()).strip()
+    return _CITY_PREFIX.sub("", text)
+
+
+def aliases(name, extra=()):
+    """Aliasy dzielnicy (znormalizowane, bez powtórzeń)"""
+    keys = [normalize(name)] + [normalize(alias) for alias in extra]
+    return list(dict.fromkeys(keys))
+
+
+def _candidates(key):
+    """Klucz i jego fragmenty z kolejnych słów (do MAX_ALIAS_WORDS) - możliwe aliasy"""
+    words = re.sub(r"[^a-z0-9 ]+", " ", key).split()
+    fragments = [key]
+    for start in range(len(words)):
+        for end in range(start + 1, min(start + MAX_ALIAS_WORDS, len(words)) + 1):
+            fragments.append(" ".join(words[start:end]))
+    return list(dict.fromkeys(fragments))
+
+
+def resolve(cursor, location):
+    """Dzielnica (wiersz districts) dla tekstu lokalizacji albo None.
+
+    Dokładne dopasowanie aliasu, a gdy tekst zawiera więcej niż nazwę dzielnicy
+    ("Kazimierz, ul. Szeroka") - najdłuższy alias występujący w nim jako osobne
+    słowa. Fragmenty tekstu są szukane po kluczu głównym district_aliases,
+    bez przeglądania całej tabeli aliasów.
+    """
+    if location is None:
+        return None
+    key = normalize(str(location))
+    if not key:
+        return None
+
+    cursor.execute("""
+        SELECT d.* FROM district_aliases a
+        JOIN districts d ON d.id = a.district_id
+        WHERE a.alias IN (SELECT value FROM json_each(?))
+        ORDER BY length(a.alias) DESC, a.district_id DESC
+        LIMIT 1
+    """, (queries.array(_candidates(key)),))
+    return cursor.fetchone()
+
+
+def lookup(cursor, value):
+    """Dzielnica po identyfikatorze (liczba) lub nazwie / aliasie"""
+    if str(value).strip().isdigit():
+        cursor.execute("SELECT * FROM districts WHERE id = ?", (int(value),))
+        return cursor.fetchone()
+    return resolve(cursor, value)
@@ -0,0 +1,124 @@
+"""
+Pamięć podręczna użytkowników (wolontariuszy, organizacji, koordynatorów).
+
+Profile użytkowników zmieniają się rzadko, a są czytane przy prawie każdym
+żądaniu: walidacja organizacji przy tworzeniu inicjatywy, GET /users/{id}
+i nazwy/adresy dołączane do list zgłoszeń i uczestnictw. UserCache czyta je
+przez pamięć (read-through): brakujące wpisy dociąga jednym zapytaniem dla
+całej listy identyfikatorów i trzyma najwyżej MAX_ENTRIES ostatnio używanych.
+
+Spójność jak w katalogu inicjatyw: triggery zapisują identyfikator każdego
+zmienionego konta w user_changes, a pamięć przed odczytem dociąga numery zmian
+nowsze niż ostatnio widziany i usuwa te wpisy. Wersja wpisu to numer zmiany,
+przy którym został wczytany - wpis z migawki starszej niż stan pamięci (np.
+żądanie zbiorcze) nie jest zapamiętywany. Zmiany z innych workerów są więc
+widoczne bez przeładowania.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+
+import queries
+
+# Najwięcej pamiętanych kont (najdawniej używane są usuwane)
+MAX_ENTRIES = int(os.environ.get("USER_CACHE_SIZE", "10000"))
+
+USERS_QUERY = "SELECT * FROM users WHERE id IN (SELECT value FROM json_each(?))"
+
+
+class UserCache:
+    def __init__(self, max_entries=MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        # id -> (wersja, słownik kolumn), od najdawniej użytego
+        self.entries = OrderedDict()
+        self.last_seq = None
+        self.generation = None
+
+    def sync(self, conn):
+        """Usuń wpisy zmienione od ostatniej synchronizacji; zwraca numer zmiany migawki"""
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT MIN(seq) as first_seq, MAX(seq) as last_seq,
+                   (SELECT generation FROM database_generation) as generation
+            FROM user_changes
+        """)
+        bounds = cursor.fetchone()
+        first_seq = bounds['first_seq'] or 0
+        last_seq = bounds['last_seq'] or 0
+        generation = bounds['generation']
+
+        with self._lock:
+            # Pierwsze użycie, baza przywrócona z kopii albo część dziennika zmian usunięta
+            if (generation != self.generation or self.last_seq is None
+                    or self.last_seq < first_seq - 1):
+                self._reset()
+                self.last_seq = last_seq
+                self.generation = generation
+                return last_seq
+            if last_seq <= self.last_seq:
+                return last_seq
+            since = self.last_seq
+
+        cursor.execute("""
+            SELECT DISTINCT user_id FROM user_changes
+            WHERE seq > ? AND seq <= ?
+        """, (since, last_seq))
+        changed = [row['user_id'] for row in cursor.fetchall()]
+
+        with self._lock:
+            for user_id in changed:
+                self.entries.pop(user_id, None)
+            self.last_seq = max(self.last_seq, last_seq)
+        return last_seq
+
+    def get_many(self, conn, user_ids):
+        """{id: użytkownik} dla istniejących kont spośród user_ids"""
+        seq = self.sync(conn)
+        found = {}
+        missing = []
+        with self._lock:
+            for user_id in set(user_ids):
+                entry = self.entries.get(user_id)
+                if entry is None:
+                    missing.append(user_id)
+                else:
+                    self.entries.move_to_end(user_id)
+                    found[user_id] = dict(entry[1])
+        if not missing:
+            return found
+
+        cursor = conn.cursor()
+        cursor.execute(USERS_QUERY, (queries.array(missing),))
+        rows = [dict(row) for row in cursor.fetchall()]
+
+        with self._lock:
+            # Migawka starsza niż pamięć mogła nie widzieć zmian, które już usunęliśmy
+            cacheable = seq == self.last_seq
+            for user in rows:
+                found[user['id']] = user
+                if cacheable:
+                    self.entries[user['id']] = (seq, dict(user))
+                    self.entries.move_to_end(user['id'])
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return found
+
+    def get(self, conn, user_id):
+        return self.get_many(conn, (user_id,)).get(user_id)
+
+    def enrich(self, conn, rows, key, fields):
+        """Dopisz do wierszy pola konta wskazanego kolumną `key` ({pole wiersza: kolumna users})"""
+        users = self.get_many(conn, (row[key] for row in rows if row[key] is not None))
+        for row in rows:
+            user = users.get(row[key])
+            for target, column in fields.items():
+                row[target] = user[column] if user else None
+        return rows
+
+
+user_cache = UserCache()
@@ -0,0 +1,172 @@
+"""
+Strumień zmian (Server-Sent Events) dla organizacji i wolontariuszy.
+
+Zdarzenia zapisywane są w tabeli event_log w tej samej transakcji co zmiana
+stanu. Lokalny broker jedynie budzi otwarte strumienie po zatwierdzeniu
+transakcji - źródłem prawdy pozostaje tabela, dzięki czemu klient może wznowić
+strumień nagłówkiem Last-Event-ID i nie zgubić żadnej zmiany.
+"""
+
+import asyncio
+import json
+import threading
+
+from starlette.concurrency import run_in_threadpool
+
+# Maksymalna liczba zdarzeń przechowywanych w event_log
+EVENT_LOG_SIZE = 10000
+
+# Co ile sekund strumień sprawdza bazę bez powiadomienia (zapisy z innych procesów)
+POLL_INTERVAL = 2.0
+
+# Co ile sekund wysyłany jest komentarz podtrzymujący połączenie
+KEEPALIVE_INTERVAL = 15.0
+
+# Ile zdarzeń pobieramy jednym zapytaniem
+BATCH_SIZE = 500
+
+INITIATIVES_CHANNEL = "initiatives"
+
+
+def organization_channel(org_id):
+    return f"organization:{org_id}"
+
+
+def volunteer_channel(volunteer_id):
+    return f"volunteer:{volunteer_id}"
+
+
+def publish(cursor, channel, event_type, data):
+    """Zapisz zdarzenie w bieżącej transakcji (wywołać przed commit)"""
+    cursor.execute("""
+        INSERT INTO event_log (channel, event_type, payload)
+        VALUES (?, ?, ?)
+    """, (channel, event_type, json.dumps(data, ensure_ascii=False)))
+
+    # Dziennik jest ograniczony - usuwamy zdarzenia starsze niż EVENT_LOG_SIZE
+    cursor.execute("DELETE FROM event_log WHERE id <= ?",
+                   (cursor.lastrowid - EVENT_LOG_SIZE,))
+    return channel
+
+
+class EventBroker:
+    """Powiadamia strumienie w tym procesie o nowych zdarzeniach na kanałach"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = {}
+
+    def subscribe(self, channels):
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+        with self._lock:
+            for channel in channels:
+                self._subscribers.setdefault(channel, set()).add(waiter)
+        return waiter
+
+    def unsubscribe(self, channels, waiter):
+        with self._lock:
+            for channel in channels:
+                waiters = self._subscribers.get(channel)
+                if waiters is None:
+                    continue
+                waiters.discard(waiter)
+                if not waiters:
+                    del self._subscribers[channel]
+
+    def notify(self, *channels):
+        """Obudź strumienie nasłuchujące na kanałach (wywołać po commit)"""
+        with self._lock:
+            waiters = set()
+            for channel in channels:
+                waiters.update(self._subscribers.get(channel, ()))
+
+        for loop, event in waiters:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                # Pętla zdarzeń już zamknięta
+                pass
+
+
+broker = EventBroker()
+
+
+def _format_event(event_id, event_type, payload):
+    return f"id: {event_id}\nevent: {event_type}\ndata: {payload}\n\n"
+
+
+def _fetch_events(get_db, channels, last_id):
+    conn = get_db()
+    cursor = conn.cursor()
+
+    placeholders = ", ".join("?" for _ in channels)
+    cursor.execute(f"""
+        SELECT id, event_type, payload
+        FROM event_log
+        WHERE channel IN ({placeholders}) AND id > ?
+        ORDER BY id
+        LIMIT ?
+    """, (*channels, last_id, BATCH_SIZE))
+
+    events = cursor.fetchall()
+    conn.close()
+    return events
+
+
+def _resolve_start(get_db, last_event_id):
+    """Zwróć (id startowe, czy część historii została już usunięta)"""
+    conn = get_db()
+    cursor = conn.cursor()
+
+    cursor.execute("SELECT MIN(id) as first_id, MAX(id) as last_id FROM event_log")
+    bounds = cursor.fetchone()
+    conn.close()
+
+    first_id = bounds['first_id'] or 0
+    last_id = bounds['last_id'] or 0
+
+    if last_event_id is None:
+        return last_id, False
+
+    return last_event_id, first_id > 0 and last_event_id < first_id - 1
+
+
+async def stream(get_db, channels, last_event_id=None):
+    """Generator SSE dla podanych kanałów, wznawiany od last_event_id"""
+    try:
+        last_event_id = int(last_event_id) if last_event_id is not None else None
+    except ValueError:
+        last_event_id = None
+
+    last_id, gap = await run_in_threadpool(_resolve_start, get_db, last_event_id)
+
+    waiter = broker.subscribe(channels)
+    wakeup = waiter[1]
+    try:
+        yield "retry: 3000\n\n"
+
+        if gap:
+            # Część zdarzeń wypadła z dziennika - klient musi pobrać stan od nowa
+            yield _format_event(last_id, "reset", json.dumps({"reason": "event_log_truncated"}))
+
+        idle = 0.0
+        while True:
+            wakeup.clear()
+            events = await run_in_threadpool(_fetch_events, get_db, channels, last_id)
+            for row in events:
+                last_id = row['id']
+                yield _format_event(row['id'], row['event_type'], row['payload'])
+
+            if len(events) == BATCH_SIZE:
+                continue
+
+            try:
+                await asyncio.wait_for(wakeup.wait(), timeout=POLL_INTERVAL)
+                idle = 0.0
+            except asyncio.TimeoutError:
+                idle += POLL_INTERVAL
+                if idle >= KEEPALIVE_INTERVAL:
+                    idle = 0.0
+                    yield ": keepalive\n\n"
+    finally:
+        broker.unsubscribe(channels, waiter)
@@ -0,0 +1,271 @@
+"""
+Księga godzin wolontariatu.
+
+Każda zmiana zaliczonych godzin (uczestnictwo ze statusem completed) jest
+dopisywana do hours_ledger jako różnica względem poprzedniego stanu, a w tej
+samej transakcji aktualizowane są sumy bieżące w hours_totals (wolontariusz,
+szkoła, organizacja, cała platforma) i rozbicie wolontariusza na kategorie
+i miesiące w hours_breakdown. Raporty i statystyki czytają gotowe sumy zamiast
+sumować participations przy każdym żądaniu.
+
+Reconciler porównuje sumy z księgą partiami (kolejne identyfikatory zakresów,
+każda partia w osobnej transakcji) i poprawia tylko rozbieżne wiersze -
+harmonogram nie przelicza wszystkiego naraz (rebuild) pod blokadą zapisu.
+"""
+
+VOLUNTEER = "volunteer"
+SCHOOL = "school"
+ORGANIZATION = "organization"
+PLATFORM = "platform"
+
+# scope_id sumy dla całej platformy
+PLATFORM_ID = 0
+
+# Kolumna księgi dla każdego zakresu, w kolejności sprawdzania przez Reconciler
+SCOPE_COLUMNS = ((VOLUNTEER, "volunteer_id"), (SCHOOL, "school_id"), (ORGANIZATION, "organization_id"))
+
+PARTICIPATION_QUERY = """
+    SELECT p.id, p.volunteer_id, p.initiative_id, p.status, p.hours_completed,
+           i.organization_id, i.category, i.end_date, i.end_day, i.district_id, u.school_id
+    FROM participations p
+    JOIN initiatives i ON p.initiative_id = i.id
+    JOIN users u ON p.volunteer_id = u.id
+    WHERE p.id = ?
+"""
+
+
+def credited_hours(status, hours_completed):
+    """Godziny zaliczane uczestnictwu: tylko ukończone się liczą"""
+    return (hours_completed or 0) if status == "completed" else 0
+
+
+def _add_to_totals(cursor, scope, scope_id, hours, completed):
+    cursor.execute("""
+        INSERT INTO hours_totals (scope, scope_id, hours, completed)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT(scope, scope_id) DO UPDATE SET
+            hours = hours + excluded.hours,
+            completed = completed + excluded.completed
+    """, (scope, scope_id, hours, completed))
+
+
+def record(cursor, participation_id, previous_status, previous_hours, reason):
+    """Zapisz w księdze zmianę godzin uczestnictwa (po jego aktualizacji).
+
+    previous_status / previous_hours to stan sprzed zmiany. Zwraca różnicę
+    godzin albo None, jeśli zmiana nie wpływa na zaliczone godziny.
+    """
+    cursor.execute(PARTICIPATION_QUERY, (participation_id,))
+    current = cursor.fetchone()
+
+    delta = (credited_hours(current['status'], current['hours_completed'])
+             - credited_hours(previous_status, previous_hours))
+    completed = int(current['status'] == "completed") - int(previous_status == "completed")
+    if not delta and not completed:
+        return None
+
+    month = current['end_date'][:7]
+    cursor.execute("""
+        INSERT INTO hours_ledger
+        (participation_id, volunteer_id, school_id, organization_id, initiative_id,
+         category, district_id, month, day, hours, completed, reason)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, (participation_id, current['volunteer_id'], current['school_id'],
+          current['organization_id'], current['initiative_id'], current['category'],
+          current['district_id'], month, current['end_day'], delta, completed, reason))
+
+    _add_to_totals(cursor, VOLUNTEER, current['volunteer_id'], delta, completed)
+    if current['school_id'] is not None:
+        _add_to_totals(cursor, SCHOOL, current['school_id'], delta, completed)
+    _add_to_totals(cursor, ORGANIZATION, current['organization_id'], delta, completed)
+    _add_to_totals(cursor, PLATFORM, PLATFORM_ID, delta, completed)
+
+    cursor.execute("""
+        INSERT INTO hours_breakdown (volunteer_id, category, month, hours)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT(volunteer_id, category, month) DO UPDATE SET
+            hours = hours + excluded.hours
+    """, (current['volunteer_id'], current['category'], month, delta))
+    return delta
+
+
+def totals(cursor, scope, scope_id):
+    """Suma godzin i liczba ukończonych uczestnictw dla zakresu"""
+    cursor.execute("SELECT hours, completed FROM hours_totals WHERE scope = ? AND scope_id = ?",
+                   (scope, scope_id))
+    row = cursor.fetchone()
+    if row is None:
+        return {"hours": 0, "completed": 0}
+    return {"hours": row['hours'], "completed": row['completed']}
+
+
+def rebuild(cursor):
+    """Przelicz sumy od nowa na podstawie księgi (np. po ręcznej naprawie danych)"""
+    cursor.execute("DELETE FROM hours_totals")
+    cursor.execute("DELETE FROM hours_breakdown")
+    for scope, column in ((VOLUNTEER, "volunteer_id"), (SCHOOL, "school_id"),
+                          (ORGANIZATION, "organization_id")):
+        cursor.execute(f"""
+            INSERT INTO hours_totals (scope, scope_id, hours, completed)
+            SELECT ?, {column}, SUM(hours), SUM(completed)
+            FROM hours_ledger
+            WHERE {column} IS NOT NULL
+            GROUP BY {column}
+        """, (scope,))
+    cursor.execute("""
+        INSERT INTO hours_totals (scope, scope_id, hours, completed)
+        SELECT ?, ?, COALESCE(SUM(hours), 0), COALESCE(SUM(completed), 0)
+        FROM hours_ledger
+    """, (PLATFORM, PLATFORM_ID))
+    cursor.execute("""
+        INSERT INTO hours_breakdown (volunteer_id, category, month, hours)
+        SELECT volunteer_id, category, month, SUM(hours)
+        FROM hours_ledger
+        GROUP BY volunteer_id, category, month
+    """)
+
+
+def _next_ids(cursor, scope, column, after, limit):
+    """Kolejne `limit` identyfikatorów zakresu (z sum albo z księgi) większych niż after"""
+    cursor.execute("""
+        SELECT scope_id FROM hours_totals WHERE scope = ? AND scope_id > ?
+        ORDER BY scope_id LIMIT ?
+    """, (scope, after, limit))
+    ids = {row[0] for row in cursor.fetchall()}
+    cursor.execute(f"""
+        SELECT DISTINCT {column} FROM hours_ledger WHERE {column} > ?
+        ORDER BY {column} LIMIT ?
+    """, (after, limit))
+    ids.update(row[0] for row in cursor.fetchall())
+    return sorted(ids)[:limit]
+
+
+def _reconcile_rows(cursor, expected, current, upsert, delete):
+    """Popraw wiersze różniące się od oczekiwanych ({klucz: wartości}); zwraca liczbę poprawek"""
+    changed = [key + values for key, values in expected.items() if current.get(key) != values]
+    extra = [key for key in current if key not in expected]
+    if changed:
+        cursor.executemany(upsert, changed)
+    if extra:
+        cursor.executemany(delete, extra)
+    return len(changed) + len(extra)
+
+
+def reconcile(cursor, scope, after, limit):
+    """Porównaj z księgą sumy najwyżej `limit` zakresów o scope_id > after i popraw rozbieżne.
+
+    Zwraca (sprawdzone identyfikatory, liczba poprawionych wierszy).
+    """
+    column = dict(SCOPE_COLUMNS)[scope]
+    ids = _next_ids(cursor, scope, column, after, limit)
+    if not ids:
+        return ids, 0
+    bounds = (ids[0], ids[-1])
+
+    cursor.execute(f"""
+        SELECT {column}, SUM(hours), SUM(completed) FROM hours_ledger
+        WHERE {column} BETWEEN ? AND ?
+        GROUP BY {column}
+    """, bounds)
+    expected = {(scope, row[0]): (row[1], row[2]) for row in cursor.fetchall()}
+    cursor.execute("""
+        SELECT scope_id, hours, completed FROM hours_totals
+        WHERE scope = ? AND scope_id BETWEEN ? AND ?
+    """, (scope, *bounds))
+    current = {(scope, row[0]): (row[1], row[2]) for row in cursor.fetchall()}
+    fixed = _reconcile_rows(cursor, expected, current, """
+        INSERT INTO hours_totals (scope, scope_id, hours, completed) VALUES (?, ?, ?, ?)
+        ON CONFLICT(scope, scope_id) DO UPDATE SET
+            hours = excluded.hours, completed = excluded.completed
+    """, "DELETE FROM hours_totals WHERE scope = ? AND scope_id = ?")
+
+    if scope == VOLUNTEER:
+        cursor.execute("""
+            SELECT volunteer_id, category, month, SUM(hours) FROM hours_ledger
+            WHERE volunteer_id BETWEEN ? AND ?
+            GROUP BY volunteer_id, category, month
+        """, bounds)
+        expected = {tuple(row[:3]): (row[3],) for row in cursor.fetchall()}
+        cursor.execute("""
+            SELECT volunteer_id, category, month, hours FROM hours_breakdown
+            WHERE volunteer_id BETWEEN ? AND ?
+        """, bounds)
+        current = {tuple(row[:3]): (row[3],) for row in cursor.fetchall()}
+        fixed += _reconcile_rows(cursor, expected, current, """
+            INSERT INTO hours_breakdown (volunteer_id, category, month, hours) VALUES (?, ?, ?, ?)
+            ON CONFLICT(volunteer_id, category, month) DO UPDATE SET hours = excluded.hours
+        """, "DELETE FROM hours_breakdown WHERE volunteer_id = ? AND category = ? AND month = ?")
+    return ids, fixed
+
+
+def reconcile_platform(cursor):
+    """Suma platformy jako suma organizacji (każdy wpis księgi ma organizację); zwraca 0 lub 1"""
+    cursor.execute("""
+        SELECT COALESCE(SUM(hours), 0), COALESCE(SUM(completed), 0) FROM hours_totals
+        WHERE scope = ?
+    """, (ORGANIZATION,))
+    expected = {(PLATFORM, PLATFORM_ID): tuple(cursor.fetchone())}
+    cursor.execute("SELECT hours, completed FROM hours_totals WHERE scope = ? AND scope_id = ?",
+                   (PLATFORM, PLATFORM_ID))
+    row = cursor.fetchone()
+    current = {(PLATFORM, PLATFORM_ID): tuple(row)} if row is not None else {}
+    return _reconcile_rows(cursor, expected, current, """
+        INSERT INTO hours_totals (scope, scope_id, hours, completed) VALUES (?, ?, ?, ?)
+        ON CONFLICT(scope, scope_id) DO UPDATE SET
+            hours = excluded.hours, completed = excluded.completed
+    """, "DELETE FROM hours_totals WHERE scope = ? AND scope_id = ?")
+
+
+class Reconciler:
+    """Sprawdzanie sum partiami; kolejne wywołania step() przechodzą przez wszystkie zakresy"""
+
+    def __init__(self):
+        self._reset()
+
+    def _reset(self):
+        # Zakres z SCOPE_COLUMNS i ostatni sprawdzony identyfikator (identyfikatory są dodatnie)
+        self.scope_index = 0
+        self.after = 0
+
+    def step(self, cursor, limit):
+        """Sprawdź najwyżej `limit` zakresów; zwraca (sprawdzone, poprawione).
+
+        Mniej sprawdzonych niż `limit` oznacza koniec przebiegu - następne
+        wywołanie zaczyna od początku.
+        """
+        checked = 0
+        fixed = 0
+        while checked < limit:
+            if self.scope_index == len(SCOPE_COLUMNS):
+                fixed += reconcile_platform(cursor)
+                self._reset()
+                break
+            wanted = limit - checked
+            scope = SCOPE_COLUMNS[self.scope_index][0]
+            ids, scope_fixed = reconcile(cursor, scope, self.after, wanted)
+            checked += len(ids)
+            fixed += scope_fixed
+            if len(ids) < wanted:
+                self.scope_index += 1
+                self.after = 0
+            else:
+                self.after = ids[-1]
+        return checked, fixed
+
+
+def backfill(cursor, reason="backfill"):
+    """Dopisz do księgi ukończone uczestnictwa, których w niej jeszcze nie ma, i przelicz sumy"""
+    cursor.execute("""
+        INSERT INTO hours_ledger
+        (participation_id, volunteer_id, school_id, organization_id, initiative_id,
+         category, district_id, month, day, hours, completed, reason)
+        SELECT p.id, p.volunteer_id, u.school_id, i.organization_id, p.initiative_id,
+               i.category, i.district_id, substr(i.end_date, 1, 7), i.end_day,
+               COALESCE(p.hours_completed, 0), 1, ?
+        FROM participations p
+        JOIN initiatives i ON p.initiative_id = i.id
+        JOIN users u ON p.volunteer_id = u.id
+        WHERE p.status = 'completed'
+          AND p.id NOT IN (SELECT participation_id FROM hours_ledger)
+    """, (reason,))
+    rebuild(cursor)
@@ -0,0 +1,293 @@
+"""
+Klucze idempotencji (nagłówek Idempotency-Key) dla żądań zapisu.
+
+Klient mobilny ponawiający POST z tym samym kluczem dostaje zapisaną
+odpowiedź pierwszego wykonania - endpoint nie jest wywoływany ponownie, więc
+nie powstają duplikaty inicjatyw, zgłoszeń ani zaświadczeń. Klucz obowiązuje
+w obrębie klienta (admission.client_key: znany klucz API albo adres IP) - ten sam
+nagłówek od innego klienta nie odtwarza cudzej odpowiedzi. Odpowiedzi są
+przechowywane w tabeli idempotency_keys (wspólnej dla wszystkich workerów)
+przez IDEMPOTENCY_TTL_SECONDS; wygasłe wpisy są usuwane okresowo.
+
+Równoczesne żądania z tym samym kluczem są łączone: pierwsze rezerwuje klucz
+i wykonuje endpoint, pozostałe czekają na jego odpowiedź (w tym samym procesie
+przez asyncio.Event, z innych procesów przez odpytywanie tabeli).
+
+Odpowiedź jest zapisywana osobną transakcją, już po zatwierdzeniu zmian przez
+endpoint. Jeśli proces padnie pomiędzy tymi commitami, rezerwacja wygaśnie po
+LOCK_SECONDS, a ponowienie z tym samym kluczem wykona żądanie jeszcze raz -
+w tym (krótkim) oknie gwarancja jest "co najmniej raz", nie "dokładnie raz".
+
+Treść żądania jest buforowana (potrzebna do odcisku i odtworzenia), więc
+obsługujemy tylko treści do MAX_BODY_BYTES (większe - 413). Przesyłanie plików
+(multipart/form-data) idzie strumieniowo z pominięciem idempotencji.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import time
+
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse
+
+import admission
+
+HEADER = b"idempotency-key"
+CONTENT_TYPE = b"content-type"
+CONTENT_LENGTH = b"content-length"
+
+# Treści tego typu nie są buforowane (przesyłanie plików) - nagłówek jest pomijany
+STREAMED_TYPES = (b"multipart/form-data",)
+
+# Metody, dla których nagłówek jest obsługiwany
+METHODS = {"POST", "PUT"}
+
+# Jak długo przechowywana jest odpowiedź (domyślnie doba)
+TTL_SECONDS = float(os.environ.get("IDEMPOTENCY_TTL_SECONDS", "86400"))
+
+# Rezerwacja klucza wygasa po tym czasie (np. gdy worker padł w trakcie żądania)
+LOCK_SECONDS = 30.0
+
+# Co ile sekund usuwane są wygasłe wpisy
+SWEEP_INTERVAL = 300.0
+
+# Co ile sekund żądanie oczekujące sprawdza tabelę (klucz zarezerwowany w innym procesie)
+POLL_INTERVAL = 0.05
+
+MAX_KEY_LENGTH = 255
+
+# Największa buforowana treść żądania z nagłówkiem Idempotency-Key (domyślnie 1 MiB)
+MAX_BODY_BYTES = int(os.environ.get("IDEMPOTENCY_MAX_BODY_BYTES", str(1024 * 1024)))
+
+
+def _claim(get_db, key, fingerprint, now):
+    """Zarezerwuj klucz; zwraca None (zarezerwowany) albo istniejący wpis"""
+    conn = get_db()
+    cursor = conn.cursor()
+    try:
+        # Wolny jest klucz nowy, wygasły albo porzucony w trakcie wykonania
+        cursor.execute("""
+            INSERT INTO idempotency_keys
+            (key, fingerprint, state, locked_until, expires_at, created_at)
+            VALUES (?, ?, 'pending', ?, ?, ?)
+            ON CONFLICT(key) DO UPDATE SET
+                fingerprint = excluded.fingerprint,
+                state = 'pending',
+                status_code = NULL,
+                headers = NULL,
+                body = NULL,
+                locked_until = excluded.locked_until,
+                expires_at = excluded.expires_at,
+                created_at = excluded.created_at
+            WHERE idempotency_keys.expires_at < excluded.created_at
+               OR (idempotency_keys.state = 'pending'
+                   AND idempotency_keys.locked_until < excluded.created_at)
+        """, (key, fingerprint, now + LOCK_SECONDS, now + TTL_SECONDS, now))
+        claimed = cursor.rowcount == 1
+        conn.commit()
+        if claimed:
+            return None
+        cursor.execute("SELECT * FROM idempotency_keys WHERE key = ?", (key,))
+        return cursor.fetchone()
+    finally:
+        conn.close()
+
+
+def _fetch(get_db, key):
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute("SELECT * FROM idempotency_keys WHERE key = ?", (key,))
+    row = cursor.fetchone()
+    conn.close()
+    return row
+
+
+def _complete(get_db, key, status_code, headers, body):
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute("""
+        UPDATE idempotency_keys
+        SET state = 'done', status_code = ?, headers = ?, body = ?
+        WHERE key = ?
+    """, (status_code, json.dumps(headers), body, key))
+    conn.commit()
+    conn.close()
+
+
+def _release(get_db, key):
+    """Zwolnij klucz bez zapisu odpowiedzi - ponowienie wykona żądanie od nowa"""
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM idempotency_keys WHERE key = ? AND state = 'pending'", (key,))
+    conn.commit()
+    conn.close()
+
+
+def sweep(get_db, now=None):
+    """Usuń wygasłe wpisy; zwraca ich liczbę"""
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM idempotency_keys WHERE expires_at < ?", (now or time.time(),))
+    removed = cursor.rowcount
+    conn.commit()
+    conn.close()
+    return removed
+
+
+async def _read_body(receive, limit=MAX_BODY_BYTES):
+    """(treść, wiadomość po treści); treść None, gdy przekracza limit bajtów"""
+    chunks = []
+    size = 0
+    while True:
+        message = await receive()
+        if message["type"] != "http.request":
+            return b"".join(chunks), message
+        chunk = message.get("body", b"")
+        size += len(chunk)
+        if size > limit:
+            return None, None
+        chunks.append(chunk)
+        if not message.get("more_body", False):
+            return b"".join(chunks), None
+
+
+def _too_large(headers):
+    """Czy zadeklarowana długość treści przekracza MAX_BODY_BYTES"""
+    length = headers.get(CONTENT_LENGTH)
+    return length is not None and length.isdigit() and int(length) > MAX_BODY_BYTES
+
+
+class IdempotencyMiddleware:
+    """Middleware ASGI obsługujące nagłówek Idempotency-Key"""
+
+    def __init__(self, app, get_db):
+        self.app = app
+        self.get_db = get_db
+        # Klucze wykonywane w tym procesie -> zdarzenie zakończenia
+        self._in_flight = {}
+        self._last_sweep = 0.0
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in METHODS:
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope["headers"])
+        header = headers.get(HEADER)
+        if header is None or headers.get(CONTENT_TYPE, b"").lower().startswith(STREAMED_TYPES):
+            await self.app(scope, receive, send)
+            return
+
+        if not header or len(header) > MAX_KEY_LENGTH:
+            await JSONResponse({"detail": "Nieprawidłowy nagłówek Idempotency-Key"},
+                               status_code=400)(scope, receive, send)
+            return
+
+        body, pending_message = (None, None) if _too_large(headers) else await _read_body(receive)
+        if body is None:
+            await JSONResponse(
+                {"detail": f"Treść żądania z Idempotency-Key przekracza {MAX_BODY_BYTES} bajtów"},
+                status_code=413)(scope, receive, send)
+            return
+        # Klient w kluczu - zapisana odpowiedź (identyfikatory, dane zaświadczeń) trafia tylko do niego
+        key = (f"{admission.client_key(scope)} {scope['method']} {scope['path']} "
+               f"{header.decode('latin-1')}")
+        fingerprint = hashlib.sha256(scope.get("query_string", b"") + b"\0" + body).hexdigest()
+
+        await self._maybe_sweep()
+
+        while True:
+            now = time.time()
+            existing = await run_in_threadpool(_claim, self.get_db, key, fingerprint, now)
+            if existing is None:
+                await self._execute(key, scope, body, pending_message, receive, send)
+                return
+
+            if existing['fingerprint'] != fingerprint:
+                await JSONResponse(
+                    {"detail": "Idempotency-Key został już użyty z inną treścią żądania"},
+                    status_code=422)(scope, receive, send)
+                return
+
+            if existing['state'] == 'done':
+                await self._replay(existing, send)
+                return
+
+            # Klucz wykonywany równolegle - poczekaj na jego odpowiedź
+            finished = await self._wait(key, existing['locked_until'])
+            if finished is not None:
+                await self._replay(finished, send)
+                return
+            # Rezerwacja wygasła albo została zwolniona po błędzie - spróbuj ją przejąć
+
+    async def _execute(self, key, scope, body, pending_message, receive, send):
+        done = self._in_flight[key] = asyncio.Event()
+        sent_body = False
+
+        async def replay_receive():
+            nonlocal sent_body
+            if not sent_body:
+                sent_body = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            if pending_message is not None:
+                return pending_message
+            return await receive()
+
+        response = {"status": None, "headers": [], "body": []}
+
+        async def capture_send(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+                response["headers"] = [[name.decode("latin-1"), value.decode("latin-1")]
+                                       for name, value in message.get("headers", [])]
+            elif message["type"] == "http.response.body":
+                response["body"].append(message.get("body", b""))
+            await send(message)
+
+        stored = False
+        try:
+            await self.app(scope, replay_receive, capture_send)
+            # Błędy serwera nie są zapamiętywane - ponowienie może się udać
+            if response["status"] is not None and response["status"] < 500:
+                await run_in_threadpool(_complete, self.get_db, key, response["status"],
+                                        response["headers"], b"".join(response["body"]))
+                stored = True
+        finally:
+            if not stored:
+                await run_in_threadpool(_release, self.get_db, key)
+            del self._in_flight[key]
+            done.set()
+
+    async def _wait(self, key, locked_until):
+        """Poczekaj na zakończenie klucza; zwraca zapisany wpis albo None"""
+        while time.time() < locked_until:
+            local = self._in_flight.get(key)
+            if local is not None:
+                try:
+                    await asyncio.wait_for(local.wait(), timeout=max(0.0, locked_until - time.time()))
+                except asyncio.TimeoutError:
+                    return None
+            else:
+                await asyncio.sleep(POLL_INTERVAL)
+
+            row = await run_in_threadpool(_fetch, self.get_db, key)
+            if row is None:
+                return None
+            if row['state'] == 'done':
+                return row
+        return None
+
+    async def _replay(self, row, send):
+        headers = [(name.encode("latin-1"), value.encode("latin-1"))
+                   for name, value in json.loads(row['headers'])]
+        headers.append((b"idempotent-replayed", b"true"))
+        await send({"type": "http.response.start", "status": row['status_code'], "headers": headers})
+        await send({"type": "http.response.body", "body": row['body'] or b""})
+
+    async def _maybe_sweep(self):
+        now = time.time()
+        if now - self._last_sweep >= SWEEP_INTERVAL:
+            self._last_sweep = now
+            await run_in_threadpool(sweep, self.get_db, now)
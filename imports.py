@@ -0,0 +1,180 @@
+"""
+Import inicjatyw z pliku CSV lub XLSX (dla organizacji planujących wiele terminów).
+
+Plik jest czytany strumieniowo, wiersz po wierszu - w pamięci jest najwyżej
+jedna porcja CHUNK_SIZE poprawnych wierszy i ograniczona lista błędów, więc
+rozmiar pliku nie wpływa na zużycie pamięci. Każdy wiersz jest sprawdzany
+modelem InitiativeCreate (w tym poprawność i kolejność dat), poprawne trafiają do bazy przez
+executemany - jedna transakcja na porcję. Błędne wiersze są pomijane
+i opisane w raporcie z numerem wiersza pliku (nagłówek to wiersz 1).
+
+Nagłówek pliku to nazwy pól InitiativeCreate (organization_id można pominąć).
+CSV: UTF-8, separator przecinek lub średnik. XLSX wymaga pakietu openpyxl.
+"""
+
+import csv
+import io
+from datetime import date
+
+from pydantic import ValidationError
+
+import districts
+import events
+
+# Liczba wierszy zapisywanych w jednej transakcji
+CHUNK_SIZE = 500
+
+# Ile błędów wierszy zwracamy w raporcie (pozostałe są tylko liczone)
+MAX_REPORTED_ERRORS = 1000
+
+INSERT_QUERY = """
+    INSERT INTO initiatives
+    (title, description, category, location, district_id, latitude, longitude,
+     start_date, end_date, hours_required, spots_available, requirements,
+     organization_id, status)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 'active')
+"""
+
+
+def _csv_rows(file):
+    text = io.TextIOWrapper(file, encoding="utf-8-sig", newline="")
+    try:
+        header = text.readline()
+        # Excel w polskiej wersji zapisuje CSV ze średnikiem
+        delimiter = ";" if header.count(";") > header.count(",") else ","
+        fieldnames = [name.strip() for name in next(csv.reader([header], delimiter=delimiter), [])]
+        if not any(fieldnames):
+            raise ValueError("Plik jest pusty albo nie ma nagłówka")
+        for number, row in enumerate(csv.DictReader(text, fieldnames=fieldnames,
+                                                     delimiter=delimiter), start=2):
+            yield number, row
+    except UnicodeDecodeError:
+        raise ValueError("Plik CSV musi być zapisany w kodowaniu UTF-8")
+    except csv.Error as e:
+        raise ValueError(f"Nieprawidłowy plik CSV: {e}")
+    finally:
+        # Nie zamykamy pliku przesłanego przez klienta razem z nakładką tekstową
+        text.detach()
+
+
+def _xlsx_rows(file):
+    try:
+        import openpyxl
+    except ImportError:
+        raise ValueError("Import plików XLSX wymaga pakietu openpyxl (pip install openpyxl)")
+
+    try:
+        workbook = openpyxl.load_workbook(file, read_only=True, data_only=True)
+    except Exception as e:
+        raise ValueError(f"Nieprawidłowy plik XLSX: {e}")
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            raise ValueError("Plik jest pusty albo nie ma nagłówka")
+        fieldnames = [str(name).strip() if name is not None else "" for name in header]
+        for number, values in enumerate(rows, start=2):
+            if all(value is None for value in values):
+                continue
+            yield number, dict(zip(fieldnames, values))
+    finally:
+        workbook.close()
+
+
+def rows(file, filename):
+    """Wiersze pliku jako (numer wiersza, słownik kolumna -> wartość)"""
+    if (filename or "").lower().endswith(".xlsx"):
+        return _xlsx_rows(file)
+    return _csv_rows(file)
+
+
+def _clean(row):
+    """Puste komórki jako brak wartości, daty z arkusza jako tekst ISO"""
+    cleaned = {}
+    for name, value in row.items():
+        if not name:
+            continue
+        if isinstance(value, str):
+            value = value.strip() or None
+        elif isinstance(value, date):
+            value = value.isoformat()[:10]
+        if value is not None:
+            cleaned[name] = value
+    return cleaned
+
+
+def _validate(model, row, organization_id):
+    """Zwróć (inicjatywa, None) albo (None, lista błędów)"""
+    data = _clean(row)
+    if str(data.setdefault("organization_id", organization_id)) != str(organization_id):
+        return None, ["organization_id: wiersz dotyczy innej organizacji"]
+    try:
+        initiative = model(**data)
+    except ValidationError as e:
+        return None, [f"{'.'.join(str(part) for part in error['loc'])}: {error['msg']}"
+                      for error in e.errors()]
+
+    # Format dat i kolejność start/koniec sprawdza model
+    if initiative.hours_required < 0 or initiative.spots_available < 0:
+        return None, ["hours_required/spots_available: wartość nie może być ujemna"]
+    return initiative, None
+
+
+def import_initiatives(conn, model, file, filename, organization_id):
+    """Zaimportuj inicjatywy organizacji z pliku; zwraca raport importu"""
+    cursor = conn.cursor()
+    locations = {}
+    chunk = []
+    report = {"imported": 0, "failed": 0, "errors": [], "chunks": 0}
+
+    def resolve(location):
+        # Organizacja zwykle powtarza kilka lokalizacji - rozpoznajemy każdą raz
+        if location not in locations:
+            district = districts.resolve(cursor, location)
+            locations[location] = ((district['id'], district['latitude'], district['longitude'])
+                                   if district else (None, None, None))
+        return locations[location]
+
+    def flush():
+        if not chunk:
+            return
+        cursor.executemany(INSERT_QUERY, chunk)
+        # Jedno zdarzenie na porcję zamiast setek initiative.created
+        event = {"organization_id": organization_id, "count": len(chunk)}
+        events.publish(cursor, events.INITIATIVES_CHANNEL, "initiatives.imported", event)
+        events.publish(cursor, events.organization_channel(organization_id),
+                       "initiatives.imported", event)
+        conn.commit()
+        report["imported"] += len(chunk)
+        report["chunks"] += 1
+        chunk.clear()
+
+    def fail(number, errors):
+        report["failed"] += 1
+        if len(report["errors"]) < MAX_REPORTED_ERRORS:
+            report["errors"].append({"row": number, "errors": errors})
+
+    try:
+        for number, row in rows(file, filename):
+            initiative, errors = _validate(model, row, organization_id)
+            if errors:
+                fail(number, errors)
+                continue
+
+            district_id, latitude, longitude = resolve(initiative.location)
+            chunk.append((
+                initiative.title, initiative.description, initiative.category,
+                initiative.location, district_id, latitude, longitude,
+                initiative.start_date.isoformat(), initiative.end_date.isoformat(),
+                initiative.hours_required, initiative.spots_available,
+                initiative.requirements, organization_id
+            ))
+            if len(chunk) >= CHUNK_SIZE:
+                flush()
+    except ValueError as e:
+        # Błąd całego pliku (kodowanie, format) - zapisane porcje pozostają w bazie
+        report["file_error"] = str(e)
+    flush()
+
+    report["errors_truncated"] = report["failed"] > len(report["errors"])
+    return report
@@ -1,13 +1,464 @@
+import json
 import sqlite3
 from datetime import datetime, timedelta
 import random
 
+import certificates
+import districts
+import hours
+import rollups
+from database import DATABASE_PATH
+
+# Wersja schematu zapisywana w PRAGMA user_version; baza bez migracji ma wersję 0
+SCHEMA_VERSION = 15
+
+
+def _migration_1(cursor):
+    """Dziennik zdarzeń dla strumieni SSE"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS event_log (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            channel TEXT NOT NULL,
+            event_type TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_event_log_channel ON event_log(channel, id)")
+
+
+def _migration_2(cursor):
+    """Outbox powiadomień zapisywany w transakcji zmiany stanu"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            recipient_id INTEGER NOT NULL,
+            payload TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending' CHECK(status IN ('pending', 'sent', 'failed')),
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL,
+            locked_until REAL,
+            last_error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            sent_at TIMESTAMP,
+            FOREIGN KEY (recipient_id) REFERENCES users(id)
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox(status, next_attempt_at)")
+
+
+def _migration_3(cursor):
+    """Dziennik zmian inicjatyw dla katalogu w pamięci (wypełniany triggerami)"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS initiative_changes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            initiative_id INTEGER NOT NULL
+        )
+    """)
+    for event, row in (("INSERT", "NEW"), ("UPDATE", "NEW"), ("DELETE", "OLD")):
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_initiatives_{event.lower()}_change
+            AFTER {event} ON initiatives
+            BEGIN
+                INSERT INTO initiative_changes (initiative_id) VALUES ({row}.id);
+            END
+        """)
+    # Zmiana nazwy lub adresu organizacji zmienia też wiersze katalogu
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_users_organization_change
+        AFTER UPDATE OF name, email ON users
+        WHEN NEW.user_type = 'organization'
+        BEGIN
+            INSERT INTO initiative_changes (initiative_id)
+            SELECT id FROM initiatives WHERE organization_id = NEW.id;
+        END
+    """)
+    # Dziennik jest ograniczony do ostatnich 10 000 zmian
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_initiative_changes_trim
+        AFTER INSERT ON initiative_changes
+        BEGIN
+            DELETE FROM initiative_changes WHERE seq <= NEW.seq - 10000;
+        END
+    """)
+
+
+# Numer dnia od 1970-01-01 (tak jak database.to_day) wyliczany w SQL
+def _day_sql(column):
+    return f"CAST(julianday(date({column})) - 2440587.5 AS INTEGER)"
+
+
+def _migration_4(cursor):
+    """Daty jako liczby całkowite (dni) z indeksami pod zapytania o przedziały"""
+    cursor.execute("ALTER TABLE initiatives ADD COLUMN start_day INTEGER")
+    cursor.execute("ALTER TABLE initiatives ADD COLUMN end_day INTEGER")
+    cursor.execute("ALTER TABLE participations ADD COLUMN applied_day INTEGER")
+
+    cursor.execute(f"""
+        UPDATE initiatives
+        SET start_day = {_day_sql('start_date')}, end_day = {_day_sql('end_date')}
+    """)
+    cursor.execute(f"UPDATE participations SET applied_day = {_day_sql('applied_date')}")
+
+    # Kolumny *_day są utrzymywane triggerami, więc żaden zapis ich nie pominie
+    for event in ("INSERT", "UPDATE OF start_date, end_date"):
+        name = event.split()[0].lower()
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_initiatives_{name}_days
+            AFTER {event} ON initiatives
+            BEGIN
+                UPDATE initiatives
+                SET start_day = {_day_sql('NEW.start_date')}, end_day = {_day_sql('NEW.end_date')}
+                WHERE id = NEW.id;
+            END
+        """)
+    for event in ("INSERT", "UPDATE OF applied_date"):
+        name = event.split()[0].lower()
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_participations_{name}_day
+            AFTER {event} ON participations
+            BEGIN
+                UPDATE participations SET applied_day = {_day_sql('NEW.applied_date')}
+                WHERE id = NEW.id;
+            END
+        """)
+
+    # Nakładanie się przedziałów: start_day <= :to AND end_day >= :from
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_initiatives_days ON initiatives(start_day, end_day)")
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_initiatives_organization_days
+        ON initiatives(organization_id, start_day, end_day)
+    """)
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_participations_status_applied
+        ON participations(status, applied_day)
+    """)
+
+
+def _migration_5(cursor):
+    """Słownik dzielnic z aliasami; inicjatywy wskazują dzielnicę przez district_id"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS districts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT UNIQUE NOT NULL,
+            latitude REAL NOT NULL,
+            longitude REAL NOT NULL
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS district_aliases (
+            alias TEXT PRIMARY KEY,
+            district_id INTEGER NOT NULL,
+            FOREIGN KEY (district_id) REFERENCES districts(id)
+        ) WITHOUT ROWID
+    """)
+    for name, latitude, longitude, extra in districts.DISTRICTS:
+        cursor.execute("INSERT INTO districts (name, latitude, longitude) VALUES (?, ?, ?)",
+                       (name, latitude, longitude))
+        district_id = cursor.lastrowid
+        cursor.executemany("INSERT INTO district_aliases (alias, district_id) VALUES (?, ?)",
+                           [(alias, district_id) for alias in districts.aliases(name, extra)])
+
+    cursor.execute("ALTER TABLE initiatives ADD COLUMN district_id INTEGER REFERENCES districts(id)")
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_initiatives_district
+        ON initiatives(district_id, start_day)
+    """)
+
+    # Istniejące lokalizacje rozpoznajemy tak samo jak przy tworzeniu inicjatywy
+    cursor.execute("SELECT DISTINCT location FROM initiatives")
+    for (location,) in cursor.fetchall():
+        district = districts.resolve(cursor, location)
+        if district is not None:
+            cursor.execute("UPDATE initiatives SET district_id = ? WHERE location = ?",
+                           (district[0], location))
+
+
+def _migration_6(cursor):
+    """Księga godzin z sumami bieżącymi (wolontariusz, szkoła, organizacja, platforma)"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS hours_ledger (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            participation_id INTEGER NOT NULL,
+            volunteer_id INTEGER NOT NULL,
+            school_id INTEGER,
+            organization_id INTEGER NOT NULL,
+            initiative_id INTEGER NOT NULL,
+            category TEXT NOT NULL,
+            month TEXT NOT NULL,
+            hours INTEGER NOT NULL,
+            completed INTEGER NOT NULL DEFAULT 0,
+            reason TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_hours_ledger_participation
+        ON hours_ledger(participation_id)
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS hours_totals (
+            scope TEXT NOT NULL CHECK(scope IN ('volunteer', 'school', 'organization', 'platform')),
+            scope_id INTEGER NOT NULL,
+            hours INTEGER NOT NULL DEFAULT 0,
+            completed INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (scope, scope_id)
+        ) WITHOUT ROWID
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS hours_breakdown (
+            volunteer_id INTEGER NOT NULL,
+            category TEXT NOT NULL,
+            month TEXT NOT NULL,
+            hours INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (volunteer_id, category, month)
+        ) WITHOUT ROWID
+    """)
+    # Ukończone uczestnictwa trafiają do księgi w postaci z tej wersji schematu
+    # (hours.backfill wypełnia już kolumny dodane w migracji 11)
+    cursor.execute("""
+        INSERT INTO hours_ledger
+        (participation_id, volunteer_id, school_id, organization_id, initiative_id,
+         category, month, hours, completed, reason)
+        SELECT p.id, p.volunteer_id, u.school_id, i.organization_id, p.initiative_id,
+               i.category, substr(i.end_date, 1, 7), COALESCE(p.hours_completed, 0), 1, 'backfill'
+        FROM participations p
+        JOIN initiatives i ON p.initiative_id = i.id
+        JOIN users u ON p.volunteer_id = u.id
+        WHERE p.status = 'completed'
+          AND p.id NOT IN (SELECT participation_id FROM hours_ledger)
+    """)
+    hours.rebuild(cursor)
+
+
+def _migration_7(cursor):
+    """Zwarty zapis zaświadczeń i skrót treści z unikalnym indeksem"""
+    cursor.execute("ALTER TABLE certificates ADD COLUMN content_hash TEXT")
+
+    rows = cursor.connection.cursor()
+    rows.row_factory = sqlite3.Row
+    rows.execute("""
+        SELECT c.id, c.participation_id, c.volunteer_id, c.organization_id,
+               c.issued_date, c.hours_completed, c.certificate_data,
+               p.initiative_id, i.title as initiative_title, i.category,
+               i.start_date, i.end_date, v.name as volunteer_name, o.name as organization_name
+        FROM certificates c
+        LEFT JOIN participations p ON c.participation_id = p.id
+        LEFT JOIN initiatives i ON p.initiative_id = i.id
+        LEFT JOIN users v ON c.volunteer_id = v.id
+        LEFT JOIN users o ON i.organization_id = o.id
+    """)
+    for row in rows.fetchall():
+        source = dict(row)
+        # Dotychczasowy zapis był kopią wiersza z chwili wydania - ma pierwszeństwo
+        try:
+            snapshot = json.loads(row['certificate_data'] or "{}")
+        except ValueError:
+            snapshot = {}
+        for key in ("initiative_id", "initiative_title", "category", "start_date",
+                    "end_date", "volunteer_name", "organization_name"):
+            if snapshot.get(key) is not None:
+                source[key] = snapshot[key]
+
+        text, content_hash = certificates.encode(certificates.payload(source, row['issued_date']))
+        cursor.execute("UPDATE certificates SET certificate_data = ?, content_hash = ? WHERE id = ?",
+                       (text, content_hash, row['id']))
+
+    cursor.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_certificates_content_hash
+        ON certificates(content_hash)
+    """)
+
+
+def _migration_8(cursor):
+    """Zapisane odpowiedzi dla nagłówka Idempotency-Key"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS idempotency_keys (
+            key TEXT PRIMARY KEY,
+            fingerprint TEXT NOT NULL,
+            state TEXT NOT NULL CHECK(state IN ('pending', 'done')),
+            status_code INTEGER,
+            headers TEXT,
+            body BLOB,
+            locked_until REAL NOT NULL,
+            expires_at REAL NOT NULL,
+            created_at REAL NOT NULL
+        )
+    """)
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_idempotency_keys_expires
+        ON idempotency_keys(expires_at)
+    """)
+
+
+def _migration_9(cursor):
+    """Harmonogram zadań okresowych: dzierżawa lidera i stan zadań"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS scheduler_leases (
+            name TEXT PRIMARY KEY,
+            owner TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        ) WITHOUT ROWID
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS scheduler_jobs (
+            name TEXT PRIMARY KEY,
+            last_run_at REAL NOT NULL,
+            duration_ms REAL NOT NULL,
+            processed INTEGER NOT NULL,
+            error TEXT
+        ) WITHOUT ROWID
+    """)
+    # Wyszukiwanie aktywnych inicjatyw po dacie zakończenia
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_initiatives_status_end
+        ON initiatives(status, end_day)
+    """)
+
+
+def _migration_10(cursor):
+    """Aktywność kont (synchronizacja list uczniów) i indeks uczniów szkoły"""
+    cursor.execute("ALTER TABLE users ADD COLUMN active INTEGER NOT NULL DEFAULT 1")
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_users_school_type
+        ON users(school_id, user_type)
+    """)
+
+
+def _migration_11(cursor):
+    """Dzień i dzielnica w księdze godzin oraz agregaty czasowe aktywności"""
+    cursor.execute("ALTER TABLE hours_ledger ADD COLUMN day INTEGER")
+    cursor.execute("ALTER TABLE hours_ledger ADD COLUMN district_id INTEGER")
+    cursor.execute("""
+        UPDATE hours_ledger
+        SET day = (SELECT end_day FROM initiatives i WHERE i.id = hours_ledger.initiative_id),
+            district_id = (SELECT district_id FROM initiatives i WHERE i.id = hours_ledger.initiative_id)
+    """)
+    hours.backfill(cursor)
+
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS activity_rollups (
+            grain TEXT NOT NULL CHECK(grain IN ('day', 'week', 'month')),
+            dimension TEXT NOT NULL,
+            key TEXT NOT NULL,
+            bucket INTEGER NOT NULL,
+            hours INTEGER NOT NULL DEFAULT 0,
+            completed INTEGER NOT NULL DEFAULT 0,
+            applications INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (grain, dimension, key, bucket)
+        ) WITHOUT ROWID
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS rollup_state (
+            source TEXT PRIMARY KEY,
+            last_id INTEGER NOT NULL
+        ) WITHOUT ROWID
+    """)
+    rollups.rebuild(cursor)
+
+
+def _migration_12(cursor):
+    """Dziennik zmian kont dla pamięci podręcznej użytkowników (wypełniany triggerami)"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS user_changes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL
+        )
+    """)
+    for event, row in (("INSERT", "NEW"), ("UPDATE", "NEW"), ("DELETE", "OLD")):
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_users_{event.lower()}_change
+            AFTER {event} ON users
+            BEGIN
+                INSERT INTO user_changes (user_id) VALUES ({row}.id);
+            END
+        """)
+    # Dziennik jest ograniczony do ostatnich 10 000 zmian
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_user_changes_trim
+        AFTER INSERT ON user_changes
+        BEGIN
+            DELETE FROM user_changes WHERE seq <= NEW.seq - 10000;
+        END
+    """)
+
+
+def _migration_13(cursor):
+    """Indeksy księgi godzin dla sprawdzania sum partiami (hours.Reconciler)"""
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_hours_ledger_volunteer
+        ON hours_ledger(volunteer_id, category, month, hours, completed)
+    """)
+    for column in ("school_id", "organization_id"):
+        cursor.execute(f"""
+            CREATE INDEX IF NOT EXISTS idx_hours_ledger_{column[:-3]}
+            ON hours_ledger({column}, hours, completed)
+        """)
+
+
+def _migration_14(cursor):
+    """Pokolenie bazy - zmieniane przy przywróceniu kopii (backup.restore), po którym
+    pamięci podręczne wczytują dane od nowa"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS database_generation (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            generation INTEGER NOT NULL
+        )
+    """)
+    cursor.execute("INSERT OR IGNORE INTO database_generation (id, generation) VALUES (1, 0)")
+
+
+def _migration_15(cursor):
+    """Indeks adresów e-mail bez rozróżniania wielkości liter (roster.sync)"""
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_users_email_lower ON users(lower(email))")
+
+
+MIGRATIONS = [
+    (1, _migration_1),
+    (2, _migration_2),
+    (3, _migration_3),
+    (4, _migration_4),
+    (5, _migration_5),
+    (6, _migration_6),
+    (7, _migration_7),
+    (8, _migration_8),
+    (9, _migration_9),
+    (10, _migration_10),
+    (11, _migration_11),
+    (12, _migration_12),
+    (13, _migration_13),
+    (14, _migration_14),
+    (15, _migration_15),
+]
+
+
+def migrate(conn):
+    """Zastosuj brakujące migracje schematu"""
+    cursor = conn.cursor()
+    cursor.execute("BEGIN IMMEDIATE")
+    try:
+        cursor.execute("PRAGMA user_version")
+        version = cursor.fetchone()[0]
+        for target, migration in MIGRATIONS:
+            if target > version:
+                migration(cursor)
+                cursor.execute(f"PRAGMA user_version = {target}")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return max(version, SCHEMA_VERSION)
+
 
 def create_database():
     """Utwórz schemat bazy danych"""
-    conn = sqlite3.connect('volunteer.db')
+    conn = sqlite3.connect(DATABASE_PATH)
     cursor = conn.cursor()
 
+    # Na pustej bazie działa od razu; wolne strony zwalnia maintenance.py
+    cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+
     # Tabela użytkowników
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS users (
@@ -82,6 +533,7 @@ def create_database():
     """)
 
     conn.commit()
+    migrate(conn)
     print("✓ Schemat bazy danych utworzony")
     return conn
 
@@ -174,15 +626,8 @@ def populate_test_data(conn):
     categories = ["Pomoc społeczna", "Ekologia", "Kultura", "Edukacja", "Sport",
                   "Opieka nad zwierzętami", "Pomoc seniorom"]
 
-    locations = [
-        ("Stare Miasto", 50.0614, 19.9372),
-        ("Kazimierz", 50.0519, 19.9464),
-        ("Podgórze", 50.0345, 19.9495),
-        ("Krowodrza", 50.0836, 19.9155),
-        ("Nowa Huta", 50.0705, 20.0340),
-        ("Dębniki", 50.0431, 19.9053),
-        ("Prądnik Biały", 50.0957, 19.9395),
-    ]
+    cursor.execute("SELECT id, name, latitude, longitude FROM districts ORDER BY id")
+    locations = cursor.fetchall()
 
     initiatives_data = [
         ("Sprzątanie Parku Jordana",
@@ -248,22 +693,22 @@ def populate_test_data(conn):
 
     org_ids = list(range(11, 18))  # IDs organizacji (11-17)
 
-    for i, (title, desc, category, hours, spots, reqs) in enumerate(initiatives_data):
+    for i, (title, desc, category, hours_required, spots, reqs) in enumerate(initiatives_data):
         org_id = random.choice(org_ids)
-        location_name, lat, lon = random.choice(locations)
+        district_id, location_name, lat, lon = random.choice(locations)
 
         start_date = datetime.now() + timedelta(days=random.randint(5, 60))
         end_date = start_date + timedelta(days=random.randint(1, 14))
 
         cursor.execute("""
             INSERT INTO initiatives 
-            (title, description, category, location, latitude, longitude,
+            (title, description, category, location, district_id, latitude, longitude,
              start_date, end_date, hours_required, spots_available, 
              requirements, organization_id, status)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """, (title, desc, category, location_name, lat, lon,
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (title, desc, category, location_name, district_id, lat, lon,
               start_date.strftime("%Y-%m-%d"), end_date.strftime("%Y-%m-%d"),
-              hours, spots, reqs, org_id, 'active'))
+              hours_required, spots, reqs, org_id, 'active'))
 
     print(f"✓ Dodano {len(initiatives_data)} inicjatyw")
 
@@ -316,31 +761,22 @@ def populate_test_data(conn):
 
     print(f"✓ Dodano {participations_count} uczestnictw")
 
+    # Godziny ukończonych uczestnictw trafiają do księgi godzin
+    hours.backfill(cursor, reason="seed")
+    rollups.refresh(cursor)
+
     # === ZAŚWIADCZENIA ===
 
     # Pobierz ukończone uczestnictwa
-    cursor.execute("""
-        SELECT p.id, p.volunteer_id, i.organization_id, p.hours_completed
-        FROM participations p
-        JOIN initiatives i ON p.initiative_id = i.id
-        WHERE p.status = 'completed'
-        LIMIT 10
-    """)
-
-    completed = cursor.fetchall()
-
-    for participation in completed:
-        part_id, vol_id, org_id, hours = participation
+    cursor.execute("SELECT id FROM participations WHERE status = 'completed' LIMIT 10")
+    completed = [row[0] for row in cursor.fetchall()]
 
+    rows = conn.cursor()
+    rows.row_factory = sqlite3.Row
+    for participation_id in completed:
+        participation = certificates.completed_participation(rows, participation_id)
         issued_date = datetime.now() - timedelta(days=random.randint(1, 20))
-
-        cursor.execute("""
-            INSERT INTO certificates 
-            (participation_id, volunteer_id, organization_id, 
-             issued_date, hours_completed, certificate_data)
-            VALUES (?, ?, ?, ?, ?, ?)
-        """, (part_id, vol_id, org_id, issued_date.isoformat(),
-              hours, '{"type": "volunteer_certificate"}'))
+        certificates.insert(rows, participation, issued_date.isoformat())
 
     print(f"✓ Dodano {len(completed)} zaświadczeń")
 
@@ -353,8 +789,8 @@ def main():
 
     # Usuń starą bazę jeśli istnieje
     import os
-    if os.path.exists('volunteer.db'):
-        os.remove('volunteer.db')
+    if os.path.exists(DATABASE_PATH):
+        os.remove(DATABASE_PATH)
         print("✓ Usunięto starą bazę danych")
 
     # Utwórz nową bazę
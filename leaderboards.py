@@ -0,0 +1,186 @@
+"""
+Rankingi wolontariuszy, szkół i organizacji według godzin wolontariatu.
+
+Każdy ranking (zakres x okres: cały czas albo miesiąc RRRR-MM) to posortowana
+lista kluczy (-godziny, -ukończone, id) w pamięci procesu i słownik id -> klucz.
+Strona rankingu to wycinek listy, a miejsce konkretnego wolontariusza/szkoły
+to bisect - O(log n). Remisy rozstrzyga liczba ukończonych uczestnictw,
+a potem mniejszy identyfikator, więc kolejność jest zawsze ta sama.
+
+Przy pierwszym użyciu rankingi są budowane z sum (hours_totals dla całego
+czasu, księga godzin zgrupowana po miesiącach dla okresów), a potem - jak
+katalog inicjatyw - przed każdym zapytaniem dociągają tylko wpisy hours_ledger
+nowsze niż ostatnio widziany identyfikator. Zmiany z innych workerów są więc
+widoczne bez przeładowania. Po przywróceniu kopii bazy (nowe pokolenie
+w database_generation) rankingi są budowane od nowa.
+"""
+
+import bisect
+import re
+import threading
+from datetime import date
+
+import hours
+
+ALL_TIME = "all"
+
+# Zakres -> kolumna księgi godzin
+SCOPE_COLUMNS = {
+    hours.VOLUNTEER: "volunteer_id",
+    hours.SCHOOL: "school_id",
+    hours.ORGANIZATION: "organization_id",
+}
+
+# Ostatni wpis księgi i pokolenie bazy (zmienia się po przywróceniu kopii)
+LAST_ID_QUERY = """
+    SELECT COALESCE(MAX(id), 0), (SELECT generation FROM database_generation)
+    FROM hours_ledger
+"""
+
+
+def period_key(value, today=None):
+    """Okres z parametru: "all", "month" (bieżący miesiąc) albo "RRRR-MM" """
+    if value in (None, "", ALL_TIME):
+        return ALL_TIME
+    if value == "month":
+        return (today or date.today()).strftime("%Y-%m")
+    if re.fullmatch(r"\d{4}-(0[1-9]|1[0-2])", value):
+        return value
+    raise ValueError("period: all, month albo miesiąc w formacie RRRR-MM")
+
+
+class Board:
+    """Jeden ranking: posortowane klucze i bieżące sumy"""
+
+    __slots__ = ("keys", "totals")
+
+    def __init__(self):
+        self.keys = []
+        self.totals = {}
+
+    @staticmethod
+    def _key(entity_id, total):
+        return (-total[0], -total[1], entity_id)
+
+    def add(self, entity_id, delta_hours, delta_completed):
+        current = self.totals.get(entity_id)
+        if current is not None:
+            position = bisect.bisect_left(self.keys, self._key(entity_id, current))
+            del self.keys[position]
+        else:
+            current = (0, 0)
+
+        total = (current[0] + delta_hours, current[1] + delta_completed)
+        # Wpisy bez godzin i ukończonych uczestnictw nie zajmują miejsca w rankingu
+        if total[0] <= 0 and total[1] <= 0:
+            self.totals.pop(entity_id, None)
+            return
+        self.totals[entity_id] = total
+        bisect.insort(self.keys, self._key(entity_id, total))
+
+    def page(self, offset, limit):
+        """[(miejsce, id, godziny, ukończone)] od miejsca offset + 1"""
+        return [(offset + index + 1, key[2], -key[0], -key[1])
+                for index, key in enumerate(self.keys[offset:offset + limit])]
+
+    def position(self, entity_id):
+        """(miejsce, godziny, ukończone) albo None, jeśli nie ma go w rankingu"""
+        total = self.totals.get(entity_id)
+        if total is None:
+            return None
+        return bisect.bisect_left(self.keys, self._key(entity_id, total)) + 1, total[0], total[1]
+
+
+class Leaderboards:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        # (zakres, okres) -> Board
+        self.boards = {}
+        self.last_id = None
+        self.generation = None
+
+    def _board(self, scope, period):
+        board = self.boards.get((scope, period))
+        if board is None:
+            board = self.boards[(scope, period)] = Board()
+        return board
+
+    def _load(self, conn):
+        # Sumy i księga muszą pochodzić z tej samej migawki bazy
+        own_transaction = not conn.in_transaction
+        if own_transaction:
+            conn.execute("BEGIN")
+        try:
+            self._load_snapshot(conn.cursor())
+        finally:
+            if own_transaction:
+                conn.rollback()
+
+    def _load_snapshot(self, cursor):
+        self._reset()
+        cursor.execute(LAST_ID_QUERY)
+        last_id, generation = cursor.fetchone()
+
+        cursor.execute("SELECT scope, scope_id, hours, completed FROM hours_totals WHERE scope != ?",
+                       (hours.PLATFORM,))
+        for scope, scope_id, total_hours, completed in cursor.fetchall():
+            self._board(scope, ALL_TIME).add(scope_id, total_hours, completed)
+
+        for scope, column in SCOPE_COLUMNS.items():
+            cursor.execute(f"""
+                SELECT {column}, month, SUM(hours), SUM(completed)
+                FROM hours_ledger
+                WHERE {column} IS NOT NULL AND id <= ?
+                GROUP BY {column}, month
+            """, (last_id,))
+            for scope_id, month, total_hours, completed in cursor.fetchall():
+                self._board(scope, month).add(scope_id, total_hours, completed)
+        self.last_id = last_id
+        self.generation = generation
+
+    def sync(self, conn):
+        """Dociągnij nowe wpisy księgi godzin (wywoływane pod blokadą)"""
+        cursor = conn.cursor()
+        cursor.execute(LAST_ID_QUERY)
+        last_id, generation = cursor.fetchone()
+        if self.last_id == last_id and self.generation == generation:
+            return
+        # Pierwsze użycie, baza przywrócona z kopii albo księga odtworzona od nowa
+        if self.last_id is None or generation != self.generation or last_id < self.last_id:
+            self._load(conn)
+            return
+
+        cursor.execute("""
+            SELECT volunteer_id, school_id, organization_id, month, hours, completed
+            FROM hours_ledger
+            WHERE id > ? AND id <= ?
+        """, (self.last_id, last_id))
+        for volunteer_id, school_id, organization_id, month, delta, completed in cursor.fetchall():
+            for scope, scope_id in ((hours.VOLUNTEER, volunteer_id), (hours.SCHOOL, school_id),
+                                    (hours.ORGANIZATION, organization_id)):
+                if scope_id is None:
+                    continue
+                self._board(scope, ALL_TIME).add(scope_id, delta, completed)
+                self._board(scope, month).add(scope_id, delta, completed)
+        self.last_id = last_id
+
+    def top(self, conn, scope, period, offset=0, limit=10):
+        """Strona rankingu i liczba wszystkich pozycji"""
+        with self._lock:
+            self.sync(conn)
+            board = self.boards.get((scope, period))
+            if board is None:
+                return [], 0
+            return board.page(offset, limit), len(board.keys)
+
+    def position(self, conn, scope, period, entity_id):
+        with self._lock:
+            self.sync(conn)
+            board = self.boards.get((scope, period))
+            return board.position(entity_id) if board is not None else None
+
+
+leaderboards = Leaderboards()
@@ -0,0 +1,175 @@
+"""
+Test obciążeniowy: jak przepustowość API skaluje się z liczbą workerów.
+
+Dla każdej liczby workerów uruchamia serve.py na kopii bazy, czeka na /ready
+i przez zadany czas wysyła z kilku procesów klienckich mieszankę odczytów
+i zapisów. Wynik: żądania/s, opóźnienia p50/p99 oraz liczba błędów 5xx
+(w tym ewentualnych "database is locked").
+
+Uruchom: python load_test.py --workers 1 2 4 --duration 10 --concurrency 16
+"""
+
+import argparse
+import http.client
+import json
+import multiprocessing
+import os
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+INITIATIVE_IDS = list(range(1, 16))
+ORGANIZATION_IDS = list(range(11, 18))
+
+# Mieszanka odczytów (ścieżka, waga)
+READS = [
+    ("/initiatives", 40),
+    ("/initiatives/{initiative_id}", 30),
+    ("/statistics", 10),
+    ("/organizations/{org_id}/applications?status=pending", 10),
+    ("/organizations/{org_id}/initiatives", 10),
+]
+
+
+def new_initiative(org_id):
+    return {
+        "title": "Inicjatywa testu obciążeniowego",
+        "description": "Utworzona przez load_test.py",
+        "category": random.choice(["Ekologia", "Kultura", "Edukacja", "Sport"]),
+        "location": random.choice(["Kazimierz", "Podgórze", "Nowa Huta"]),
+        "start_date": "2025-12-01",
+        "end_date": "2025-12-02",
+        "hours_required": 4,
+        "spots_available": 10,
+        "organization_id": org_id
+    }
+
+
+def client(args):
+    """Pętla jednego klienta (osobny proces, połączenie keep-alive)"""
+    port, duration, write_ratio, seed = args
+    random.seed(seed)
+    paths = [path for path, _ in READS]
+    weights = [weight for _, weight in READS]
+
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    latencies = []
+    errors = 0
+    deadline = time.perf_counter() + duration
+
+    while time.perf_counter() < deadline:
+        org_id = random.choice(ORGANIZATION_IDS)
+        started = time.perf_counter()
+        try:
+            if random.random() < write_ratio:
+                body = json.dumps(new_initiative(org_id))
+                conn.request("POST", "/initiatives", body=body,
+                             headers={"Content-Type": "application/json"})
+            else:
+                path = random.choices(paths, weights)[0].format(
+                    initiative_id=random.choice(INITIATIVE_IDS), org_id=org_id)
+                conn.request("GET", path)
+            response = conn.getresponse()
+            response.read()
+            if response.status >= 500:
+                errors += 1
+        except (OSError, http.client.HTTPException):
+            errors += 1
+            conn.close()
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+        latencies.append(time.perf_counter() - started)
+
+    conn.close()
+    return latencies, errors
+
+
+def wait_until_ready(port, workers, timeout=60):
+    """Poczekaj, aż /ready odpowie 200 kilka razy z rzędu (każdy worker się rozgrzał)"""
+    deadline = time.time() + timeout
+    streak = 0
+    while time.time() < deadline:
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=2)
+            conn.request("GET", "/ready")
+            status = conn.getresponse().status
+            conn.close()
+        except OSError:
+            status = None
+        streak = streak + 1 if status == 200 else 0
+        if streak >= 3 * workers:
+            return
+        time.sleep(0.1)
+    raise RuntimeError("Serwer nie osiągnął gotowości")
+
+
+def run(workers, port, duration, concurrency, write_ratio, database_path):
+    # Wszyscy klienci testu mają ten sam adres - limit na klienta jest wyłączony
+    env = dict(os.environ, VOLUNTEER_DB=database_path,
+               NOTIFY_SINK=f"file:{database_path}.notifications.jsonl",
+               RATE_LIMIT_PER_SECOND="0")
+    server = subprocess.Popen(
+        [sys.executable, "serve.py", "--workers", str(workers), "--port", str(port),
+         "--log-level", "warning"],
+        cwd=HERE, env=env, stdout=subprocess.DEVNULL
+    )
+    try:
+        wait_until_ready(port, workers)
+        with multiprocessing.Pool(concurrency) as clients:
+            results = clients.map(client, [(port, duration, write_ratio, seed)
+                                           for seed in range(concurrency)])
+    finally:
+        server.terminate()
+        server.wait()
+
+    latencies = sorted(latency for result, _ in results for latency in result)
+    errors = sum(errors for _, errors in results)
+    return {
+        "workers": workers,
+        "requests": len(latencies),
+        "rps": len(latencies) / duration,
+        "p50_ms": latencies[len(latencies) // 2] * 1000 if latencies else 0,
+        "p99_ms": latencies[int(len(latencies) * 0.99)] * 1000 if latencies else 0,
+        "errors": errors
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Skalowanie przepustowości z liczbą workerów")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--duration", type=float, default=10.0, help="sekundy na pomiar")
+    parser.add_argument("--concurrency", type=int, default=16, help="liczba klientów")
+    parser.add_argument("--write-ratio", type=float, default=0.1, help="udział zapisów")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--database", default="volunteer.db", help="baza źródłowa (kopiowana)")
+    args = parser.parse_args()
+
+    print(f"Rdzenie CPU: {os.cpu_count()}, klienci: {args.concurrency}, "
+          f"zapisy: {args.write_ratio:.0%}, czas pomiaru: {args.duration}s\n")
+    print(f"{'workery':>8} {'żądań/s':>10} {'p50 ms':>8} {'p99 ms':>8} {'błędy':>6} {'skalowanie':>10}")
+
+    baseline = None
+    with tempfile.TemporaryDirectory() as tmp:
+        for workers in args.workers:
+            # Każdy pomiar na świeżej kopii bazy, by zapisy nie wpływały na kolejne
+            database_path = os.path.join(tmp, f"load_{workers}.db")
+            source = sqlite3.connect(os.path.join(HERE, args.database))
+            target = sqlite3.connect(database_path)
+            source.backup(target)
+            source.close()
+            target.close()
+
+            result = run(workers, args.port, args.duration, args.concurrency,
+                         args.write_ratio, database_path)
+            baseline = baseline or result["rps"]
+            print(f"{result['workers']:>8} {result['rps']:>10.1f} {result['p50_ms']:>8.1f} "
+                  f"{result['p99_ms']:>8.1f} {result['errors']:>6} "
+                  f"{result['rps'] / baseline:>9.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,88 @@
-from fastapi import FastAPI, HTTPException, Query
+from fastapi import FastAPI, HTTPException, Query, Header, Request, UploadFile, File
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, ValidationInfo, field_validator
 from typing import Optional, List
 from datetime import datetime, date
 from enum import Enum
-import sqlite3
-import json
+from contextlib import asynccontextmanager
+import asyncio
+import hmac
+import os
+
+import admission
+import archive
+import backup
+import batch
+import certificates
+import database
+from catalog import catalog
+import districts
+from entities import user_cache
+import events
+import hours
+import idempotency
+import imports
+import init_database
+from leaderboards import leaderboards, period_key
+import maintenance
+import outbox
+import profiling
+import queries
+import rollups
+import roster
+import scheduler
+import startup
+import tracing
+from database import get_db, to_day
+
+# Pomijane przy rozgrzewce: sam /ready oraz strumienie SSE, które się nie kończą
+WARMUP_SKIP_PATHS = {"/ready", "/volunteers/{volunteer_id}/events", "/organizations/{org_id}/events"}
+
+# Token endpointów administracyjnych (nagłówek X-Admin-Token); bez niego są wyłączone
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN", "")
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # Uzupełnij schemat bazy o brakujące migracje i sprawdź jego wersję
+    # (serve.py wykonuje migracje raz przed startem workerów: RUN_MIGRATIONS=0)
+    conn = get_db()
+    if os.environ.get("RUN_MIGRATIONS", "1") != "0":
+        init_database.migrate(conn)
+    startup.check_schema(conn)
+    conn.close()
+
+    database.pool.open()
+
+    # Wysyłka powiadomień w tle (OUTBOX_DISPATCHER=0 gdy działa jako osobny proces)
+    if os.environ.get("OUTBOX_DISPATCHER", "1") != "0":
+        dispatcher.start()
+
+    # Zadania okresowe - przy kilku workerach wykonuje je tylko lider (SCHEDULER=0 wyłącza)
+    if os.environ.get("SCHEDULER", "1") != "0":
+        jobs.start()
+
+    # Rozgrzewka w tle - do jej końca GET /ready zwraca 503
+    warmup = asyncio.create_task(startup.warmup(app, WARMUP_SKIP_PATHS))
+    yield
+    warmup.cancel()
+    await jobs.stop()
+    await dispatcher.stop()
+    database.pool.close_all()
+
+
+app = FastAPI(title="Krakowskie Cyfrowe Centrum Wolontariatu API", lifespan=lifespan)
+
+# Endpointy ze spanem "handler" w śledzonych żądaniach i próbkowane w profilowanych
+# (przed dodaniem tras)
+app.router.route_class = profiling.ProfiledRoute
 
-app = FastAPI(title="Krakowskie Cyfrowe Centrum Wolontariatu API")
+# Ponowienia POST/PUT z nagłówkiem Idempotency-Key dostają zapisaną odpowiedź
+app.add_middleware(idempotency.IdempotencyMiddleware, get_db=get_db)
+
+# Limity klientów i odrzucanie nadmiaru ruchu (429/503 z Retry-After)
+app.add_middleware(admission.AdmissionMiddleware)
 
 # CORS
 app.add_middleware(
@@ -16,14 +91,27 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Request-ID"],
 )
 
+# Profil żądania z nagłówkiem X-Profile: 1 (tylko z X-Admin-Token), wraz z limitami ruchu
+app.add_middleware(profiling.ProfileMiddleware, authorize=lambda token: is_admin(token))
+
+# X-Request-ID i ślady wybranych żądań (TRACE_SAMPLE_RATE / TRACE_SLOW_MS) - najbardziej
+# zewnętrzny, więc obejmuje też limity ruchu i idempotencję
+app.add_middleware(tracing.TracingMiddleware)
+
+
+dispatcher = outbox.Dispatcher(get_db, outbox.sink_from_url(outbox.SINK_URL))
 
-# Database connection
-def get_db():
-    conn = sqlite3.connect('volunteer.db')
-    conn.row_factory = sqlite3.Row
-    return conn
+
+def after_scheduled_commit(channels):
+    """Po partii zadania okresowego: obudź strumienie SSE i wysyłkę powiadomień"""
+    events.broker.notify(*channels)
+    dispatcher.wake()
+
+
+jobs = scheduler.Scheduler(get_db, on_commit=after_scheduled_commit)
 
 
 # Enums
@@ -39,6 +127,19 @@ class InitiativeStatus(str, Enum):
     cancelled = "cancelled"
 
 
+class LeaderboardScope(str, Enum):
+    volunteers = "volunteers"
+    schools = "schools"
+    organizations = "organizations"
+
+
+LEADERBOARD_SCOPES = {
+    LeaderboardScope.volunteers: hours.VOLUNTEER,
+    LeaderboardScope.schools: hours.SCHOOL,
+    LeaderboardScope.organizations: hours.ORGANIZATION,
+}
+
+
 class ParticipationStatus(str, Enum):
     pending = "pending"
     approved = "approved"
@@ -52,13 +153,22 @@ class InitiativeCreate(BaseModel):
     description: str
     category: str
     location: str
-    start_date: str
-    end_date: str
+    # Daty RRRR-MM-DD - z nich triggery wyliczają start_day/end_day (katalog, filtry dat)
+    start_date: date
+    end_date: date
     hours_required: int
     spots_available: int
     requirements: Optional[str] = None
     organization_id: int
 
+    @field_validator("end_date")
+    @classmethod
+    def end_after_start(cls, end_date: date, info: ValidationInfo):
+        start_date = info.data.get("start_date")
+        if start_date is not None and end_date < start_date:
+            raise ValueError("data zakończenia przed datą rozpoczęcia")
+        return end_date
+
 
 class ParticipationApply(BaseModel):
     volunteer_id: int
@@ -76,6 +186,99 @@ class CertificateCreate(BaseModel):
     organization_id: int
 
 
+class RosterStudent(BaseModel):
+    name: str
+    email: str
+    phone: Optional[str] = None
+    age_category: Optional[str] = None
+
+
+class RosterSync(BaseModel):
+    students: List[RosterStudent]
+    deactivate_missing: bool = False
+
+
+class BatchItem(BaseModel):
+    id: Optional[str] = None
+    method: str = "GET"
+    path: str
+
+
+class BatchRequest(BaseModel):
+    requests: List[BatchItem]
+
+
+# Facety GET /initiatives: nazwa -> (pole wartości, pole etykiety)
+FACETS = {
+    "category": ("category", "category"),
+    "location": ("district_id", "district_name"),
+    "organization_id": ("organization_id", "organization_name"),
+}
+
+
+def parse_facets(facets):
+    """Lista facetów z parametru facets=category,location,..."""
+    if not facets:
+        return []
+    names = [name.strip() for name in facets.split(",") if name.strip()]
+    unknown = [name for name in names if name not in FACETS]
+    if unknown:
+        raise HTTPException(status_code=400,
+                            detail=f"Nieznany facet: {', '.join(unknown)} "
+                                   f"(dostępne: {', '.join(FACETS)})")
+    return list(dict.fromkeys(names))
+
+
+def facet_counts(initiatives, names):
+    """Liczności wartości facetów w wynikach - jedno przejście po liście"""
+    counts = {name: {} for name in names}
+    for initiative in initiatives:
+        for name in names:
+            value_field, label_field = FACETS[name]
+            value = initiative[value_field]
+            bucket = counts[name].get(value)
+            if bucket is None:
+                bucket = counts[name][value] = {"value": value, "label": initiative[label_field],
+                                                "count": 0}
+            bucket["count"] += 1
+    return {name: sorted(buckets.values(), key=lambda b: (-b["count"], str(b["label"])))
+            for name, buckets in counts.items()}
+
+
+def initiatives_response(initiatives, facet_names):
+    """Odpowiedź listy inicjatyw, z facetami jeśli zażądano"""
+    response = {"initiatives": initiatives, "count": len(initiatives)}
+    if facet_names:
+        response["facets"] = facet_counts(initiatives, facet_names)
+    return response
+
+
+def date_range(date_from, date_to):
+    """Zakres dat from/to jako numery dni (kolumny start_day/end_day)"""
+    if date_from and date_to and date_from > date_to:
+        raise HTTPException(status_code=400, detail="Data 'from' jest późniejsza niż 'to'")
+    return to_day(date_from), to_day(date_to)
+
+
+def overlap_filters(alias="i"):
+    """Filtry queries.Select: inicjatywa trwa choć jeden dzień w zakresie :from_day/:to_day"""
+    return {
+        "to_day": f"{alias}.start_day <= :to_day",
+        "from_day": f"{alias}.end_day >= :from_day",
+    }
+
+
+def is_admin(token):
+    """Czy nagłówek X-Admin-Token zgadza się z ADMIN_TOKEN (bez tokenu - nigdy)"""
+    return bool(ADMIN_TOKEN) and hmac.compare_digest((token or "").encode(), ADMIN_TOKEN.encode())
+
+
+def require_admin(token):
+    """403, jeśli nagłówek X-Admin-Token nie zgadza się z ADMIN_TOKEN"""
+    if not is_admin(token):
+        raise HTTPException(status_code=403, detail="Wymagany poprawny nagłówek X-Admin-Token")
+
+
 # === ENDPOINTS ===
 
 @app.get("/")
@@ -91,47 +294,80 @@ def root():
     }
 
 
+@app.get("/ready")
+def ready():
+    """Gotowość do obsługi ruchu (po rozgrzewce)"""
+    status = "ready" if startup.state["ready"] else "warming_up"
+    return JSONResponse({"status": status, **startup.state},
+                        status_code=200 if startup.state["ready"] else 503)
+
+
 # === INITIATIVES ENDPOINTS ===
 
+# Nazwa i adres organizacji dopisywane z pamięci podręcznej kont zamiast JOIN-a z users
+ORGANIZATION_FIELDS = {"organization_name": "name", "organization_email": "email"}
+
+INITIATIVES_QUERY = queries.Select("""
+        SELECT i.*, d.name as district_name
+        FROM initiatives i
+        LEFT JOIN districts d ON i.district_id = d.id
+        WHERE 1=1
+    """, {
+    "category": "i.category = :category",
+    "district_id": "i.district_id = :district_id",
+    "status": "i.status = :status",
+    "organization_id": "i.organization_id = :organization_id",
+    **overlap_filters()
+}, "ORDER BY i.start_date DESC")
+
+
 @app.get("/initiatives")
 def get_initiatives(
         category: Optional[str] = None,
         location: Optional[str] = None,
         status: Optional[str] = "active",
-        organization_id: Optional[int] = None
+        organization_id: Optional[int] = None,
+        date_from: Optional[date] = Query(None, alias="from"),
+        date_to: Optional[date] = Query(None, alias="to"),
+        facets: Optional[str] = None
 ):
-    """Pobierz listę inicjatyw z filtrowaniem"""
-    conn = get_db()
-    cursor = conn.cursor()
+    """Pobierz listę inicjatyw z filtrowaniem.
 
-    query = """
-        SELECT i.*, u.name as organization_name, u.email as organization_email
-        FROM initiatives i
-        JOIN users u ON i.organization_id = u.id
-        WHERE 1=1
+    location: identyfikator lub nazwa (alias) dzielnicy; from/to: inicjatywy
+    trwające w danym okresie; facets: np. category,location,organization_id -
+    liczności wartości w wynikach.
     """
-    params = []
+    from_day, to_day = date_range(date_from, date_to)
+    facet_names = parse_facets(facets)
+    conn = get_db()
 
-    if category:
-        query += " AND i.category = ?"
-        params.append(category)
+    district_id = None
     if location:
-        query += " AND i.location LIKE ?"
-        params.append(f"%{location}%")
-    if status:
-        query += " AND i.status = ?"
-        params.append(status)
-    if organization_id:
-        query += " AND i.organization_id = ?"
-        params.append(organization_id)
-
-    query += " ORDER BY i.start_date DESC"
-
-    cursor.execute(query, params)
-    initiatives = [dict(row) for row in cursor.fetchall()]
+        district = districts.lookup(conn.cursor(), location)
+        # Nieznana lokalizacja - żadna inicjatywa do niej nie pasuje
+        if district is None:
+            conn.close()
+            return initiatives_response([], facet_names)
+        district_id = district['id']
+
+    # Aktywne inicjatywy obsługuje katalog w pamięci (indeksy zamiast JOIN-a)
+    if status == "active":
+        initiatives = catalog.query(conn, category=category, district_id=district_id,
+                                    organization_id=organization_id,
+                                    from_day=from_day, to_day=to_day)
+        conn.close()
+        return initiatives_response(initiatives, facet_names)
+
+    cursor = conn.cursor()
+    cursor.execute(*INITIATIVES_QUERY.build(
+        category=category, district_id=district_id, status=status,
+        organization_id=organization_id, from_day=from_day, to_day=to_day
+    ))
+    initiatives = user_cache.enrich(conn, [dict(row) for row in cursor.fetchall()],
+                                    "organization_id", ORGANIZATION_FIELDS)
     conn.close()
 
-    return {"initiatives": initiatives, "count": len(initiatives)}
+    return initiatives_response(initiatives, facet_names)
 
 
 @app.get("/initiatives/{initiative_id}")
@@ -174,29 +410,75 @@ def create_initiative(initiative: InitiativeCreate):
     cursor = conn.cursor()
 
     # Sprawdź czy organizacja istnieje
-    cursor.execute("SELECT * FROM users WHERE id = ? AND user_type = 'organization'",
-                   (initiative.organization_id,))
-    if not cursor.fetchone():
+    organization = user_cache.get(conn, initiative.organization_id)
+    if not organization or organization['user_type'] != 'organization':
         conn.close()
         raise HTTPException(status_code=404, detail="Organizacja nie znaleziona")
 
+    # Lokalizacja wpisana tekstem -> dzielnica (współrzędne jej środka trafiają na mapę)
+    district = districts.resolve(cursor, initiative.location)
+    district_id = district['id'] if district else None
+    latitude = district['latitude'] if district else None
+    longitude = district['longitude'] if district else None
+
     cursor.execute("""
         INSERT INTO initiatives 
-        (title, description, category, location, start_date, end_date, 
-         hours_required, spots_available, requirements, organization_id, status)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 'active')
+        (title, description, category, location, district_id, latitude, longitude,
+         start_date, end_date, hours_required, spots_available, requirements,
+         organization_id, status)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 'active')
     """, (
         initiative.title, initiative.description, initiative.category,
-        initiative.location, initiative.start_date, initiative.end_date,
+        initiative.location, district_id, latitude, longitude,
+        initiative.start_date.isoformat(), initiative.end_date.isoformat(),
         initiative.hours_required, initiative.spots_available,
         initiative.requirements, initiative.organization_id
     ))
 
-    conn.commit()
     initiative_id = cursor.lastrowid
+
+    event = {
+        "initiative_id": initiative_id,
+        "title": initiative.title,
+        "category": initiative.category,
+        "location": initiative.location,
+        "district_id": district_id,
+        "organization_id": initiative.organization_id
+    }
+    channels = [
+        events.publish(cursor, events.INITIATIVES_CHANNEL, "initiative.created", event),
+        events.publish(cursor, events.organization_channel(initiative.organization_id),
+                       "initiative.created", event)
+    ]
+
+    conn.commit()
     conn.close()
+    events.broker.notify(*channels)
 
-    return {"message": "Inicjatywa utworzona", "initiative_id": initiative_id}
+    return {"message": "Inicjatywa utworzona", "initiative_id": initiative_id,
+            "district_id": district_id}
+
+
+@app.post("/organizations/{org_id}/initiatives/import")
+def import_initiatives(org_id: int, file: UploadFile = File(...)):
+    """Import wielu inicjatyw organizacji z pliku CSV lub XLSX"""
+    conn = get_db()
+
+    organization = user_cache.get(conn, org_id)
+    if not organization or organization['user_type'] != 'organization':
+        conn.close()
+        raise HTTPException(status_code=404, detail="Organizacja nie znaleziona")
+
+    try:
+        report = imports.import_initiatives(conn, InitiativeCreate, file.file, file.filename, org_id)
+    finally:
+        conn.close()
+
+    if report["imported"]:
+        events.broker.notify(events.INITIATIVES_CHANNEL, events.organization_channel(org_id))
+    if report.get("file_error") and not report["imported"] and not report["failed"]:
+        raise HTTPException(status_code=400, detail=report["file_error"])
+    return {"message": "Import zakończony", **report}
 
 
 @app.post("/initiatives/{initiative_id}/apply")
@@ -230,56 +512,153 @@ def apply_to_initiative(initiative_id: int, application: ParticipationApply):
     """, (application.volunteer_id, initiative_id,
           datetime.now().isoformat(), application.message))
 
-    conn.commit()
     participation_id = cursor.lastrowid
+
+    event = {
+        "participation_id": participation_id,
+        "initiative_id": initiative_id,
+        "volunteer_id": application.volunteer_id,
+        "status": "pending"
+    }
+    channels = [
+        events.publish(cursor, events.organization_channel(initiative['organization_id']),
+                       "application.created", event),
+        events.publish(cursor, events.volunteer_channel(application.volunteer_id),
+                       "participation.created", event)
+    ]
+    outbox.enqueue(cursor, "application.created", initiative['organization_id'],
+                   {**event, "initiative_title": initiative['title']})
+
+    conn.commit()
     conn.close()
+    events.broker.notify(*channels)
+    dispatcher.wake()
 
     return {"message": "Zgłoszenie wysłane", "participation_id": participation_id}
 
 
 # === VOLUNTEERS ENDPOINTS ===
 
+def _volunteer_participations_query(include_archived):
+    initiatives, participations = archive.table_names(include_archived)
+    return queries.Select(f"""
+        SELECT p.*, i.title as initiative_title, i.category, 
+               i.location, i.start_date, i.end_date, i.organization_id
+        FROM {participations} p
+        JOIN {initiatives} i ON p.initiative_id = i.id
+        WHERE p.volunteer_id = :volunteer_id
+    """, overlap_filters(), "ORDER BY p.applied_date DESC")
+
+
+# Osobne szablony dla tabel bieżących i widoków z archiwum
+VOLUNTEER_PARTICIPATIONS_QUERIES = {
+    include_archived: _volunteer_participations_query(include_archived)
+    for include_archived in (False, True)
+}
+
+
 @app.get("/volunteers/{volunteer_id}/participations")
-def get_volunteer_participations(volunteer_id: int):
-    """Pobierz uczestnictwa wolontariusza"""
+def get_volunteer_participations(
+        volunteer_id: int,
+        include_archived: bool = False,
+        date_from: Optional[date] = Query(None, alias="from"),
+        date_to: Optional[date] = Query(None, alias="to")
+):
+    """Pobierz uczestnictwa wolontariusza (z archiwum tylko na żądanie)"""
+    from_day, to_day = date_range(date_from, date_to)
     conn = get_db()
+    archive.tables(conn, include_archived)
     cursor = conn.cursor()
 
-    cursor.execute("""
-        SELECT p.*, i.title as initiative_title, i.category, 
-               i.location, i.start_date, i.end_date,
-               u.name as organization_name
-        FROM participations p
-        JOIN initiatives i ON p.initiative_id = i.id
-        JOIN users u ON i.organization_id = u.id
-        WHERE p.volunteer_id = ?
-        ORDER BY p.applied_date DESC
-    """, (volunteer_id,))
+    cursor.execute(*VOLUNTEER_PARTICIPATIONS_QUERIES[include_archived].build(
+        volunteer_id=volunteer_id, from_day=from_day, to_day=to_day
+    ))
 
-    participations = [dict(row) for row in cursor.fetchall()]
+    participations = user_cache.enrich(conn, [dict(row) for row in cursor.fetchall()],
+                                       "organization_id", {"organization_name": "name"})
     conn.close()
 
     return {"participations": participations, "count": len(participations)}
 
 
-# === ORGANIZATIONS ENDPOINTS ===
-
-@app.get("/organizations/{org_id}/initiatives")
-def get_organization_initiatives(org_id: int):
-    """Pobierz inicjatywy organizacji"""
+@app.get("/volunteers/{volunteer_id}/hours")
+def get_volunteer_hours(volunteer_id: int):
+    """Godziny wolontariusza z księgi: suma oraz rozbicie na kategorie i miesiące"""
     conn = get_db()
     cursor = conn.cursor()
 
+    cursor.execute("SELECT id FROM users WHERE id = ? AND user_type = 'volunteer'", (volunteer_id,))
+    if not cursor.fetchone():
+        conn.close()
+        raise HTTPException(status_code=404, detail="Wolontariusz nie znaleziony")
+
+    total = hours.totals(cursor, hours.VOLUNTEER, volunteer_id)
+
+    cursor.execute("""
+        SELECT category, SUM(hours) as hours
+        FROM hours_breakdown
+        WHERE volunteer_id = ?
+        GROUP BY category
+        HAVING SUM(hours) != 0
+        ORDER BY hours DESC
+    """, (volunteer_id,))
+    by_category = [dict(row) for row in cursor.fetchall()]
+
     cursor.execute("""
+        SELECT month, SUM(hours) as hours
+        FROM hours_breakdown
+        WHERE volunteer_id = ?
+        GROUP BY month
+        HAVING SUM(hours) != 0
+        ORDER BY month
+    """, (volunteer_id,))
+    by_month = [dict(row) for row in cursor.fetchall()]
+    conn.close()
+
+    return {
+        "volunteer_id": volunteer_id,
+        "total_hours": total['hours'],
+        "completed_participations": total['completed'],
+        "by_category": by_category,
+        "by_month": by_month
+    }
+
+
+@app.get("/volunteers/{volunteer_id}/events")
+async def volunteer_events(volunteer_id: int, last_event_id: Optional[str] = Header(None)):
+    """Strumień zmian wolontariusza (SSE): status zgłoszeń, zaświadczenia, nowe inicjatywy"""
+    channels = [events.volunteer_channel(volunteer_id), events.INITIATIVES_CHANNEL]
+    return StreamingResponse(events.stream(get_db, channels, last_event_id),
+                             media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache"})
+
+
+# === ORGANIZATIONS ENDPOINTS ===
+
+ORGANIZATION_INITIATIVES_QUERY = queries.Select("""
         SELECT i.*,
                COUNT(DISTINCT CASE WHEN p.status = 'pending' THEN p.id END) as pending_applications,
                COUNT(DISTINCT CASE WHEN p.status = 'approved' THEN p.id END) as approved_volunteers
         FROM initiatives i
         LEFT JOIN participations p ON i.id = p.initiative_id
-        WHERE i.organization_id = ?
-        GROUP BY i.id
-        ORDER BY i.start_date DESC
-    """, (org_id,))
+        WHERE i.organization_id = :org_id
+    """, overlap_filters(), "GROUP BY i.id ORDER BY i.start_date DESC")
+
+
+@app.get("/organizations/{org_id}/initiatives")
+def get_organization_initiatives(
+        org_id: int,
+        date_from: Optional[date] = Query(None, alias="from"),
+        date_to: Optional[date] = Query(None, alias="to")
+):
+    """Pobierz inicjatywy organizacji"""
+    from_day, to_day = date_range(date_from, date_to)
+    conn = get_db()
+    cursor = conn.cursor()
+
+    cursor.execute(*ORGANIZATION_INITIATIVES_QUERY.build(
+        org_id=org_id, from_day=from_day, to_day=to_day
+    ))
 
     initiatives = [dict(row) for row in cursor.fetchall()]
     conn.close()
@@ -287,34 +666,54 @@ def get_organization_initiatives(org_id: int):
     return {"initiatives": initiatives, "count": len(initiatives)}
 
 
+ORGANIZATION_APPLICATIONS_QUERY = queries.Select("""
+        SELECT p.*, i.title as initiative_title
+        FROM participations p
+        JOIN initiatives i ON p.initiative_id = i.id
+        WHERE i.organization_id = :org_id
+    """, {
+    "status": "p.status = :status",
+    **overlap_filters()
+}, "ORDER BY p.applied_date DESC")
+
+
 @app.get("/organizations/{org_id}/applications")
-def get_organization_applications(org_id: int, status: Optional[str] = None):
+def get_organization_applications(
+        org_id: int,
+        status: Optional[str] = None,
+        date_from: Optional[date] = Query(None, alias="from"),
+        date_to: Optional[date] = Query(None, alias="to")
+):
     """Pobierz zgłoszenia do inicjatyw organizacji"""
+    from_day, to_day = date_range(date_from, date_to)
     conn = get_db()
     cursor = conn.cursor()
+    cursor.execute(*ORGANIZATION_APPLICATIONS_QUERY.build(
+        org_id=org_id, status=status, from_day=from_day, to_day=to_day
+    ))
+    applications = user_cache.enrich(conn, [dict(row) for row in cursor.fetchall()], "volunteer_id", {
+        "volunteer_name": "name",
+        "volunteer_email": "email",
+        "volunteer_phone": "phone",
+        "age_category": "age_category"
+    })
+    conn.close()
 
-    query = """
-        SELECT p.*, i.title as initiative_title,
-               v.name as volunteer_name, v.email as volunteer_email,
-               v.phone as volunteer_phone, v.age_category
-        FROM participations p
-        JOIN initiatives i ON p.initiative_id = i.id
-        JOIN users v ON p.volunteer_id = v.id
-        WHERE i.organization_id = ?
-    """
-    params = [org_id]
+    return {"applications": applications, "count": len(applications)}
 
-    if status:
-        query += " AND p.status = ?"
-        params.append(status)
 
-    query += " ORDER BY p.applied_date DESC"
+@app.get("/organizations/{org_id}/events")
+async def organization_events(org_id: int, last_event_id: Optional[str] = Header(None)):
+    """Strumień zmian organizacji (SSE): nowe zgłoszenia i zmiany ich statusu"""
+    channels = [events.organization_channel(org_id)]
+    return StreamingResponse(events.stream(get_db, channels, last_event_id),
+                             media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache"})
 
-    cursor.execute(query, params)
-    applications = [dict(row) for row in cursor.fetchall()]
-    conn.close()
 
-    return {"applications": applications, "count": len(applications)}
+APPROVE_UPDATE = queries.Update("participations",
+                                ("status", "hours_completed", "approved_date"),
+                                "id = :id", required=("status",))
 
 
 @app.put("/participations/{participation_id}/approve")
@@ -323,32 +722,47 @@ def approve_participation(participation_id: int, approval: ParticipationApprove)
     conn = get_db()
     cursor = conn.cursor()
 
-    cursor.execute("SELECT * FROM participations WHERE id = ?", (participation_id,))
-    if not cursor.fetchone():
+    cursor.execute("""
+        SELECT p.*, i.organization_id, i.title as initiative_title
+        FROM participations p
+        JOIN initiatives i ON p.initiative_id = i.id
+        WHERE p.id = ?
+    """, (participation_id,))
+    participation = cursor.fetchone()
+    if not participation:
         conn.close()
         raise HTTPException(status_code=404, detail="Zgłoszenie nie znalezione")
 
-    update_fields = ["status = ?"]
-    params = [approval.status]
-
-    if approval.hours_completed is not None:
-        update_fields.append("hours_completed = ?")
-        params.append(approval.hours_completed)
-
-    if approval.status == "approved":
-        update_fields.append("approved_date = ?")
-        params.append(datetime.now().isoformat())
+    approved_date = datetime.now().isoformat() if approval.status == "approved" else None
+    cursor.execute(*APPROVE_UPDATE.build(
+        id=participation_id, status=approval.status,
+        hours_completed=approval.hours_completed, approved_date=approved_date
+    ))
 
-    params.append(participation_id)
+    # Zaliczone godziny: wpis w księdze i sumy bieżące w tej samej transakcji
+    hours.record(cursor, participation_id, participation['status'],
+                 participation['hours_completed'], reason="approve")
 
-    cursor.execute(f"""
-        UPDATE participations 
-        SET {', '.join(update_fields)}
-        WHERE id = ?
-    """, params)
+    event = {
+        "participation_id": participation_id,
+        "initiative_id": participation['initiative_id'],
+        "volunteer_id": participation['volunteer_id'],
+        "status": approval.status,
+        "hours_completed": approval.hours_completed
+    }
+    channels = [
+        events.publish(cursor, events.volunteer_channel(participation['volunteer_id']),
+                       "participation.updated", event),
+        events.publish(cursor, events.organization_channel(participation['organization_id']),
+                       "participation.updated", event)
+    ]
+    outbox.enqueue(cursor, "participation.updated", participation['volunteer_id'],
+                   {**event, "initiative_title": participation['initiative_title']})
 
     conn.commit()
     conn.close()
+    events.broker.notify(*channels)
+    dispatcher.wake()
 
     return {"message": "Status zaktualizowany"}
 
@@ -359,65 +773,72 @@ def approve_participation(participation_id: int, approval: ParticipationApprove)
 def create_certificate(cert: CertificateCreate):
     """Wygeneruj zaświadczenie dla wolontariusza"""
     conn = get_db()
+    archive.attach(conn)
     cursor = conn.cursor()
 
-    # Pobierz szczegóły uczestnictwa
-    cursor.execute("""
-        SELECT p.*, i.title as initiative_title, i.description,
-               i.start_date, i.end_date, i.category,
-               v.name as volunteer_name, o.name as organization_name
-        FROM participations p
-        JOIN initiatives i ON p.initiative_id = i.id
-        JOIN users v ON p.volunteer_id = v.id
-        JOIN users o ON i.organization_id = o.id
-        WHERE p.id = ? AND p.status = 'completed'
-    """, (cert.participation_id,))
-
-    participation = cursor.fetchone()
+    # Pobierz szczegóły uczestnictwa (także zarchiwizowanego)
+    participation = certificates.completed_participation(
+        cursor, cert.participation_id, "all_initiatives", "all_participations")
     if not participation:
         conn.close()
         raise HTTPException(status_code=404,
                             detail="Uczestnictwo nie znalezione lub nieukończone")
 
-    # Utwórz zaświadczenie
-    cursor.execute("""
-        INSERT INTO certificates 
-        (participation_id, volunteer_id, organization_id, issued_date, 
-         hours_completed, certificate_data)
-        VALUES (?, ?, ?, ?, ?, ?)
-    """, (
-        cert.participation_id,
-        participation['volunteer_id'],
-        cert.organization_id,
-        datetime.now().isoformat(),
-        participation['hours_completed'],
-        json.dumps(dict(participation))
-    ))
+    # Utwórz zaświadczenie (zwarty zapis + skrót do weryfikacji)
+    certificate_id, content_hash = certificates.insert(
+        cursor, {**dict(participation), "organization_id": cert.organization_id},
+        datetime.now().isoformat())
+
+    event = {
+        "certificate_id": certificate_id,
+        "participation_id": cert.participation_id,
+        "hours": participation['hours_completed']
+    }
+    channel = events.publish(cursor, events.volunteer_channel(participation['volunteer_id']),
+                             "certificate.created", event)
+    outbox.enqueue(cursor, "certificate.created", participation['volunteer_id'],
+                   {**event, "initiative_title": participation['initiative_title']})
 
     conn.commit()
-    certificate_id = cursor.lastrowid
     conn.close()
+    events.broker.notify(channel)
+    dispatcher.wake()
 
     return {
         "message": "Zaświadczenie wygenerowane",
         "certificate_id": certificate_id,
+        "hash": content_hash,
+        "verify_url": f"/certificates/verify/{content_hash}",
         "volunteer_name": participation['volunteer_name'],
         "initiative_title": participation['initiative_title'],
         "hours": participation['hours_completed']
     }
 
 
+@app.get("/certificates/verify/{content_hash}")
+def verify_certificate(content_hash: str):
+    """Zweryfikuj zaświadczenie po skrócie treści (SHA-256)"""
+    conn = get_db()
+    result = certificates.verify(conn.cursor(), content_hash)
+    conn.close()
+
+    if result is None:
+        raise HTTPException(status_code=404, detail="Zaświadczenie nie znalezione")
+    return result
+
+
 @app.get("/volunteers/{volunteer_id}/certificates")
 def get_volunteer_certificates(volunteer_id: int):
     """Pobierz zaświadczenia wolontariusza"""
     conn = get_db()
+    archive.attach(conn)
     cursor = conn.cursor()
 
     cursor.execute("""
         SELECT c.*, i.title as initiative_title, o.name as organization_name
         FROM certificates c
-        JOIN participations p ON c.participation_id = p.id
-        JOIN initiatives i ON p.initiative_id = i.id
+        JOIN all_participations p ON c.participation_id = p.id
+        JOIN all_initiatives i ON p.initiative_id = i.id
         JOIN users o ON c.organization_id = o.id
         WHERE c.volunteer_id = ?
         ORDER BY c.issued_date DESC
@@ -431,22 +852,38 @@ def get_volunteer_certificates(volunteer_id: int):
 
 # === COORDINATORS ENDPOINTS ===
 
+def _coordinator_students_query(include_archived):
+    _, participations = archive.table_names(include_archived)
+    # Godziny z księgi (obejmują też uczestnictwa przeniesione do archiwum)
+    return queries.Select(f"""
+        SELECT u.*,
+               COUNT(DISTINCT p.id) as total_participations,
+               COALESCE(t.hours, 0) as total_hours
+        FROM users u
+        LEFT JOIN {participations} p ON u.id = p.volunteer_id
+        LEFT JOIN hours_totals t ON t.scope = 'volunteer' AND t.scope_id = u.id
+        WHERE u.user_type = 'volunteer' AND u.school_id = 
+              (SELECT school_id FROM users WHERE id = :coordinator_id)
+    """, {"active": "u.active = :active"}, "GROUP BY u.id")
+
+
+COORDINATOR_STUDENTS_QUERIES = {
+    include_archived: _coordinator_students_query(include_archived)
+    for include_archived in (False, True)
+}
+
+
 @app.get("/coordinators/{coordinator_id}/students")
-def get_coordinator_students(coordinator_id: int):
+def get_coordinator_students(coordinator_id: int, include_archived: bool = False,
+                             include_inactive: bool = False):
     """Pobierz uczniów przypisanych do koordynatora"""
     conn = get_db()
+    archive.tables(conn, include_archived)
     cursor = conn.cursor()
 
-    cursor.execute("""
-        SELECT u.*,
-               COUNT(DISTINCT p.id) as total_participations,
-               SUM(CASE WHEN p.status = 'completed' THEN p.hours_completed ELSE 0 END) as total_hours
-        FROM users u
-        LEFT JOIN participations p ON u.id = p.volunteer_id
-        WHERE u.user_type = 'volunteer' AND u.school_id = 
-              (SELECT school_id FROM users WHERE id = ?)
-        GROUP BY u.id
-    """, (coordinator_id,))
+    cursor.execute(*COORDINATOR_STUDENTS_QUERIES[include_archived].build(
+        coordinator_id=coordinator_id, active=None if include_inactive else 1
+    ))
 
     students = [dict(row) for row in cursor.fetchall()]
     conn.close()
@@ -454,10 +891,35 @@ def get_coordinator_students(coordinator_id: int):
     return {"students": students, "count": len(students)}
 
 
+@app.post("/coordinators/{coordinator_id}/roster")
+def sync_roster(coordinator_id: int, roster_sync: RosterSync):
+    """Synchronizuj listę uczniów szkoły koordynatora (upsert po adresie e-mail)"""
+    conn = get_db()
+    cursor = conn.cursor()
+
+    cursor.execute("SELECT school_id FROM users WHERE id = ? AND user_type = 'coordinator'",
+                   (coordinator_id,))
+    coordinator = cursor.fetchone()
+    if not coordinator or coordinator['school_id'] is None:
+        conn.close()
+        raise HTTPException(status_code=404, detail="Koordynator nie znaleziony")
+
+    try:
+        report = roster.sync(conn, coordinator['school_id'],
+                             [student.model_dump() for student in roster_sync.students],
+                             roster_sync.deactivate_missing)
+    finally:
+        conn.close()
+
+    return {"message": "Lista uczniów zsynchronizowana", "school_id": coordinator['school_id'],
+            **report}
+
+
 @app.get("/coordinators/{coordinator_id}/reports")
-def get_coordinator_reports(coordinator_id: int):
+def get_coordinator_reports(coordinator_id: int, include_archived: bool = False):
     """Wygeneruj raport dla koordynatora"""
     conn = get_db()
+    initiatives, participations = archive.tables(conn, include_archived)
     cursor = conn.cursor()
 
     # Pobierz szkołę koordynatora
@@ -470,25 +932,25 @@ def get_coordinator_reports(coordinator_id: int):
     school_id = result['school_id']
 
     # Statystyki uczniów
-    cursor.execute("""
+    cursor.execute(f"""
         SELECT 
             COUNT(DISTINCT u.id) as total_students,
             COUNT(DISTINCT p.id) as total_participations,
-            SUM(CASE WHEN p.status = 'completed' THEN p.hours_completed ELSE 0 END) as total_hours,
             COUNT(DISTINCT c.id) as total_certificates
         FROM users u
-        LEFT JOIN participations p ON u.id = p.volunteer_id
+        LEFT JOIN {participations} p ON u.id = p.volunteer_id
         LEFT JOIN certificates c ON u.id = c.volunteer_id
         WHERE u.school_id = ? AND u.user_type = 'volunteer'
     """, (school_id,))
 
     stats = dict(cursor.fetchone())
+    stats['total_hours'] = hours.totals(cursor, hours.SCHOOL, school_id)['hours']
 
     # Najpopularniejsze kategorie
-    cursor.execute("""
+    cursor.execute(f"""
         SELECT i.category, COUNT(*) as count
-        FROM participations p
-        JOIN initiatives i ON p.initiative_id = i.id
+        FROM {participations} p
+        JOIN {initiatives} i ON p.initiative_id = i.id
         JOIN users u ON p.volunteer_id = u.id
         WHERE u.school_id = ?
         GROUP BY i.category
@@ -510,20 +972,17 @@ def get_coordinator_reports(coordinator_id: int):
 
 # === USERS ENDPOINTS ===
 
+USERS_QUERY = queries.Select("SELECT * FROM users WHERE 1=1", {
+    "user_type": "user_type = :user_type"
+})
+
+
 @app.get("/users")
 def get_users(user_type: Optional[str] = None):
     """Pobierz listę użytkowników"""
     conn = get_db()
     cursor = conn.cursor()
-
-    query = "SELECT * FROM users WHERE 1=1"
-    params = []
-
-    if user_type:
-        query += " AND user_type = ?"
-        params.append(user_type)
-
-    cursor.execute(query, params)
+    cursor.execute(*USERS_QUERY.build(user_type=user_type))
     users = [dict(row) for row in cursor.fetchall()]
     conn.close()
 
@@ -534,17 +993,140 @@ def get_users(user_type: Optional[str] = None):
 def get_user(user_id: int):
     """Pobierz szczegóły użytkownika"""
     conn = get_db()
-    cursor = conn.cursor()
-
-    cursor.execute("SELECT * FROM users WHERE id = ?", (user_id,))
-    user = cursor.fetchone()
+    user = user_cache.get(conn, user_id)
+    conn.close()
 
     if not user:
-        conn.close()
         raise HTTPException(status_code=404, detail="Użytkownik nie znaleziony")
+    return user
 
+
+# === DISTRICTS ENDPOINTS ===
+
+@app.get("/districts")
+def get_districts():
+    """Dzielnice (wartości filtra location) z aliasami i współrzędnymi środka"""
+    conn = get_db()
+    cursor = conn.cursor()
+
+    cursor.execute("""
+        SELECT d.*, COUNT(i.id) as active_initiatives
+        FROM districts d
+        LEFT JOIN initiatives i ON i.district_id = d.id AND i.status = 'active'
+        GROUP BY d.id
+        ORDER BY d.name
+    """)
+    result = [dict(row) for row in cursor.fetchall()]
+
+    cursor.execute("SELECT alias, district_id FROM district_aliases ORDER BY alias")
+    aliases = {}
+    for row in cursor.fetchall():
+        aliases.setdefault(row['district_id'], []).append(row['alias'])
+    conn.close()
+
+    for district in result:
+        district['aliases'] = aliases.get(district['id'], [])
+    return {"districts": result, "count": len(result)}
+
+
+# === ANALYTICS ENDPOINTS ===
+
+@app.get("/analytics/timeseries")
+def get_timeseries(
+        grain: str = "week",
+        dimension: str = "all",
+        key: Optional[str] = None,
+        date_from: Optional[date] = Query(None, alias="from"),
+        date_to: Optional[date] = Query(None, alias="to"),
+        bucket_days: Optional[int] = Query(None, ge=1, le=366)
+):
+    """Godziny, ukończone uczestnictwa i zgłoszenia w czasie (z agregatów activity_rollups)"""
+    if grain not in rollups.GRAINS:
+        raise HTTPException(status_code=400, detail=f"grain: jedna z {', '.join(rollups.GRAINS)}")
+    if dimension not in rollups.DIMENSIONS:
+        raise HTTPException(status_code=400,
+                            detail=f"dimension: jedna z {', '.join(rollups.DIMENSIONS)}")
+    first_day, last_day = date_range(date_from, date_to)
+
+    # Własna długość okresu: sumowanie dziennych agregatów (domyślnie ostatnie 90 dni)
+    if bucket_days is not None:
+        last_day = last_day if last_day is not None else to_day(date.today())
+        first_day = first_day if first_day is not None else last_day - 89
+        grain = "day"
+
+    conn = get_db()
+    series = rollups.timeseries(conn.cursor(), grain, dimension, key, first_day, last_day)
     conn.close()
-    return dict(user)
+
+    result = []
+    for series_key, points in series.items():
+        if bucket_days is not None:
+            points = rollups.resample(points, first_day, last_day, bucket_days)
+        result.append({"key": series_key, "points": [rollups.point(*point) for point in points]})
+
+    return {
+        "grain": f"{bucket_days}d" if bucket_days is not None else grain,
+        "dimension": dimension,
+        "series": result,
+        "count": len(result)
+    }
+
+
+# === LEADERBOARDS ENDPOINTS ===
+
+@app.get("/leaderboards/{scope}")
+def get_leaderboard(
+        scope: LeaderboardScope,
+        period: str = "all",
+        limit: int = Query(10, ge=1, le=100),
+        offset: int = Query(0, ge=0),
+        id: Optional[int] = None
+):
+    """Ranking według godzin (period: all, month albo RRRR-MM); id - miejsce wybranej pozycji"""
+    try:
+        period = period_key(period)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    conn = get_db()
+    board_scope = LEADERBOARD_SCOPES[scope]
+    entries, total = leaderboards.top(conn, board_scope, period, offset, limit)
+    position = leaderboards.position(conn, board_scope, period, id) if id is not None else None
+
+    # Szkoły nie mają własnych kont - nazwy tylko dla wolontariuszy i organizacji
+    names = {}
+    if scope != LeaderboardScope.schools:
+        ids = [entry[1] for entry in entries] + ([id] if position else [])
+        names = {user_id: user['name'] for user_id, user in user_cache.get_many(conn, ids).items()}
+    conn.close()
+
+    def entry(rank, entity_id, total_hours, completed):
+        return {"rank": rank, "id": entity_id, "name": names.get(entity_id),
+                "hours": total_hours, "completed": completed}
+
+    return {
+        "scope": scope.value,
+        "period": period,
+        "entries": [entry(*row) for row in entries],
+        "total": total,
+        "position": entry(position[0], id, *position[1:]) if position else None
+    }
+
+
+# === BATCH ENDPOINTS ===
+
+@app.post("/batch")
+async def run_batch(batch_request: BatchRequest, request: Request):
+    """Kilka odczytów GET w jednym żądaniu, na wspólnej migawce bazy"""
+    if not batch_request.requests:
+        raise HTTPException(status_code=400, detail="Brak podżądań")
+    if len(batch_request.requests) > batch.MAX_REQUESTS:
+        raise HTTPException(status_code=400,
+                            detail=f"Maksymalnie {batch.MAX_REQUESTS} podżądań w jednym żądaniu")
+
+    responses = await batch.execute(app, request.scope,
+                                    [item.model_dump() for item in batch_request.requests])
+    return {"responses": responses, "count": len(responses)}
 
 
 # === STATISTICS ENDPOINTS ===
@@ -561,12 +1143,13 @@ def get_statistics():
             (SELECT COUNT(*) FROM users WHERE user_type = 'volunteer') as volunteers,
             (SELECT COUNT(*) FROM users WHERE user_type = 'organization') as organizations,
             (SELECT COUNT(*) FROM users WHERE user_type = 'coordinator') as coordinators,
-            (SELECT COUNT(*) FROM initiatives WHERE status = 'active') as active_initiatives,
-            (SELECT COUNT(*) FROM participations WHERE status = 'completed') as completed_participations,
-            (SELECT SUM(hours_completed) FROM participations WHERE status = 'completed') as total_hours
+            (SELECT COUNT(*) FROM initiatives WHERE status = 'active') as active_initiatives
     """)
 
     stats = dict(cursor.fetchone())
+    platform = hours.totals(cursor, hours.PLATFORM, hours.PLATFORM_ID)
+    stats['completed_participations'] = platform['completed']
+    stats['total_hours'] = platform['hours']
 
     # Inicjatywy według kategorii
     cursor.execute("""
@@ -598,6 +1181,50 @@ def get_statistics():
     }
 
 
+# === ADMIN ENDPOINTS ===
+
+@app.post("/admin/backups")
+def create_backup(x_admin_token: Optional[str] = Header(None)):
+    """Kopia zapasowa działającej bazy (krokami, bez blokowania zapisów)"""
+    require_admin(x_admin_token)
+    return backup.backup()
+
+
+@app.get("/admin/backups")
+def get_backups(x_admin_token: Optional[str] = Header(None)):
+    """Zapisane kopie zapasowe od najnowszej"""
+    require_admin(x_admin_token)
+    return {"backups": backup.list_backups(), "keep": backup.KEEP_BACKUPS}
+
+
+@app.post("/admin/maintenance")
+def run_maintenance(x_admin_token: Optional[str] = Header(None)):
+    """Konserwacja bazy: optimize, ANALYZE, checkpoint WAL, incremental_vacuum"""
+    require_admin(x_admin_token)
+    conn = get_db()
+    try:
+        return maintenance.run(conn)
+    finally:
+        conn.close()
+
+
+@app.get("/admin/profiles")
+def get_profiles(x_admin_token: Optional[str] = Header(None)):
+    """Zapisane profile żądań (X-Profile: 1) od najnowszego"""
+    require_admin(x_admin_token)
+    return {"profiles": profiling.list_profiles(), "keep": profiling.KEEP_PROFILES}
+
+
+@app.get("/admin/profiles/{request_id}", response_class=PlainTextResponse)
+def get_profile(request_id: str, x_admin_token: Optional[str] = Header(None)):
+    """Profil żądania o danym X-Request-ID w formacie collapsed (flamegraph)"""
+    require_admin(x_admin_token)
+    profile = profiling.load(request_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Nie znaleziono profilu")
+    return profile
+
+
 if __name__ == "__main__":
     import uvicorn
 
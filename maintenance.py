@@ -0,0 +1,167 @@
+"""
+Konserwacja bazy: statystyki planisty, checkpoint WAL i zwalnianie wolnych stron.
+
+Jeden przebieg (run) wykonuje kolejno:
+
+- PRAGMA optimize z analysis_limit - SQLite sam odświeża statystyki tabel,
+  w których od ostatniego razu dużo się zmieniło,
+- ANALYZE tabel łączonych w raportach (ANALYZED_TABLES), każda w osobnej
+  krótkiej transakcji - planista zna wtedy rozkład wartości w indeksach,
+- PRAGMA wal_checkpoint(TRUNCATE) - przeniesienie WAL do pliku bazy i obcięcie
+  pliku -wal (gdy czytelnicy trzymają starsze strony, checkpoint jest częściowy),
+- PRAGMA incremental_vacuum porcjami po VACUUM_STEP_PAGES stron, każda porcja
+  w osobnej transakcji z przerwą - wolne strony po archiwizacji i czyszczeniu
+  dzienników wracają do systemu plików bez blokowania zapisów na długo.
+
+incremental_vacuum działa tylko w bazach z auto_vacuum = INCREMENTAL. Nowe bazy
+(init_database.py) są tak tworzone; istniejącą trzeba raz przebudować:
+python maintenance.py --enable-incremental-vacuum (pełny VACUUM, blokuje bazę).
+
+Raport zawiera rozmiar pliku, liczbę wolnych stron i rozmiar WAL przed i po.
+Przebieg wykonuje harmonogram raz na dobę albo na żądanie:
+python maintenance.py lub POST /admin/maintenance.
+"""
+
+import argparse
+import os
+import time
+
+import database
+
+# Tabele łączone w raportach organizacji i koordynatorów
+ANALYZED_TABLES = ("users", "initiatives", "participations", "hours_ledger", "certificates")
+
+# Ile wierszy indeksu czyta ANALYZE/optimize (0 - wszystkie); przybliżenie wystarcza planiście
+ANALYSIS_LIMIT = 1000
+
+# Stron zwalnianych w jednej transakcji, limit porcji na przebieg i przerwa między nimi
+VACUUM_STEP_PAGES = 256
+MAX_VACUUM_STEPS = 40
+STEP_PAUSE_SECONDS = 0.01
+
+AUTO_VACUUM_MODES = {0: "none", 1: "full", 2: "incremental"}
+
+
+def _pragma(conn, name):
+    return conn.execute(f"PRAGMA {name}").fetchone()[0]
+
+
+def stats(conn):
+    """Rozmiar pliku, wolne strony i rozmiar WAL"""
+    path = next((row[2] for row in conn.execute("PRAGMA database_list") if row[1] == "main"), "")
+    wal_path = f"{path}-wal"
+    page_size = _pragma(conn, "page_size")
+    return {
+        "file_bytes": _pragma(conn, "page_count") * page_size,
+        "freelist_pages": _pragma(conn, "freelist_count"),
+        "freelist_bytes": _pragma(conn, "freelist_count") * page_size,
+        "wal_bytes": os.path.getsize(wal_path) if path and os.path.exists(wal_path) else 0,
+        "auto_vacuum": AUTO_VACUUM_MODES.get(_pragma(conn, "auto_vacuum"), "none")
+    }
+
+
+def optimize(conn):
+    conn.execute(f"PRAGMA analysis_limit = {ANALYSIS_LIMIT}")
+    conn.execute("PRAGMA optimize").fetchall()
+
+
+def analyze(conn, tables=ANALYZED_TABLES):
+    """ANALYZE wybranych tabel, każda w osobnej transakcji; zwraca przeanalizowane"""
+    conn.execute(f"PRAGMA analysis_limit = {ANALYSIS_LIMIT}")
+    existing = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    analyzed = []
+    for table in tables:
+        if table in existing:
+            conn.execute(f"ANALYZE main.{table}")
+            analyzed.append(table)
+    return analyzed
+
+
+def checkpoint(conn):
+    busy, wal_pages, checkpointed = conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()
+    return {"busy": bool(busy), "wal_pages": wal_pages, "checkpointed_pages": checkpointed}
+
+
+def incremental_vacuum(conn, step_pages=VACUUM_STEP_PAGES, max_steps=MAX_VACUUM_STEPS,
+                       pause=STEP_PAUSE_SECONDS):
+    """Zwolnij wolne strony porcjami; zwraca liczbę zwolnionych stron"""
+    if _pragma(conn, "auto_vacuum") != 2:
+        return 0
+    released = 0
+    for _ in range(max_steps):
+        free = _pragma(conn, "freelist_count")
+        if not free:
+            break
+        # Moduł sqlite3 w execute() wykonuje tylko jeden krok pragmy (jedna strona);
+        # executescript kroczy do końca, a transakcja obejmuje całą porcję
+        try:
+            conn.executescript(f"BEGIN IMMEDIATE; "
+                               f"PRAGMA incremental_vacuum({min(step_pages, free)}); COMMIT;")
+        except Exception:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+        released += free - _pragma(conn, "freelist_count")
+        if pause:
+            time.sleep(pause)
+    return released
+
+
+def enable_incremental_vacuum(conn):
+    """Przełącz bazę na auto_vacuum = INCREMENTAL (pełny VACUUM - tylko poza godzinami ruchu)"""
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    conn.execute("VACUUM")
+
+
+def run(conn):
+    """Pełny przebieg konserwacji; zwraca raport"""
+    # Pragmy poniżej nie mogą działać wewnątrz otwartej transakcji
+    if conn.in_transaction:
+        conn.commit()
+    started = time.time()
+    before = stats(conn)
+    optimize(conn)
+    analyzed = analyze(conn)
+    wal = checkpoint(conn)
+    released = incremental_vacuum(conn)
+    # Strony zwolnione przez vacuum trafiły do WAL - drugi checkpoint go obcina
+    if released:
+        wal = checkpoint(conn)
+    return {
+        "before": before,
+        "after": stats(conn),
+        "analyzed": analyzed,
+        "checkpoint": wal,
+        "vacuumed_pages": released,
+        "duration_ms": round((time.time() - started) * 1000, 1)
+    }
+
+
+def maintenance_job(cursor, today, limit):
+    """Zadanie harmonogramu: pełny przebieg na połączeniu zadania"""
+    run(cursor.connection)
+    return 0, set()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Konserwacja bazy wolontariatu")
+    parser.add_argument("--stats", action="store_true", help="tylko pokaż rozmiary")
+    parser.add_argument("--enable-incremental-vacuum", action="store_true",
+                        help="przebuduj bazę z auto_vacuum = INCREMENTAL (blokuje bazę)")
+    args = parser.parse_args()
+
+    conn = database.connect()
+    if args.stats:
+        print(stats(conn))
+    else:
+        if args.enable_incremental_vacuum:
+            enable_incremental_vacuum(conn)
+            print("✓ auto_vacuum = INCREMENTAL")
+        report = run(conn)
+        for phase in ("before", "after"):
+            item = report[phase]
+            print(f"{phase:>6}: plik {item['file_bytes'] / 1024:.0f} KB, "
+                  f"wolne strony {item['freelist_pages']}, WAL {item['wal_bytes'] / 1024:.0f} KB")
+        print(f"ANALYZE: {', '.join(report['analyzed'])}; zwolniono {report['vacuumed_pages']} stron "
+              f"w {report['duration_ms']} ms")
+    conn.dispose()
@@ -0,0 +1,371 @@
+"""
+Transakcyjny outbox powiadomień.
+
+Endpointy zapisują powiadomienie w tabeli outbox w tej samej transakcji co
+zmiana stanu, więc czas odpowiedzi nie zależy od wysyłki. Dispatcher działający
+w tle (zadanie asyncio w aplikacji lub osobny proces: python outbox.py) pobiera
+zaległe wiadomości partiami, przekazuje je do wybranego ujścia (sink) i ponawia
+nieudane próby z wykładniczym opóźnieniem.
+
+Wiadomości dostarczone (sent) i porzucone (failed) są usuwane przez zadanie
+harmonogramu (purge_job) po RETENTION_DAYS od ostatniej próby - tabela nie
+rośnie bez końca, a pobieranie zaległych partii pozostaje szybkie.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import random
+import threading
+import time
+from datetime import datetime
+
+from starlette.concurrency import run_in_threadpool
+
+import queries
+
+logger = logging.getLogger(__name__)
+
+# Liczba wiadomości pobieranych w jednej partii
+BATCH_SIZE = 50
+
+# Co ile sekund dispatcher sprawdza outbox bez wybudzenia
+POLL_INTERVAL = 5.0
+
+# Na ile sekund partia jest zarezerwowana dla jednego dispatchera
+LEASE_SECONDS = 60.0
+
+# Ponawianie: opóźnienie BASE * 2^próba (z losowym rozrzutem), maks. MAX_ATTEMPTS prób
+RETRY_BASE_SECONDS = 5.0
+RETRY_MAX_SECONDS = 3600.0
+MAX_ATTEMPTS = 8
+
+# Po ilu dniach od ostatniej próby usuwane są wiadomości wysłane i porzucone
+RETENTION_DAYS = int(os.environ.get("OUTBOX_RETENTION_DAYS", "30"))
+
+# Ujście powiadomień, np. "file:notifications.jsonl" lub "smtp://localhost:1025"
+SINK_URL = os.environ.get("NOTIFY_SINK", "file:notifications.jsonl")
+SENDER = os.environ.get("NOTIFY_SENDER", "no-reply@wolontariat.krakow.pl")
+
+SUBJECTS = {
+    "application.created": "Nowe zgłoszenie do inicjatywy",
+    "participation.updated": "Zmiana statusu Twojego zgłoszenia",
+    "certificate.created": "Twoje zaświadczenie jest gotowe",
+}
+
+STATUS_LABELS = {
+    "pending": "oczekujące",
+    "approved": "zatwierdzone",
+    "rejected": "odrzucone",
+    "completed": "ukończone",
+}
+
+
+def enqueue(cursor, kind, recipient_id, data):
+    """Dodaj powiadomienie w bieżącej transakcji (wywołać przed commit)"""
+    cursor.execute("""
+        INSERT INTO outbox (kind, recipient_id, payload, next_attempt_at)
+        VALUES (?, ?, ?, ?)
+    """, (kind, recipient_id, json.dumps(data, ensure_ascii=False), time.time()))
+
+
+def render(message):
+    """Zbuduj temat i treść wiadomości na podstawie rodzaju powiadomienia"""
+    data = message['data']
+    subject = SUBJECTS.get(message['kind'], "Powiadomienie")
+    lines = [f"Dzień dobry {message['recipient_name']},", ""]
+
+    if message['kind'] == "application.created":
+        lines.append(f"Do inicjatywy \"{data['initiative_title']}\" wpłynęło nowe zgłoszenie "
+                     f"(ID: {data['participation_id']}).")
+    elif message['kind'] == "participation.updated":
+        lines.append(f"Status Twojego zgłoszenia do inicjatywy \"{data['initiative_title']}\" "
+                     f"zmienił się na: {STATUS_LABELS.get(data['status'], data['status'])}.")
+        if data.get('hours_completed') is not None:
+            lines.append(f"Zaliczone godziny: {data['hours_completed']}.")
+    elif message['kind'] == "certificate.created":
+        lines.append(f"Wystawiliśmy zaświadczenie nr {data['certificate_id']} za inicjatywę "
+                     f"\"{data['initiative_title']}\" ({data['hours']} godz.).")
+
+    lines += ["", "Krakowskie Cyfrowe Centrum Wolontariatu"]
+    return subject, "\n".join(lines)
+
+
+# === SINKS ===
+
+class NotificationSink:
+    """Ujście powiadomień - podklasy implementują send() lub send_batch()"""
+
+    def send(self, message):
+        raise NotImplementedError
+
+    def send_batch(self, messages):
+        """Wyślij partię; zwraca listę błędów (None = wysłano) w kolejności wiadomości"""
+        errors = []
+        for message in messages:
+            try:
+                self.send(message)
+                errors.append(None)
+            except Exception as e:
+                errors.append(str(e) or type(e).__name__)
+        return errors
+
+
+class FileSink(NotificationSink):
+    """Zapisuje wiadomości do pliku JSONL (środowisko lokalne i testy)"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def send(self, message):
+        self.send_batch([message])
+
+    def send_batch(self, messages):
+        lines = []
+        for message in messages:
+            subject, body = render(message)
+            lines.append(json.dumps({
+                "id": message['id'],
+                "to": message['recipient_email'],
+                "subject": subject,
+                "body": body,
+                "sent_at": datetime.now().isoformat()
+            }, ensure_ascii=False) + "\n")
+
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.writelines(lines)
+        return [None] * len(messages)
+
+
+class SmtpSink(NotificationSink):
+    """Wysyła wiadomości przez SMTP, jedno połączenie na partię"""
+
+    def __init__(self, host, port, sender=SENDER):
+        self.host = host
+        self.port = port
+        self.sender = sender
+
+    def send_batch(self, messages):
+        import smtplib
+        from email.message import EmailMessage
+
+        errors = []
+        with smtplib.SMTP(self.host, self.port, timeout=30) as smtp:
+            for message in messages:
+                subject, body = render(message)
+                email = EmailMessage()
+                email["From"] = self.sender
+                email["To"] = message['recipient_email']
+                email["Subject"] = subject
+                email.set_content(body)
+                try:
+                    smtp.send_message(email)
+                    errors.append(None)
+                except smtplib.SMTPException as e:
+                    errors.append(str(e))
+        return errors
+
+
+def sink_from_url(url):
+    if url.startswith("file:"):
+        return FileSink(url[len("file:"):])
+    if url.startswith("smtp://"):
+        host, _, port = url[len("smtp://"):].partition(":")
+        return SmtpSink(host, int(port or 25))
+    raise ValueError(f"Nieobsługiwane ujście powiadomień: {url}")
+
+
+# === DISPATCHER ===
+
+def _claim_batch(get_db, limit):
+    """Zarezerwuj partię zaległych wiadomości i zwróć je wraz z adresatami"""
+    conn = get_db()
+    try:
+        return _claim(conn, limit)
+    finally:
+        conn.close()
+
+
+def _claim(conn, limit):
+    cursor = conn.cursor()
+    now = time.time()
+
+    cursor.execute("""
+        UPDATE outbox SET locked_until = ?
+        WHERE id IN (
+            SELECT id FROM outbox
+            WHERE status = 'pending' AND next_attempt_at <= ?
+              AND (locked_until IS NULL OR locked_until < ?)
+            ORDER BY id
+            LIMIT ?
+        )
+        RETURNING id
+    """, (now + LEASE_SECONDS, now, now, limit))
+    ids = [row['id'] for row in cursor.fetchall()]
+    conn.commit()
+
+    if not ids:
+        return []
+
+    cursor.execute("""
+        SELECT o.id, o.kind, o.payload, o.attempts,
+               u.email as recipient_email, u.name as recipient_name
+        FROM outbox o
+        JOIN users u ON o.recipient_id = u.id
+        WHERE o.id IN (SELECT value FROM json_each(?))
+        ORDER BY o.id
+    """, (queries.array(ids),))
+    messages = []
+    failed = []
+    for row in cursor.fetchall():
+        message = dict(row)
+        # Wiadomość, z której nie da się zbudować treści, nie uda się przy żadnej próbie -
+        # oznaczamy ją od razu, zamiast przerywać całą partię w ujściu
+        try:
+            message['data'] = json.loads(message.pop('payload'))
+            render(message)
+        except Exception as e:
+            failed.append((f"Nieprawidłowa treść powiadomienia: {type(e).__name__}: {e}", message['id']))
+            continue
+        messages.append(message)
+
+    # Wiadomości do nieistniejących użytkowników nie da się dostarczyć
+    known = {row[1] for row in failed} | {m['id'] for m in messages}
+    failed += [("Nieznany adresat", message_id) for message_id in set(ids) - known]
+    if failed:
+        cursor.executemany("""
+            UPDATE outbox SET status = 'failed', last_error = ?, locked_until = NULL
+            WHERE id = ?
+        """, failed)
+        conn.commit()
+
+    return messages
+
+
+def _record_results(get_db, messages, errors):
+    conn = get_db()
+    try:
+        _record(conn, messages, errors)
+    finally:
+        conn.close()
+
+
+def _record(conn, messages, errors):
+    cursor = conn.cursor()
+    now = time.time()
+    sent = []
+    retries = []
+
+    for message, error in zip(messages, errors):
+        if error is None:
+            sent.append((datetime.now().isoformat(), message['id']))
+            continue
+
+        attempts = message['attempts'] + 1
+        status = 'failed' if attempts >= MAX_ATTEMPTS else 'pending'
+        delay = min(RETRY_BASE_SECONDS * 2 ** (attempts - 1), RETRY_MAX_SECONDS)
+        delay *= random.uniform(0.8, 1.2)
+        retries.append((status, attempts, now + delay, error, message['id']))
+
+    cursor.executemany("""
+        UPDATE outbox SET status = 'sent', sent_at = ?, attempts = attempts + 1, locked_until = NULL
+        WHERE id = ?
+    """, sent)
+    cursor.executemany("""
+        UPDATE outbox SET status = ?, attempts = ?, next_attempt_at = ?, last_error = ?,
+                          locked_until = NULL
+        WHERE id = ?
+    """, retries)
+
+    conn.commit()
+
+
+def purge_job(cursor, today, limit):
+    """Zadanie harmonogramu: usuń najwyżej `limit` wiadomości wysłanych i porzuconych
+    dawniej niż RETENTION_DAYS dni (next_attempt_at - czas ostatniej próby, indeks idx_outbox_due)"""
+    cursor.execute("""
+        DELETE FROM outbox
+        WHERE id IN (
+            SELECT id FROM outbox
+            WHERE status IN ('sent', 'failed') AND next_attempt_at < ?
+            LIMIT ?
+        )
+    """, ((today - RETENTION_DAYS) * 86400, limit))
+    return cursor.rowcount, set()
+
+
+class Dispatcher:
+    """Zadanie w tle dostarczające powiadomienia z outboxa"""
+
+    def __init__(self, get_db, sink):
+        self.get_db = get_db
+        self.sink = sink
+        self._task = None
+        self._loop = None
+        self._wakeup = None
+
+    def wake(self):
+        """Przyspiesz wysyłkę po zatwierdzeniu transakcji (bezpieczne z dowolnego wątku)"""
+        if self._loop is not None:
+            try:
+                self._loop.call_soon_threadsafe(self._wakeup.set)
+            except RuntimeError:
+                pass
+
+    def dispatch_once(self):
+        """Dostarcz jedną partię; zwraca liczbę przetworzonych wiadomości"""
+        messages = _claim_batch(self.get_db, BATCH_SIZE)
+        if not messages:
+            return 0
+
+        try:
+            errors = self.sink.send_batch(messages)
+        except Exception as e:
+            errors = [str(e) or type(e).__name__] * len(messages)
+
+        _record_results(self.get_db, messages, errors)
+        return len(messages)
+
+    async def run(self):
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        while True:
+            self._wakeup.clear()
+            try:
+                processed = await run_in_threadpool(self.dispatch_once)
+            except Exception:
+                # Błąd jednej partii (baza, ujście) nie może zatrzymać wysyłki na stałe;
+                # zarezerwowane wiadomości wrócą po wygaśnięciu dzierżawy
+                logger.exception("Wysyłka partii powiadomień nie powiodła się")
+                processed = 0
+
+            if processed == BATCH_SIZE:
+                continue
+
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self._loop = None
+
+
+if __name__ == "__main__":
+    # Dispatcher jako osobny proces (wtedy w aplikacji ustaw OUTBOX_DISPATCHER=0)
+    from database import get_db
+
+    print(f"Dispatcher powiadomień: {SINK_URL}")
+    asyncio.run(Dispatcher(get_db, sink_from_url(SINK_URL)).run())
@@ -0,0 +1,375 @@
+"""
+Profilowanie pojedynczego żądania na żądanie (nagłówek X-Profile: 1).
+
+Żądanie z nagłówkami X-Profile: 1 i poprawnym X-Admin-Token jest wykonywane
+pod profilerem próbkującym: wątek w tle co INTERVAL_SECONDS zapisuje stos
+wywołań wątków, które w tej chwili pracują dla tego żądania:
+
+- wątek pętli zdarzeń - tylko gdy wykonuje korutyny tego żądania (stos zawiera
+  ramkę ProfileMiddleware.__call__ tego wywołania): odczyt i walidacja treści
+  przez pydantic, zamiana wyniku na JSON, middleware,
+- wątek z puli, w którym działa endpoint (ProfiledRoute) - zapytania SQL
+  i zamiana wierszy na słowniki.
+
+Stosy innych żądań obsługiwanych w tym czasie nie trafiają do profilu.
+Bez nagłówka middleware niczego nie mierzy.
+
+Wynik to stosy w formacie collapsed ("ramka;ramka;ramka liczba_próbek"),
+który przyjmują flamegraph.pl, speedscope i inferno. Plik PROFILE_DIR/<X-Request-ID>.folded
+jest dostępny przez GET /admin/profiles/{request_id}; odpowiedź profilowanego
+żądania ma nagłówek X-Profile ze ścieżką do niego. Middleware wstrzymuje
+odpowiedź do zapisania pliku (w wątku z puli, nie w pętli zdarzeń), więc profil
+istnieje, zanim klient zobaczy nagłówek - odpowiedzi strumieniowe (SSE) nie
+nadają się do profilowania. W katalogu zostaje KEEP_PROFILES najnowszych profili.
+
+Profil dowolnej trasy na wygenerowanej bazie (init_database.py w katalogu
+tymczasowym), z wieloma powtórzeniami dla krótkich żądań:
+    python profiling.py /coordinators/18/reports --repeat 200
+    python profiling.py /initiatives --params status=active --output initiatives.folded
+    python profiling.py /initiatives --method POST --json '{"title": ...}'
+"""
+
+import argparse
+import contextvars
+import functools
+import inspect
+import json
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter
+
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse
+
+import tracing
+
+PROFILE_HEADER = b"x-profile"
+ADMIN_HEADER = b"x-admin-token"
+
+PROFILE_DIR = os.environ.get("VOLUNTEER_PROFILE_DIR", "profiles")
+
+# Ile najnowszych profili zostawiać w katalogu
+KEEP_PROFILES = int(os.environ.get("PROFILE_KEEP", "50"))
+
+# Odstęp próbek; w kodzie zajmującym procesor wątek próbkujący dostaje GIL
+# najwcześniej po sys.getswitchinterval() (domyślnie 5 ms)
+INTERVAL_SECONDS = float(os.environ.get("PROFILE_INTERVAL_SECONDS", "0.001"))
+
+SUFFIX = ".folded"
+
+_profile = contextvars.ContextVar("profile", default=None)
+
+
+class Profile:
+    """Profiler próbkujący wątki zarejestrowane przez enter()"""
+
+    def __init__(self, interval=INTERVAL_SECONDS):
+        self.interval = interval
+        self.samples = 0
+        self.stacks = Counter()
+        # id wątku -> ramka, od której (włącznie) zbierany jest stos
+        self._roots = {}
+        self._names = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def enter(self, frame):
+        """Próbkuj bieżący wątek od ramki `frame`; zwraca poprzednią ramkę dla leave()"""
+        thread_id = threading.get_ident()
+        previous = self._roots.get(thread_id)
+        self._roots[thread_id] = frame
+        return previous
+
+    def leave(self, previous):
+        thread_id = threading.get_ident()
+        if previous is None:
+            self._roots.pop(thread_id, None)
+        else:
+            self._roots[thread_id] = previous
+
+    def _name(self, code):
+        name = self._names.get(code)
+        if name is None:
+            name = self._names[code] = (f"{getattr(code, 'co_qualname', code.co_name)} "
+                                        f"({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        return name
+
+    def _sample(self):
+        frames = sys._current_frames()
+        for thread_id, root in list(self._roots.items()):
+            frame = frames.get(thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(self._name(frame.f_code))
+                if frame is root:
+                    break
+                frame = frame.f_back
+            # Wątek poza kodem tego żądania (np. czeka na pulę albo obsługuje inne)
+            if frame is None:
+                continue
+            self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def collapsed(self):
+        """Stosy w formacie collapsed, od najczęstszego"""
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+# === ENDPOINTY ===
+
+def profile_handler(endpoint):
+    """Opakuj endpoint synchroniczny tak, by wątek z puli był próbkowany w profilowanym żądaniu"""
+    # Korutyny działają w wątku pętli, który próbkuje już middleware
+    if inspect.iscoroutinefunction(endpoint):
+        return endpoint
+
+    @functools.wraps(endpoint)
+    def profiled(*args, **kwargs):
+        profile = _profile.get()
+        if profile is None:
+            return endpoint(*args, **kwargs)
+        previous = profile.enter(sys._getframe())
+        try:
+            return endpoint(*args, **kwargs)
+        finally:
+            profile.leave(previous)
+    return profiled
+
+
+class ProfiledRoute(tracing.TracedRoute):
+    def __init__(self, path, endpoint, **kwargs):
+        super().__init__(path, profile_handler(endpoint), **kwargs)
+
+
+# === ZAPIS PROFILI ===
+
+def _file_name(request_id):
+    # Identyfikator pochodzi z nagłówka klienta - w nazwie pliku tylko bezpieczne znaki
+    return re.sub(r"[^A-Za-z0-9_.-]", "_", request_id)[:100].lstrip(".") + SUFFIX
+
+
+def list_profiles(directory=None):
+    """Profile w katalogu od najnowszego: [{request_id, size, created_at}]"""
+    directory = directory or PROFILE_DIR
+    if not os.path.isdir(directory):
+        return []
+    profiles = []
+    for name in os.listdir(directory):
+        if name.endswith(SUFFIX):
+            stat = os.stat(os.path.join(directory, name))
+            profiles.append((stat.st_mtime, name, stat.st_size))
+    profiles.sort(reverse=True)
+    return [{"request_id": name[:-len(SUFFIX)], "size": size,
+             "created_at": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(mtime))}
+            for mtime, name, size in profiles]
+
+
+def save(profile, request_id, directory=None, keep=KEEP_PROFILES):
+    """Zapisz profil jako PROFILE_DIR/<request_id>.folded i usuń najstarsze; zwraca ścieżkę"""
+    directory = directory or PROFILE_DIR
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, _file_name(request_id))
+    with open(path + ".part", "w", encoding="utf-8") as f:
+        f.write(profile.collapsed())
+    os.replace(path + ".part", path)
+    for old in list_profiles(directory)[keep:]:
+        os.remove(os.path.join(directory, old["request_id"] + SUFFIX))
+    return path
+
+
+def load(request_id, directory=None):
+    """Zapisany profil (tekst collapsed) albo None"""
+    path = os.path.join(directory or PROFILE_DIR, _file_name(request_id))
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return f.read()
+
+
+# === MIDDLEWARE ===
+
+def _header(scope, name):
+    for key, value in scope.get("headers", ()):
+        if key == name:
+            return value.decode("latin-1").strip()
+    return None
+
+
+class ProfileMiddleware:
+    """Middleware ASGI: profil żądania z X-Profile: 1 (authorize(token) sprawdza X-Admin-Token)"""
+
+    def __init__(self, app, authorize, directory=None, interval=INTERVAL_SECONDS):
+        self.app = app
+        self.authorize = authorize
+        self.directory = directory
+        self.interval = interval
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or _header(scope, PROFILE_HEADER) != "1":
+            await self.app(scope, receive, send)
+            return
+
+        if not self.authorize(_header(scope, ADMIN_HEADER)):
+            await JSONResponse({"detail": "Wymagany poprawny nagłówek X-Admin-Token"},
+                               status_code=403)(scope, receive, send)
+            return
+
+        # X-Request-ID nadaje TracingMiddleware (zewnętrzne)
+        request_id = scope.get("state", {}).get("request_id") or uuid.uuid4().hex
+        location = f"/admin/profiles/{_file_name(request_id)[:-len(SUFFIX)]}"
+
+        # Odpowiedź wychodzi dopiero po zapisaniu profilu - X-Profile wskazuje istniejący plik
+        messages = []
+
+        async def hold(message):
+            messages.append(message)
+
+        profile = Profile(self.interval)
+        token = _profile.set(profile)
+        previous = profile.enter(sys._getframe())
+        profile.start()
+        try:
+            await self.app(scope, receive, hold)
+        finally:
+            profile.leave(previous)
+            profile.stop()
+            _profile.reset(token)
+            # Zapis pliku i przegląd katalogu poza pętlą zdarzeń
+            await run_in_threadpool(save, profile, request_id, self.directory)
+
+        for message in messages:
+            if message["type"] == "http.response.start":
+                message = {**message, "headers": [*message.get("headers", ()),
+                                                  (PROFILE_HEADER, location.encode("latin-1"))]}
+            await send(message)
+
+
+# === CLI ===
+
+def hot_spots(stacks, limit):
+    """Funkcje z największą liczbą próbek: własnych (szczyt stosu) i łącznych"""
+    own = Counter()
+    total = Counter()
+    for stack, count in stacks.items():
+        frames = stack.split(";")
+        own[frames[-1]] += count
+        for frame in set(frames):
+            total[frame] += count
+    return own.most_common(limit), total.most_common(limit)
+
+
+def _generate_database(path):
+    """Świeża baza z danymi testowymi (init_database.py) pod ścieżką `path`"""
+    import contextlib
+    import io
+    import init_database
+
+    init_database.DATABASE_PATH = path
+    with contextlib.redirect_stdout(io.StringIO()):
+        conn = init_database.create_database()
+        init_database.populate_test_data(conn)
+    conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Profil trasy API (stosy collapsed dla flamegraph)")
+    parser.add_argument("path", help="ścieżka żądania, np. /coordinators/18/reports")
+    parser.add_argument("--method", default="GET")
+    parser.add_argument("--params", nargs="*", default=[], help="parametry zapytania nazwa=wartość")
+    parser.add_argument("--json", help="treść żądania (JSON)")
+    parser.add_argument("--repeat", type=int, default=100, help="liczba profilowanych żądań")
+    parser.add_argument("--warmup", type=int, default=5, help="żądania przed pomiarem")
+    parser.add_argument("--interval", type=float, default=0.0005, help="odstęp próbek (s)")
+    parser.add_argument("--database", help="kopia tej bazy zamiast wygenerowanej")
+    parser.add_argument("--output", default="profile.folded", help="plik wynikowy (collapsed)")
+    parser.add_argument("--top", type=int, default=15, help="ile funkcji pokazać")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="volunteer-profile-")
+    database_path = os.path.join(workdir, "volunteer.db")
+    if args.database:
+        import sqlite3
+        source = sqlite3.connect(args.database)
+        target = sqlite3.connect(database_path)
+        source.backup(target)
+        source.close()
+        target.close()
+
+    # Konfiguracja aplikacji przed jej importem
+    admin_token = uuid.uuid4().hex
+    os.environ.update({
+        "VOLUNTEER_DB": database_path,
+        "VOLUNTEER_ARCHIVE_DB": os.path.join(workdir, "volunteer_archive.db"),
+        "VOLUNTEER_PROFILE_DIR": os.path.join(workdir, "profiles"),
+        "PROFILE_KEEP": str(args.repeat),
+        "PROFILE_INTERVAL_SECONDS": str(args.interval),
+        "NOTIFY_SINK": "file:" + os.path.join(workdir, "notifications.jsonl"),
+        "ADMIN_TOKEN": admin_token,
+        "SCHEDULER": "0",
+        "OUTBOX_DISPATCHER": "0",
+        "RATE_LIMIT_PER_SECOND": "1000000",
+        "RATE_LIMIT_BURST": "1000000",
+    })
+    if not args.database:
+        _generate_database(database_path)
+
+    # Krótszy przydział GIL - wątek próbkujący nie czeka 5 ms na swoją kolej
+    sys.setswitchinterval(args.interval)
+
+    from fastapi.testclient import TestClient
+    import main as api
+
+    params = dict(param.split("=", 1) for param in args.params)
+    body = json.loads(args.json) if args.json else None
+    headers = {"X-Admin-Token": admin_token}
+
+    stacks = Counter()
+    durations = []
+    with TestClient(api.app) as client:
+        for _ in range(args.warmup):
+            client.request(args.method, args.path, params=params, json=body)
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            response = client.request(args.method, args.path, params=params, json=body,
+                                      headers={**headers, "X-Profile": "1"})
+            durations.append(time.perf_counter() - started)
+            profile = load(response.headers["x-request-id"], os.environ["VOLUNTEER_PROFILE_DIR"])
+            for line in (profile or "").splitlines():
+                stack, count = line.rsplit(" ", 1)
+                stacks[stack] += int(count)
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        f.writelines(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+    durations.sort()
+    samples = sum(stacks.values())
+    print(f"{args.method} {args.path} -> {response.status_code}, {args.repeat} żądań, "
+          f"p50 {durations[len(durations) // 2] * 1000:.2f} ms, próbek: {samples}")
+    own, total = hot_spots(stacks, args.top)
+    for title, rows in (("Czas własny", own), ("Czas łączny", total)):
+        print(f"\n{title}:")
+        for frame, count in rows:
+            print(f"{count / max(samples, 1):>7.1%}  {frame}")
+    print(f"\n✓ Stosy collapsed: {args.output} (flamegraph.pl, speedscope)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Zapytania SQL z opcjonalnymi filtrami w postaci kanonicznej.
+
+Sklejanie zapytania z kawałków (query += " AND ...") daje nowy tekst SQL dla
+każdego zestawu filtrów, a lista "IN (?, ?, ...)" - dla każdej długości listy.
+SQLite kompiluje każdy nowy tekst od zera i wypiera nim z pamięci podręcznej
+połączenia (cached_statements) zapytania, które dało się użyć ponownie.
+
+Dlatego:
+
+- Select/Update deklarują filtry (kolumny) raz, w stałej kolejności; włączone
+  dokładają warunek z parametrem nazwanym (:nazwa), wyłączone - nic. Tekst SQL
+  zależy tylko od zbioru włączonych filtrów (najwyżej 2^n tekstów na zapytanie)
+  i jest budowany raz, a wartości zawsze idą jako parametry,
+- listy identyfikatorów przekazujemy jednym parametrem JSON:
+  "id IN (SELECT value FROM json_each(?))" z wartością array(ids).
+
+statements() wylicza wszystkie teksty zadeklarowanych zapytań - test_queries.py
+sprawdza, że endpointy nie używają innych i że mieszczą się w DB_CACHED_STATEMENTS.
+"""
+
+import itertools
+import json
+
+# Wszystkie zadeklarowane zapytania (do wyliczenia pełnego zbioru tekstów SQL)
+REGISTRY = []
+
+
+def array(values):
+    """Lista wartości jako jeden parametr dla json_each(?)"""
+    return json.dumps(list(values))
+
+
+def _enabled(value):
+    return value is not None and value != ""
+
+
+class _Template:
+    def __init__(self, parts, required=()):
+        # nazwa parametru -> fragment SQL, w kolejności deklaracji
+        self.parts = parts
+        # Fragmenty zawsze obecne w zapytaniu
+        self.required = tuple(required)
+        self._texts = {}
+        REGISTRY.append(self)
+
+    def _render(self, names):
+        raise NotImplementedError
+
+    def sql(self, names):
+        text = self._texts.get(names)
+        if text is None:
+            text = self._texts[names] = self._render(names)
+        return text
+
+    def build(self, **values):
+        """(SQL, parametry) - fragmenty dla wartości innych niż None i pusty tekst"""
+        names = tuple(name for name in self.parts
+                      if name in self.required or _enabled(values.get(name)))
+        return self.sql(names), values
+
+    def statements(self):
+        """Wszystkie możliwe teksty SQL tego zapytania"""
+        optional = [name for name in self.parts if name not in self.required]
+        texts = set()
+        for size in range(len(optional) + 1):
+            for combination in itertools.combinations(optional, size):
+                names = tuple(name for name in self.parts
+                              if name in self.required or name in combination)
+                texts.add(self.sql(names))
+        return texts
+
+
+class Select(_Template):
+    """SELECT z opcjonalnymi warunkami dopisywanymi do WHERE bazowego zapytania"""
+
+    def __init__(self, base, filters, suffix=""):
+        super().__init__(filters)
+        self.base = base.rstrip()
+        self.suffix = suffix.strip()
+
+    def _render(self, names):
+        conditions = "".join(f"\n          AND {self.parts[name]}" for name in names)
+        return f"{self.base}{conditions}\n        {self.suffix}".rstrip()
+
+
+class Update(_Template):
+    """UPDATE z kolumnami ustawianymi tylko wtedy, gdy mają wartość (required - zawsze)"""
+
+    def __init__(self, table, columns, where, required=()):
+        super().__init__({column: f"{column} = :{column}" for column in columns}, required)
+        self.table = table
+        self.where = where
+
+    def _render(self, names):
+        assignments = ", ".join(self.parts[name] for name in names)
+        return f"UPDATE {self.table} SET {assignments} WHERE {self.where}"
+
+
+def statements():
+    """Teksty SQL wszystkich zadeklarowanych zapytań"""
+    texts = set()
+    for query in REGISTRY:
+        texts |= query.statements()
+    return texts
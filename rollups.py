@@ -0,0 +1,194 @@
+"""
+Agregaty czasowe aktywności wolontariuszy (dzień, tydzień, miesiąc).
+
+activity_rollups przechowuje dla każdego okresu sumy godzin, ukończonych
+uczestnictw i zgłoszeń - łącznie (dimension = 'all') oraz w podziale na
+kategorię, szkołę i dzielnicę. Tabela jest uzupełniana przyrostowo: refresh()
+czyta tylko wiersze dopisane od ostatniego odświeżenia (znacznik last_id
+w rollup_state) z dwóch źródeł:
+
+- hours_ledger - zmiany zaliczonych godzin (dzień = koniec inicjatywy),
+- participations - nowe zgłoszenia (dzień = data zgłoszenia).
+
+Odświeżanie wykonuje harmonogram (scheduler.py) partiami; GET /analytics/timeseries
+tylko czyta gotowe sumy. Okresy są zapisane jako numer pierwszego dnia
+(dni od 1970-01-01): tydzień zaczyna się w poniedziałek, miesiąc pierwszego dnia.
+"""
+
+from datetime import timedelta
+
+import queries
+from database import EPOCH, to_day
+
+GRAINS = ("day", "week", "month")
+DIMENSIONS = ("all", "category", "school", "district")
+METRICS = ("hours", "completed", "applications")
+
+# Liczba wierszy źródłowych przetwarzanych w jednej partii
+BATCH_SIZE = 2000
+
+LEDGER_QUERY = """
+    SELECT id, day, category, school_id, district_id, hours, completed
+    FROM hours_ledger
+    WHERE id > ? AND day IS NOT NULL
+    ORDER BY id
+    LIMIT ?
+"""
+
+APPLICATIONS_QUERY = """
+    SELECT p.id, p.applied_day, i.category, u.school_id, i.district_id
+    FROM participations p
+    JOIN initiatives i ON p.initiative_id = i.id
+    JOIN users u ON p.volunteer_id = u.id
+    WHERE p.id > ?
+    ORDER BY p.id
+    LIMIT ?
+"""
+
+TIMESERIES_QUERY = queries.Select("""
+        SELECT key, bucket, hours, completed, applications
+        FROM activity_rollups
+        WHERE grain = :grain AND dimension = :dimension
+    """, {
+    "key": "key = :key",
+    "from_bucket": "bucket >= :from_bucket",
+    "to_day": "bucket <= :to_day",
+}, "ORDER BY key, bucket")
+
+
+def to_date(day):
+    return EPOCH + timedelta(days=day)
+
+
+def bucket_start(grain, day):
+    """Pierwszy dzień okresu zawierającego dzień `day`"""
+    if grain == "week":
+        # 1970-01-01 był czwartkiem: (day + 3) % 7 to dzień tygodnia z poniedziałkiem = 0
+        return day - (day + 3) % 7
+    if grain == "month":
+        return to_day(to_date(day).replace(day=1))
+    return day
+
+
+def _add(sums, day, category, school_id, district_id, values):
+    keys = [("all", ""), ("category", category), ("school", school_id), ("district", district_id)]
+    for grain in GRAINS:
+        bucket = bucket_start(grain, day)
+        for dimension, key in keys:
+            if key is None:
+                continue
+            totals = sums.setdefault((grain, dimension, str(key), bucket), [0, 0, 0])
+            for index, value in enumerate(values):
+                totals[index] += value
+
+
+def _last_id(cursor, source):
+    cursor.execute("SELECT last_id FROM rollup_state WHERE source = ?", (source,))
+    row = cursor.fetchone()
+    return row[0] if row else 0
+
+
+def _set_last_id(cursor, source, last_id):
+    cursor.execute("""
+        INSERT INTO rollup_state (source, last_id) VALUES (?, ?)
+        ON CONFLICT(source) DO UPDATE SET last_id = excluded.last_id
+    """, (source, last_id))
+
+
+def refresh_batch(cursor, limit=BATCH_SIZE):
+    """Dolicz jedną partię nowych wierszy źródłowych; zwraca ich największą liczbę ze źródeł"""
+    sums = {}
+
+    cursor.execute(LEDGER_QUERY, (_last_id(cursor, "hours_ledger"), limit))
+    ledger = cursor.fetchall()
+    for _, day, category, school_id, district_id, hours, completed in ledger:
+        _add(sums, day, category, school_id, district_id, (hours, completed, 0))
+
+    cursor.execute(APPLICATIONS_QUERY, (_last_id(cursor, "participations"), limit))
+    applications = cursor.fetchall()
+    for _, day, category, school_id, district_id in applications:
+        if day is not None:
+            _add(sums, day, category, school_id, district_id, (0, 0, 1))
+
+    if sums:
+        cursor.executemany("""
+            INSERT INTO activity_rollups
+            (grain, dimension, key, bucket, hours, completed, applications)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(grain, dimension, key, bucket) DO UPDATE SET
+                hours = hours + excluded.hours,
+                completed = completed + excluded.completed,
+                applications = applications + excluded.applications
+        """, [(*key, *values) for key, values in sums.items()])
+    if ledger:
+        _set_last_id(cursor, "hours_ledger", ledger[-1][0])
+    if applications:
+        _set_last_id(cursor, "participations", applications[-1][0])
+    return max(len(ledger), len(applications))
+
+
+def refresh(cursor, limit=BATCH_SIZE):
+    """Dolicz wszystkie nowe wiersze (w jednej transakcji - migracje i dane testowe)"""
+    while refresh_batch(cursor, limit) == limit:
+        pass
+
+
+def rebuild(cursor):
+    """Przelicz agregaty od zera"""
+    cursor.execute("DELETE FROM activity_rollups")
+    for source in ("hours_ledger", "participations"):
+        _set_last_id(cursor, source, 0)
+    refresh(cursor)
+
+
+def refresh_job(cursor, today, limit):
+    """Zadanie harmonogramu: jedna partia odświeżenia"""
+    return refresh_batch(cursor, limit), set()
+
+
+def timeseries(cursor, grain, dimension, key=None, from_day=None, to_day=None):
+    """Szeregi {klucz: [(początek okresu, godziny, ukończone, zgłoszenia)]}"""
+    cursor.execute(*TIMESERIES_QUERY.build(
+        grain=grain, dimension=dimension,
+        key=str(key) if key is not None else None,
+        from_bucket=bucket_start(grain, from_day) if from_day is not None else None,
+        to_day=to_day
+    ))
+
+    series = {}
+    for row_key, bucket, *values in cursor.fetchall():
+        series.setdefault(row_key, []).append((bucket, *values))
+    return series
+
+
+def resample(points, start, end, width):
+    """Zsumuj punkty dzienne w okresy po `width` dni od dnia `start` do `end`.
+
+    Z NumPy (jeśli zainstalowany) sumowanie jest wektorowe, bez niego - pętlą.
+    """
+    count = (end - start) // width + 1
+    points = [point for point in points if start <= point[0] <= end]
+    try:
+        import numpy
+    except ImportError:
+        numpy = None
+
+    if numpy is not None and points:
+        data = numpy.array(points, dtype=numpy.int64)
+        index = (data[:, 0] - start) // width
+        columns = [numpy.bincount(index, weights=data[:, column], minlength=count)
+                   for column in range(1, data.shape[1])]
+        totals = numpy.stack(columns, axis=1).astype(numpy.int64).tolist()
+    else:
+        totals = [[0] * len(METRICS) for _ in range(count)]
+        for bucket, *values in points:
+            row = totals[(bucket - start) // width]
+            for index, value in enumerate(values):
+                row[index] += value
+
+    return [(start + index * width, *values) for index, values in enumerate(totals)]
+
+
+def point(bucket, hours, completed, applications):
+    return {"start": to_date(bucket).isoformat(), "hours": hours,
+            "completed": completed, "applications": applications}
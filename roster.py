@@ -0,0 +1,152 @@
+"""
+Synchronizacja listy uczniów szkoły (dla koordynatorów).
+
+Koordynator przesyła pełną listę uczniów swojej szkoły. Lista jest porównywana
+z bazą w jednym przebiegu, na zbiorach adresów e-mail (bez rozróżniania wielkości
+liter - "Jan@X.pl" w bazie to ten sam uczeń co "jan@x.pl" na liście):
+
+- adresy spoza bazy -> nowi uczniowie (inserted),
+- adresy w bazie z innymi danymi, bez szkoły albo z nieaktywnym kontem -> updated,
+- adresy w bazie z tymi samymi danymi -> unchanged (bez zapisu),
+- adresy uczniów innej szkoły -> errors (konto nie jest przenoszone),
+- uczniowie szkoły spoza listy -> missing; z deactivate_missing=true ich konta
+  są dezaktywowane (active = 0), historia uczestnictw pozostaje.
+
+Zapisy idą przez executemany (nowe konta - INSERT, istniejące - UPDATE po id)
+porcjami po BATCH_SIZE, każda porcja w osobnej transakcji.
+"""
+
+import queries
+
+# Liczba wierszy zapisywanych w jednej transakcji (i adresów w jednym zapytaniu IN)
+BATCH_SIZE = 500
+
+AGE_CATEGORIES = {"minor", "adult", None}
+
+# Pola porównywane przy wykrywaniu zmian
+COMPARED_FIELDS = ("name", "phone", "age_category", "school_id", "active")
+
+# Pola, których brak na liście nie kasuje wartości zapisanej w bazie
+OPTIONAL_FIELDS = ("phone", "age_category")
+
+INSERT_QUERY = """
+    INSERT INTO users (name, email, phone, user_type, age_category, school_id, active)
+    VALUES (:name, :email, :phone, 'volunteer', :age_category, :school_id, 1)
+    ON CONFLICT(email) DO NOTHING
+"""
+
+# Konto dopasowane po adresie bez rozróżniania wielkości liter - zapis po id
+# (ON CONFLICT(email) porównuje adresy dokładnie), adres w bazie bez zmian
+UPDATE_QUERY = """
+    UPDATE users SET
+        name = :name,
+        phone = COALESCE(:phone, phone),
+        age_category = COALESCE(:age_category, age_category),
+        school_id = :school_id,
+        active = 1
+    WHERE id = :id AND user_type = 'volunteer'
+"""
+
+
+def _chunks(items, size=BATCH_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _normalize(students):
+    """Wiersze listy po oczyszczeniu; zwraca (e-mail -> uczeń, błędy wierszy)"""
+    roster = {}
+    errors = []
+    for number, student in enumerate(students, start=1):
+        email = (student.get("email") or "").strip().lower()
+        name = (student.get("name") or "").strip()
+        age_category = student.get("age_category") or None
+        if not name or "@" not in email:
+            error = "Wymagane imię i nazwisko oraz adres e-mail"
+        elif age_category not in AGE_CATEGORIES:
+            error = "age_category: minor albo adult"
+        elif email in roster:
+            error = "Adres e-mail powtarza się na liście"
+        else:
+            error = None
+
+        if error:
+            errors.append({"row": number, "email": email, "error": error})
+        else:
+            roster[email] = {"name": name, "email": email,
+                             "phone": (student.get("phone") or "").strip() or None,
+                             "age_category": age_category}
+    return roster, errors
+
+
+def _existing(cursor, emails):
+    """Konta o podanych adresach (małymi literami) - zapytania IN porcjami po lower(email)"""
+    found = {}
+    for chunk in _chunks(sorted(emails)):
+        cursor.execute("""
+            SELECT id, email, user_type, name, phone, age_category, school_id, active
+            FROM users WHERE lower(email) IN (SELECT value FROM json_each(?))
+            ORDER BY id
+        """, (queries.array(chunk),))
+        for row in cursor.fetchall():
+            # Kilka kont różniących się tylko wielkością liter - pierwsze (najstarsze)
+            found.setdefault(row['email'].lower(), row)
+    return found
+
+
+def sync(conn, school_id, students, deactivate_missing=False):
+    """Zsynchronizuj uczniów szkoły z listą (słowniki name/email/phone/age_category)"""
+    cursor = conn.cursor()
+    roster, errors = _normalize(students)
+
+    existing = _existing(cursor, roster.keys())
+    cursor.execute("""
+        SELECT id, email FROM users
+        WHERE school_id = ? AND user_type = 'volunteer' AND active = 1
+    """, (school_id,))
+    enrolled = {row['email'].lower(): row['id'] for row in cursor.fetchall()}
+
+    inserts = []
+    updates = []
+    unchanged = 0
+    for email, student in roster.items():
+        student.update(school_id=school_id, active=1)
+        current = existing.get(email)
+        if current is None:
+            inserts.append(student)
+        elif current['user_type'] != 'volunteer':
+            errors.append({"email": email, "error": "Adres e-mail należy do konta innego typu"})
+        elif current['school_id'] is not None and current['school_id'] != school_id:
+            errors.append({"email": email, "error": "Uczeń jest przypisany do innej szkoły"})
+        elif any(current[field] != student[field] for field in COMPARED_FIELDS
+                 if student[field] is not None or field not in OPTIONAL_FIELDS):
+            updates.append({**student, "id": current['id']})
+        else:
+            unchanged += 1
+
+    missing = sorted(enrolled.keys() - roster.keys())
+
+    for chunk in _chunks(inserts):
+        cursor.executemany(INSERT_QUERY, chunk)
+        conn.commit()
+    for chunk in _chunks(updates):
+        cursor.executemany(UPDATE_QUERY, chunk)
+        conn.commit()
+
+    deactivated = 0
+    if deactivate_missing:
+        for chunk in _chunks(missing):
+            cursor.executemany("UPDATE users SET active = 0 WHERE id = ?",
+                               [(enrolled[email],) for email in chunk])
+            conn.commit()
+            deactivated += len(chunk)
+
+    return {
+        "inserted": len(inserts),
+        "updated": len(updates),
+        "unchanged": unchanged,
+        "missing": len(missing),
+        "deactivated": deactivated,
+        "missing_emails": missing[:100],
+        "errors": errors
+    }
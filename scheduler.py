@@ -0,0 +1,328 @@
+"""
+Zadania okresowe: zmiany statusów zależne od upływu czasu.
+
+- aktywne inicjatywy po dacie zakończenia przechodzą w status completed,
+- zgłoszenia oczekujące dłużej niż PENDING_EXPIRY_DAYS albo dotyczące
+  zakończonych już inicjatyw są odrzucane (z wyjaśnieniem w feedback
+  i powiadomieniem wolontariusza),
+- sumy godzin są okresowo porównywane z księgą i poprawiane (hours.Reconciler),
+- agregaty czasowe (rollups.py) są co minutę uzupełniane o nowe wiersze,
+- wysłane i porzucone powiadomienia starsze niż outbox.RETENTION_DAYS są usuwane,
+- raz na dobę baza przechodzi konserwację (maintenance.py: ANALYZE, checkpoint, vacuum),
+- opcjonalnie (BACKUP_INTERVAL_SECONDS) powstaje kopia zapasowa bazy (backup.py).
+
+Harmonogram działa w aplikacji (zadanie asyncio uruchamiane w lifespan), ale
+przy kilku workerach zadania wykonuje tylko jeden z nich - lider trzymający
+dzierżawę w tabeli scheduler_leases i odnawiający ją przed każdym zadaniem
+i każdą partią. Gdy lider zniknie, dzierżawa wygasa po LEASE_SECONDS i przejmuje
+ją inny worker; lider, który dzierżawę utracił, przerywa cykl.
+Zadania pracują partiami po BATCH_SIZE wierszy, każda partia w osobnej krótkiej
+transakcji, więc harmonogram nie blokuje na długo zapisów z endpointów.
+Błąd zadania jest zapisywany w scheduler_jobs.error i nie zatrzymuje harmonogramu.
+
+Jednorazowe uruchomienie wszystkich zadań: python scheduler.py --force
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import socket
+import sqlite3
+import time
+import uuid
+from datetime import date
+
+from starlette.concurrency import run_in_threadpool
+
+import backup
+import events
+import hours
+import maintenance
+import outbox
+import queries
+import rollups
+from database import to_day
+
+# Co ile sekund harmonogram sprawdza, czy któreś zadanie jest do wykonania
+TICK_SECONDS = float(os.environ.get("SCHEDULER_TICK_SECONDS", "30"))
+
+# Ważność dzierżawy lidera (odnawiana w każdym cyklu)
+LEASE_SECONDS = 90.0
+LEASE_NAME = "scheduler"
+
+# Liczba wierszy zmienianych w jednej transakcji i limit partii na jedno wykonanie
+BATCH_SIZE = 100
+MAX_BATCHES = 50
+
+# Po ilu dniach nierozpatrzone zgłoszenie wygasa
+PENDING_EXPIRY_DAYS = int(os.environ.get("PENDING_EXPIRY_DAYS", "30"))
+
+FEEDBACK_INITIATIVE_ENDED = "Zgłoszenie wygasło - inicjatywa już się zakończyła"
+FEEDBACK_NOT_REVIEWED = "Zgłoszenie wygasło - organizacja nie rozpatrzyła go na czas"
+
+logger = logging.getLogger(__name__)
+
+
+# === ZADANIA ===
+# Każde zadanie przetwarza najwyżej `limit` wierszy w bieżącej transakcji
+# i zwraca (liczba przetworzonych, kanały zdarzeń do obudzenia po commit).
+
+def complete_finished_initiatives(cursor, today, limit):
+    """Aktywne inicjatywy po dacie zakończenia -> completed"""
+    cursor.execute("""
+        UPDATE initiatives SET status = 'completed'
+        WHERE id IN (
+            SELECT id FROM initiatives
+            WHERE status = 'active' AND end_day < ?
+            LIMIT ?
+        )
+        RETURNING id, organization_id
+    """, (today, limit))
+    rows = cursor.fetchall()
+
+    channels = set()
+    for row in rows:
+        event = {"initiative_id": row['id'], "status": "completed"}
+        channels.add(events.publish(cursor, events.INITIATIVES_CHANNEL, "initiative.updated", event))
+        channels.add(events.publish(cursor, events.organization_channel(row['organization_id']),
+                                    "initiative.updated", event))
+    return len(rows), channels
+
+
+def expire_pending_applications(cursor, today, limit):
+    """Nierozpatrzone zgłoszenia: zbyt stare albo do zakończonych inicjatyw -> rejected"""
+    cursor.execute("""
+        UPDATE participations
+        SET status = 'rejected',
+            feedback = CASE
+                WHEN (SELECT end_day FROM initiatives WHERE id = participations.initiative_id) < :today
+                THEN :ended ELSE :not_reviewed
+            END
+        WHERE id IN (
+            SELECT p.id FROM participations p
+            JOIN initiatives i ON i.id = p.initiative_id
+            WHERE p.status = 'pending'
+              AND (p.applied_day < :cutoff OR i.end_day < :today)
+            LIMIT :limit
+        )
+        RETURNING id
+    """, {"today": today, "cutoff": today - PENDING_EXPIRY_DAYS, "limit": limit,
+          "ended": FEEDBACK_INITIATIVE_ENDED, "not_reviewed": FEEDBACK_NOT_REVIEWED})
+    expired = [row['id'] for row in cursor.fetchall()]
+    if not expired:
+        return 0, set()
+
+    cursor.execute("""
+        SELECT p.id, p.volunteer_id, p.initiative_id, p.feedback,
+               i.organization_id, i.title as initiative_title
+        FROM participations p
+        JOIN initiatives i ON p.initiative_id = i.id
+        WHERE p.id IN (SELECT value FROM json_each(?))
+    """, (queries.array(expired),))
+
+    channels = set()
+    for row in cursor.fetchall():
+        event = {
+            "participation_id": row['id'],
+            "initiative_id": row['initiative_id'],
+            "volunteer_id": row['volunteer_id'],
+            "status": "rejected",
+            "feedback": row['feedback']
+        }
+        channels.add(events.publish(cursor, events.volunteer_channel(row['volunteer_id']),
+                                    "participation.updated", event))
+        channels.add(events.publish(cursor, events.organization_channel(row['organization_id']),
+                                    "participation.updated", event))
+        outbox.enqueue(cursor, "participation.updated", row['volunteer_id'],
+                       {**event, "initiative_title": row['initiative_title']})
+    return len(expired), channels
+
+
+# Pozycja sprawdzania sum przechodzi między partiami i wykonaniami zadania
+hours_reconciler = hours.Reconciler()
+
+
+def refresh_hours_totals(cursor, today, limit):
+    """Porównaj z księgą kolejne sumy godzin i popraw rozbieżne (dryf sum bieżących)"""
+    checked, _ = hours_reconciler.step(cursor, limit)
+    return checked, set()
+
+
+# (nazwa, odstęp między wykonaniami w sekundach, funkcja)
+JOBS = [
+    ("complete_initiatives", 300, complete_finished_initiatives),
+    ("expire_applications", 3600, expire_pending_applications),
+    ("refresh_hours_totals", 3600, refresh_hours_totals),
+    ("refresh_rollups", 60, rollups.refresh_job),
+    ("purge_outbox", 3600, outbox.purge_job),
+    ("maintenance", 86400, maintenance.maintenance_job),
+]
+
+# Kopie zapasowe według harmonogramu tylko na żądanie (np. 86400 - raz na dobę)
+BACKUP_INTERVAL_SECONDS = int(os.environ.get("BACKUP_INTERVAL_SECONDS", "0"))
+if BACKUP_INTERVAL_SECONDS > 0:
+    JOBS.append(("backup", BACKUP_INTERVAL_SECONDS, backup.backup_job))
+
+
+# === DZIERŻAWA I STAN ZADAŃ ===
+
+def acquire_lease(get_db, owner, now=None):
+    """Przejmij lub odnów dzierżawę lidera; zwraca True, jeśli należy do owner"""
+    now = now or time.time()
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute("""
+        INSERT INTO scheduler_leases (name, owner, expires_at)
+        VALUES (?, ?, ?)
+        ON CONFLICT(name) DO UPDATE SET
+            owner = excluded.owner,
+            expires_at = excluded.expires_at
+        WHERE scheduler_leases.owner = excluded.owner
+           OR scheduler_leases.expires_at < ?
+    """, (LEASE_NAME, owner, now + LEASE_SECONDS, now))
+    acquired = cursor.rowcount == 1
+    conn.commit()
+    conn.close()
+    return acquired
+
+
+def release_lease(get_db, owner):
+    conn = get_db()
+    conn.execute("DELETE FROM scheduler_leases WHERE name = ? AND owner = ?", (LEASE_NAME, owner))
+    conn.commit()
+    conn.close()
+
+
+def _last_runs(get_db):
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute("SELECT name, last_run_at FROM scheduler_jobs")
+    last_runs = {row['name']: row['last_run_at'] for row in cursor.fetchall()}
+    conn.close()
+    return last_runs
+
+
+def _record_run(get_db, name, started, processed, error):
+    conn = get_db()
+    conn.execute("""
+        INSERT INTO scheduler_jobs (name, last_run_at, duration_ms, processed, error)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(name) DO UPDATE SET
+            last_run_at = excluded.last_run_at,
+            duration_ms = excluded.duration_ms,
+            processed = excluded.processed,
+            error = excluded.error
+    """, (name, started, (time.time() - started) * 1000, processed, error))
+    conn.commit()
+    conn.close()
+
+
+def run_job(get_db, name, job, on_commit=None, today=None, renew=None):
+    """Wykonaj zadanie partiami (każda partia w osobnej transakcji); zwraca liczbę zmian.
+
+    renew() jest wywoływane przed każdą kolejną partią; False przerywa zadanie.
+    """
+    today = today if today is not None else to_day(date.today())
+    started = time.time()
+    processed = 0
+    error = None
+    try:
+        for batch in range(MAX_BATCHES):
+            if batch and renew is not None and not renew():
+                error = "Utracono dzierżawę lidera"
+                break
+            conn = get_db()
+            try:
+                cursor = conn.cursor()
+                count, channels = job(cursor, today, BATCH_SIZE)
+                conn.commit()
+            finally:
+                conn.close()
+            processed += count
+            if channels and on_commit is not None:
+                on_commit(channels)
+            if count < BATCH_SIZE:
+                break
+    except Exception as e:
+        # Np. pełny dysk przy kopii zapasowej - zadanie wróci w następnym cyklu
+        logger.exception("Zadanie %s nie powiodło się", name)
+        error = f"{type(e).__name__}: {e}"
+    _record_run(get_db, name, started, processed, error)
+    return processed
+
+
+class Scheduler:
+    """Zadanie w tle wykonujące JOBS, gdy ten proces jest liderem"""
+
+    def __init__(self, get_db, on_commit=None, jobs=None):
+        self.get_db = get_db
+        self.on_commit = on_commit
+        self.jobs = jobs or JOBS
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._task = None
+
+    def tick(self, force=False):
+        """Jeden cykl: odnów dzierżawę i wykonaj zaległe zadania.
+
+        Zwraca słownik nazwa -> liczba zmian albo None, gdy liderem jest inny proces.
+        """
+        if not self.renew():
+            return None
+        now = time.time()
+        last_runs = _last_runs(self.get_db)
+        results = {}
+        for name, interval, job in self.jobs:
+            if force or now - last_runs.get(name, 0) >= interval:
+                # Cykl kilku zadań może trwać dłużej niż dzierżawa - odnawiamy ją przed każdym
+                if results and not self.renew():
+                    break
+                results[name] = run_job(self.get_db, name, job, self.on_commit, renew=self.renew)
+        return results
+
+    def renew(self):
+        """Odnów dzierżawę lidera; False, gdy przejął ją inny proces"""
+        return acquire_lease(self.get_db, self.owner)
+
+    async def run(self):
+        while True:
+            try:
+                await run_in_threadpool(self.tick)
+            except Exception:
+                # Harmonogram działa dalej - następny cykl spróbuje ponownie
+                logger.exception("Cykl harmonogramu nie powiódł się")
+            await asyncio.sleep(TICK_SECONDS)
+
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            # Następny worker nie musi czekać na wygaśnięcie dzierżawy
+            try:
+                await run_in_threadpool(release_lease, self.get_db, self.owner)
+            except sqlite3.Error:
+                pass
+
+
+if __name__ == "__main__":
+    from database import get_db
+
+    parser = argparse.ArgumentParser(description="Jednorazowe wykonanie zadań okresowych")
+    parser.add_argument("--force", action="store_true",
+                        help="wykonaj wszystkie zadania niezależnie od odstępów")
+    args = parser.parse_args()
+
+    scheduler = Scheduler(get_db)
+    results = scheduler.tick(force=args.force)
+    release_lease(get_db, scheduler.owner)
+    if results is None:
+        print("Zadania wykonuje obecnie inny proces (dzierżawa lidera jest zajęta)")
+    for name, processed in (results or {}).items():
+        print(f"{name}: {processed}")
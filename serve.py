@@ -0,0 +1,82 @@
+"""
+Produkcyjne uruchomienie API na wielu procesach.
+
+Migracje są wykonywane raz, przed uruchomieniem workerów; same workery tylko
+sprawdzają wersję schematu. Baza działa w trybie WAL z busy_timeout, dzięki
+czemu wiele procesów może współdzielić volunteer.db bez błędów
+"database is locked".
+
+Uruchomienie: python serve.py --workers 4 --host 0.0.0.0 --port 8000
+"""
+
+import argparse
+import os
+import socket
+
+import database
+import init_database
+
+
+def default_workers():
+    """Liczba workerów: WEB_CONCURRENCY lub liczba rdzeni (maks. 8)"""
+    if os.environ.get("WEB_CONCURRENCY"):
+        return int(os.environ["WEB_CONCURRENCY"])
+    return max(1, min(os.cpu_count() or 1, 8))
+
+
+def prepare_database():
+    """Przełącz bazę w tryb WAL i zastosuj migracje (raz, przed startem workerów)"""
+    conn = database.connect()
+    version = init_database.migrate(conn)
+    conn.dispose()
+    return version
+
+
+def bind_socket(host, port):
+    """Gniazdo nasłuchujące współdzielone przez workery.
+
+    Tworzymy je sami z jawnym IPPROTO_TCP: gniazdo uvicorna ma proto=0, które
+    przechodzi na połączenia w workerach, a asyncio ustawia TCP_NODELAY tylko
+    dla proto=IPPROTO_TCP. Bez tego każda odpowiedź czeka ~40 ms (Nagle +
+    opóźnione ACK).
+    """
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM, socket.IPPROTO_TCP)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.set_inheritable(True)
+    return sock
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Uruchom API Krakowskiego Centrum Wolontariatu")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=default_workers(),
+                        help="liczba procesów (domyślnie WEB_CONCURRENCY lub liczba rdzeni)")
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args()
+
+    version = prepare_database()
+    print(f"✓ Schemat bazy w wersji {version} ({database.DATABASE_PATH}, tryb WAL)")
+
+    # Workery dziedziczą środowisko - nie powtarzają migracji
+    os.environ["RUN_MIGRATIONS"] = "0"
+
+    import uvicorn
+    from uvicorn.supervisors import Multiprocess
+
+    print(f"✓ Uruchamiam {args.workers} workerów na http://{args.host}:{args.port}")
+    config = uvicorn.Config("main:app", host=args.host, port=args.port,
+                            workers=args.workers, log_level=args.log_level)
+    server = uvicorn.Server(config)
+
+    if args.workers > 1:
+        sock = bind_socket(args.host, args.port)
+        Multiprocess(config, target=server.run, sockets=[sock]).run()
+    else:
+        server.run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""
+Faza startowa aplikacji.
+
+Przy starcie sprawdzamy wersję schematu i otwieramy pulę połączeń, a następnie
+w tle rozgrzewamy aplikację: każde połączenie z puli wykonuje po jednym
+żądaniu GET do każdego endpointu. Kompiluje to zapytania w statement cache
+każdego połączenia, wczytuje strony bazy do pamięci i buduje walidatory
+pydantic przed pierwszym prawdziwym żądaniem. Do tego czasu GET /ready
+zwraca 503.
+"""
+
+import time
+
+from fastapi.routing import APIRoute
+
+import database
+import init_database
+
+# Zapytania dobierające istniejące identyfikatory do parametrów ścieżek
+SAMPLE_IDS = {
+    "initiative_id": "SELECT MIN(id) FROM initiatives",
+    "volunteer_id": "SELECT MIN(id) FROM users WHERE user_type = 'volunteer'",
+    "org_id": "SELECT MIN(id) FROM users WHERE user_type = 'organization'",
+    "coordinator_id": "SELECT MIN(id) FROM users WHERE user_type = 'coordinator'",
+    "user_id": "SELECT MIN(id) FROM users",
+    "content_hash": "SELECT MIN(content_hash) FROM certificates",
+    # Parametr ścieżki rankingów (nazwa zakresu, nie identyfikator)
+    "scope": "SELECT 'volunteers'",
+}
+
+state = {
+    "ready": False,
+    "warmup_seconds": None,
+    "warmed_routes": 0,
+    "errors": [],
+}
+
+
+def check_schema(conn):
+    """Przerwij start, jeśli baza ma inną wersję schematu niż kod"""
+    cursor = conn.cursor()
+    cursor.execute("PRAGMA user_version")
+    version = cursor.fetchone()[0]
+    if version != init_database.SCHEMA_VERSION:
+        raise RuntimeError(f"Nieprawidłowa wersja schematu bazy: {version} "
+                           f"(oczekiwano {init_database.SCHEMA_VERSION}) - uruchom migracje")
+    return version
+
+
+def _sample_ids(conn):
+    cursor = conn.cursor()
+    ids = {}
+    for name, query in SAMPLE_IDS.items():
+        cursor.execute(query)
+        ids[name] = cursor.fetchone()[0] or 1
+    conn.close()
+    return ids
+
+
+def warmup_paths(app, skip_paths=()):
+    """Ścieżki GET do rozgrzania (z identyfikatorami istniejących rekordów)"""
+    ids = _sample_ids(database.get_db())
+    paths = []
+    for route in app.routes:
+        if not isinstance(route, APIRoute) or "GET" not in route.methods:
+            continue
+        if route.path in skip_paths:
+            continue
+        params = {name: ids.get(name, 1) for name in route.param_convertors}
+        paths.append(route.path.format(**params))
+    return paths
+
+
+async def _asgi_get(app, path):
+    """Wykonaj żądanie GET wewnątrz procesu i zwróć kod odpowiedzi"""
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": b"",
+        "root_path": "",
+        "headers": [(b"host", b"warmup")],
+        "client": ("warmup", 0),
+        "server": ("warmup", 80),
+        "app": app,
+    }
+    status = {}
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            status["code"] = message["status"]
+
+    await app(scope, receive, send)
+    return status.get("code")
+
+
+async def warmup(app, skip_paths=()):
+    """Rozgrzej każde połączenie z puli wszystkimi endpointami GET"""
+    started = time.perf_counter()
+    paths = warmup_paths(app, skip_paths)
+
+    for conn in database.pool.drain():
+        with database.pinned(conn):
+            for path in paths:
+                error = None
+                try:
+                    code = await _asgi_get(app, path)
+                    if code is not None and code >= 500:
+                        error = f"{path}: HTTP {code}"
+                except Exception as e:
+                    error = f"{path}: {e}"
+                if error and error not in state["errors"]:
+                    state["errors"].append(error)
+        database.pool.release(conn)
+
+    state["warmed_routes"] = len(paths)
+    state["warmup_seconds"] = round(time.perf_counter() - started, 3)
+    state["ready"] = True
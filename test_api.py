@@ -3,9 +3,11 @@ Skrypt do testowania API Krakowskiego Cyfrowego Centrum Wolontariatu
 Uruchom serwer przed wykonaniem testów: python main.py
 """
 
+import os
 import requests
 import json
-from datetime import datetime, timedelta
+import uuid
+from datetime import date, datetime, timedelta
 
 BASE_URL = "http://localhost:8000"
 
@@ -131,6 +133,20 @@ def test_create_initiative():
     print_response(response)
 
 
+def test_import_initiatives():
+    print_section("TEST 30: Import inicjatyw z pliku CSV (organizacja ID: 11)")
+    lines = ["title,description,category,location,start_date,end_date,hours_required,spots_available"]
+    for week in range(4):
+        day = (datetime.now() + timedelta(days=40 + 7 * week)).strftime("%Y-%m-%d")
+        lines.append(f"Oprowadzanie po muzeum {week + 1},Wolontariusze pomagają przy zwiedzaniu,"
+                     f"Kultura,Stare Miasto,{day},{day},4,6")
+    # Wiersz z błędem - trafi do raportu, pozostałe zostaną zapisane
+    lines.append("Wiersz bez dat,Opis,Kultura,Stare Miasto,,,4,6")
+    files = {"file": ("inicjatywy.csv", "\n".join(lines).encode("utf-8"), "text/csv")}
+    response = requests.post(f"{BASE_URL}/organizations/11/initiatives/import", files=files)
+    print_response(response)
+
+
 def test_organization_initiatives():
     print_section("TEST 12: Inicjatywy organizacji ID: 11")
     response = requests.get(f"{BASE_URL}/organizations/11/initiatives")
@@ -198,6 +214,11 @@ def test_create_certificate():
         }
         response = requests.post(f"{BASE_URL}/certificates", json=data)
         print_response(response)
+
+        if response.status_code == 200:
+            print("Weryfikuję zaświadczenie po skrócie")
+            response = requests.get(f"{BASE_URL}{response.json()['verify_url']}")
+            print_response(response)
     else:
         print("Brak ukończonych uczestnictw")
 
@@ -226,6 +247,160 @@ def test_filter_by_location():
     print_response(response)
 
 
+def test_filter_by_dates():
+    print_section("TEST 24: Inicjatywy trwające w najbliższych 2 tygodniach")
+    date_from = date.today()
+    date_to = date_from + timedelta(days=14)
+    response = requests.get(f"{BASE_URL}/initiatives?from={date_from}&to={date_to}")
+    print_response(response)
+
+
+def test_districts():
+    print_section("TEST 25: Dzielnice (wartości filtra location)")
+    response = requests.get(f"{BASE_URL}/districts")
+    print_response(response)
+
+
+def test_volunteer_hours():
+    print_section("TEST 26: Godziny wolontariusza ID: 1")
+    response = requests.get(f"{BASE_URL}/volunteers/1/hours")
+    print_response(response)
+
+
+def test_idempotent_retry():
+    print_section("TEST 27: Ponowienie zgłoszenia z Idempotency-Key")
+    # Inicjatywa, do której wolontariusz ID: 8 jeszcze się nie zgłosił
+    participations = requests.get(f"{BASE_URL}/volunteers/8/participations").json()
+    applied = {p['initiative_id'] for p in participations['participations']}
+    initiatives = requests.get(f"{BASE_URL}/initiatives").json()['initiatives']
+    available = [i['id'] for i in initiatives if i['id'] not in applied]
+    if not available:
+        print("Brak inicjatyw do zgłoszenia")
+        return
+
+    initiative_id = available[0]
+    headers = {"Idempotency-Key": str(uuid.uuid4())}
+    data = {
+        "volunteer_id": 8,
+        "initiative_id": initiative_id,
+        "message": "Zgłoszenie wysłane ze słabym zasięgiem"
+    }
+    # Drugie żądanie to ponowienie - dostaje tę samą odpowiedź, bez drugiego zgłoszenia
+    for attempt in (1, 2):
+        response = requests.post(f"{BASE_URL}/initiatives/{initiative_id}/apply",
+                                 json=data, headers=headers)
+        print(f"Próba {attempt}, Idempotent-Replayed: {response.headers.get('Idempotent-Replayed')}")
+        print_response(response)
+
+
+def test_initiative_facets():
+    print_section("TEST 28: Liczności facetów (kategoria, dzielnica, organizacja)")
+    response = requests.get(f"{BASE_URL}/initiatives?facets=category,location,organization_id")
+    print(f"Status: {response.status_code}")
+    print(json.dumps(response.json().get("facets"), indent=2, ensure_ascii=False))
+
+
+def test_sync_roster():
+    print_section("TEST 31: Synchronizacja listy uczniów (koordynator ID: 18)")
+    payload = {
+        "students": [
+            {"name": "Anna Kowalska", "email": "anna.kowalska@student.krakow.pl", "age_category": "minor"},
+            {"name": "Jan Nowak", "email": "jan.nowak@student.krakow.pl", "age_category": "minor"},
+            {"name": "Ewa Kozłowska", "email": "ewa.kozlowska@student.krakow.pl", "age_category": "minor"},
+            {"name": "Zofia Mazur", "email": "zofia.mazur@student.krakow.pl", "age_category": "minor"}
+        ],
+        "deactivate_missing": False
+    }
+    response = requests.post(f"{BASE_URL}/coordinators/18/roster", json=payload)
+    print_response(response)
+
+
+def test_activity_timeseries():
+    print_section("TEST 32: Aktywność w czasie (miesiące, kategorie)")
+    response = requests.get(f"{BASE_URL}/analytics/timeseries?grain=month&dimension=category")
+    print_response(response)
+
+
+def test_leaderboard():
+    print_section("TEST 33: Ranking wolontariuszy (z miejscem wolontariusza ID: 1)")
+    response = requests.get(f"{BASE_URL}/leaderboards/volunteers?limit=5&id=1")
+    print_response(response)
+
+
+def test_create_backup():
+    print_section("TEST 34: Kopia zapasowa bazy (X-Admin-Token z ADMIN_TOKEN)")
+    headers = {"X-Admin-Token": os.environ.get("ADMIN_TOKEN", "")}
+    response = requests.post(f"{BASE_URL}/admin/backups", headers=headers)
+    print_response(response)
+
+
+def test_database_maintenance():
+    print_section("TEST 35: Konserwacja bazy (X-Admin-Token z ADMIN_TOKEN)")
+    headers = {"X-Admin-Token": os.environ.get("ADMIN_TOKEN", "")}
+    response = requests.post(f"{BASE_URL}/admin/maintenance", headers=headers)
+    print_response(response)
+
+
+def test_profile_request():
+    print_section("TEST 36: Profil żądania (X-Profile: 1, X-Admin-Token z ADMIN_TOKEN)")
+    headers = {"X-Admin-Token": os.environ.get("ADMIN_TOKEN", "")}
+    response = requests.get(f"{BASE_URL}/coordinators/18/reports", headers={**headers, "X-Profile": "1"})
+    print(f"Status: {response.status_code}, X-Request-ID: {response.headers.get('X-Request-ID')}")
+    location = response.headers.get("X-Profile")
+    if location:
+        profile = requests.get(f"{BASE_URL}{location}", headers=headers)
+        print(f"Status: {profile.status_code}")
+        for line in profile.text.splitlines()[:5]:
+            print(f"  {line[-160:]}")
+    print()
+
+
+def test_coordinator_dashboard():
+    print_section("TEST 29: Panel koordynatora jednym żądaniem (POST /batch)")
+    payload = {
+        "requests": [
+            {"id": "students", "path": "/coordinators/18/students"},
+            {"id": "reports", "path": "/coordinators/18/reports"},
+            {"id": "statistics", "path": "/statistics"}
+        ]
+    }
+    response = requests.post(f"{BASE_URL}/batch", json=payload)
+    print(f"Status: {response.status_code}")
+    for item in response.json().get("responses", []):
+        print(f"  {item['id']}: {item['status']} {item['path']}")
+    print()
+
+
+def test_volunteer_events():
+    print_section("TEST 21: Strumień zmian wolontariusza ID: 1 (SSE)")
+    # Last-Event-ID: 0 odtwarza wszystkie zdarzenia zachowane w dzienniku
+    response = requests.get(f"{BASE_URL}/volunteers/1/events", stream=True,
+                            headers={"Last-Event-ID": "0"}, timeout=5)
+    print(f"Status: {response.status_code}")
+    try:
+        for i, line in enumerate(response.iter_lines(decode_unicode=True)):
+            print(f"  {line}")
+            if i >= 8:
+                break
+    except (requests.exceptions.ReadTimeout, requests.exceptions.ConnectionError):
+        # Przekroczenie czasu odczytu strumienia requests zgłasza jako ConnectionError
+        print("  (brak kolejnych zdarzeń)")
+    response.close()
+    print()
+
+
+def test_volunteer_history():
+    print_section("TEST 22: Pełna historia wolontariusza ID: 1 (z archiwum)")
+    response = requests.get(f"{BASE_URL}/volunteers/1/participations?include_archived=true")
+    print_response(response)
+
+
+def test_ready():
+    print_section("TEST 23: Gotowość serwera")
+    response = requests.get(f"{BASE_URL}/ready")
+    print_response(response)
+
+
 def run_all_tests():
     print("\n" + "🚀" * 30)
     print("  TESTY API - KRAKOWSKIE CYFROWE CENTRUM WOLONTARIATU")
@@ -234,6 +409,7 @@ def run_all_tests():
     try:
         # Testy podstawowe
         test_root()
+        test_ready()
         test_statistics()
 
         # Testy inicjatyw
@@ -241,6 +417,9 @@ def run_all_tests():
         test_filter_initiatives()
         test_get_initiative_details()
         test_filter_by_location()
+        test_filter_by_dates()
+        test_districts()
+        test_initiative_facets()
 
         # Testy użytkowników
         test_get_users()
@@ -249,11 +428,16 @@ def run_all_tests():
 
         # Testy wolontariuszy
         test_volunteer_participations()
+        test_volunteer_history()
+        test_volunteer_hours()
         test_apply_to_initiative()
+        test_idempotent_retry()
         test_volunteer_certificates()
+        test_volunteer_events()
 
         # Testy organizacji
         test_create_initiative()
+        test_import_initiatives()
         test_organization_initiatives()
         test_organization_applications()
         test_approve_participation()
@@ -263,6 +447,17 @@ def run_all_tests():
         # Testy koordynatorów
         test_coordinator_students()
         test_coordinator_reports()
+        test_sync_roster()
+        test_coordinator_dashboard()
+
+        # Analityka
+        test_activity_timeseries()
+        test_leaderboard()
+
+        # Administracja
+        test_create_backup()
+        test_database_maintenance()
+        test_profile_request()
 
         print("\n" + "✅" * 30)
         print("  WSZYSTKIE TESTY ZAKOŃCZONE")
@@ -301,6 +496,22 @@ def interactive_menu():
         print("18. Uczniowie koordynatora")
         print("19. Raport koordynatora")
         print("20. Filtruj po lokalizacji")
+        print("21. Strumień zmian wolontariusza (SSE)")
+        print("22. Pełna historia wolontariusza (z archiwum)")
+        print("23. Gotowość serwera")
+        print("24. Filtruj po terminie (from/to)")
+        print("25. Dzielnice")
+        print("26. Godziny wolontariusza")
+        print("27. Ponowienie z Idempotency-Key")
+        print("28. Facety inicjatyw")
+        print("29. Panel koordynatora (żądanie zbiorcze)")
+        print("30. Import inicjatyw z pliku CSV")
+        print("31. Synchronizacja listy uczniów")
+        print("32. Aktywność w czasie")
+        print("33. Ranking wolontariuszy")
+        print("34. Kopia zapasowa bazy")
+        print("35. Konserwacja bazy")
+        print("36. Profil żądania")
         print()
         print("A.  URUCHOM WSZYSTKIE TESTY")
         print("Q.  WYJŚCIE")
@@ -353,6 +564,38 @@ def interactive_menu():
             test_coordinator_reports()
         elif choice == '20':
             test_filter_by_location()
+        elif choice == '21':
+            test_volunteer_events()
+        elif choice == '22':
+            test_volunteer_history()
+        elif choice == '23':
+            test_ready()
+        elif choice == '24':
+            test_filter_by_dates()
+        elif choice == '25':
+            test_districts()
+        elif choice == '26':
+            test_volunteer_hours()
+        elif choice == '27':
+            test_idempotent_retry()
+        elif choice == '28':
+            test_initiative_facets()
+        elif choice == '29':
+            test_coordinator_dashboard()
+        elif choice == '30':
+            test_import_initiatives()
+        elif choice == '31':
+            test_sync_roster()
+        elif choice == '32':
+            test_activity_timeseries()
+        elif choice == '33':
+            test_leaderboard()
+        elif choice == '34':
+            test_create_backup()
+        elif choice == '35':
+            test_database_maintenance()
+        elif choice == '36':
+            test_profile_request()
         else:
             print("❌ Nieprawidłowy wybór!")
 
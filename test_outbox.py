@@ -0,0 +1,69 @@
+"""
+Testy czyszczenia outboxa (nie wymagają uruchomionego serwera)
+Uruchom: python -m pytest test_outbox.py
+
+Zadanie outbox.purge_job jest wykonywane przez scheduler.run_job na kopii
+volunteer.db z wiadomościami w różnych stanach i w różnym wieku.
+"""
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Kopia bazy - test usuwa i dodaje wiadomości (bez zmiany VOLUNTEER_DB innych testów)
+DATABASE_PATH = os.path.join(tempfile.mkdtemp(prefix="volunteer-outbox-"), "volunteer.db")
+shutil.copy(os.path.join(HERE, "volunteer.db"), DATABASE_PATH)
+
+import database  # noqa: E402
+import init_database  # noqa: E402
+import outbox  # noqa: E402
+import scheduler  # noqa: E402
+
+
+def get_db():
+    conn = sqlite3.connect(DATABASE_PATH)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def add_messages(conn, status, last_attempt, count):
+    conn.executemany("""
+        INSERT INTO outbox (kind, recipient_id, payload, status, next_attempt_at)
+        VALUES ('certificate.created', 1, '{}', ?, ?)
+    """, [(status, last_attempt)] * count)
+
+
+def test_purge_removes_only_old_finished_messages():
+    conn = get_db()
+    init_database.migrate(conn)
+    conn.execute("DELETE FROM outbox")
+    now = time.time()
+    old = now - (outbox.RETENTION_DAYS + 2) * 86400
+    recent = now - (outbox.RETENTION_DAYS - 2) * 86400
+    # Więcej starych wiadomości niż jedna partia - zadanie usuwa je kilkoma transakcjami
+    add_messages(conn, "sent", old, scheduler.BATCH_SIZE + 20)
+    add_messages(conn, "failed", old, 5)
+    add_messages(conn, "pending", old, 3)
+    add_messages(conn, "sent", recent, 4)
+    add_messages(conn, "failed", recent, 2)
+    conn.commit()
+    conn.close()
+
+    removed = scheduler.run_job(get_db, "purge_outbox", outbox.purge_job,
+                                today=database.to_day(time.strftime("%Y-%m-%d", time.gmtime(now))))
+
+    conn = get_db()
+    left = dict(conn.execute("SELECT status, COUNT(*) FROM outbox GROUP BY status").fetchall())
+    conn.close()
+    assert removed == scheduler.BATCH_SIZE + 25
+    # Zaległe wiadomości zostają niezależnie od wieku, świeże wysłane i porzucone też
+    assert left == {"pending": 3, "sent": 4, "failed": 2}
+
+
+if __name__ == "__main__":
+    test_purge_removes_only_old_finished_messages()
+    print("✓ Outbox usuwa tylko stare wiadomości wysłane i porzucone")
@@ -0,0 +1,171 @@
+"""
+Testy zbioru zapytań SQL (nie wymagają uruchomionego serwera)
+Uruchom: python -m pytest test_queries.py
+
+Endpointy są wywoływane na kopii volunteer.db z różnymi zestawami filtrów
+i wartości, a każde połączenie zapisuje teksty wykonanych zapytań. Zbiór
+tekstów musi być skończony (nowe wartości nie dają nowych tekstów) i mieścić
+się w pamięci podręcznej zapytań połączenia (database.CACHED_STATEMENTS).
+"""
+
+import itertools
+import os
+import shutil
+import sqlite3
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Kopia bazy i archiwum - test zapisuje (zgłoszenia, zatwierdzenia, listy uczniów)
+WORKDIR = tempfile.mkdtemp(prefix="volunteer-queries-")
+shutil.copy(os.path.join(HERE, "volunteer.db"), os.path.join(WORKDIR, "volunteer.db"))
+os.environ["VOLUNTEER_DB"] = os.path.join(WORKDIR, "volunteer.db")
+os.environ["VOLUNTEER_ARCHIVE_DB"] = os.path.join(WORKDIR, "volunteer_archive.db")
+os.environ["NOTIFY_SINK"] = "file:" + os.path.join(WORKDIR, "notifications.jsonl")
+os.environ["SCHEDULER"] = "0"
+os.environ["OUTBOX_DISPATCHER"] = "0"
+os.environ["RATE_LIMIT_PER_SECOND"] = "100000"
+os.environ["RATE_LIMIT_BURST"] = "100000"
+
+import database  # noqa: E402
+
+# Teksty SQL wykonane przez połączenia aplikacji
+STATEMENTS = set()
+
+
+class RecordingCursor(sqlite3.Cursor):
+    def execute(self, sql, *args):
+        STATEMENTS.add(sql)
+        return super().execute(sql, *args)
+
+    def executemany(self, sql, *args):
+        STATEMENTS.add(sql)
+        return super().executemany(sql, *args)
+
+
+class RecordingConnection(database.PooledConnection):
+    # Connection.execute() też tworzy kursor przez cursor()
+    def cursor(self, factory=RecordingCursor):
+        return super().cursor(factory)
+
+
+database.PooledConnection = RecordingConnection
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+import main  # noqa: E402
+import queries  # noqa: E402
+
+
+def initiative_filters(variant):
+    """Wszystkie kombinacje filtrów GET /initiatives z wartościami zależnymi od wariantu"""
+    values = {
+        "category": ["Ekologia", "Edukacja"][variant % 2],
+        "location": ["Nowa Huta", "Kazimierz"][variant % 2],
+        "organization_id": 11 + variant,
+        "from": f"2025-0{1 + variant}-01",
+        "to": f"2026-0{1 + variant}-28",
+    }
+    for status in ("active", "completed", ""):
+        for size in range(len(values) + 1):
+            for names in itertools.combinations(values, size):
+                yield {"status": status, **{name: values[name] for name in names}}
+
+
+def exercise(client, variant):
+    """Wywołaj endpointy z filtrami i wartościami zależnymi od wariantu"""
+    for params in initiative_filters(variant):
+        client.get("/initiatives", params=params)
+
+    dates = [{}, {"from": "2025-01-01"}, {"to": "2026-12-31"}, {"from": "2025-01-01", "to": "2026-12-31"}]
+    volunteer_id = 1 + variant
+    org_id = 11 + variant
+    for params in dates:
+        for status in (None, "pending", "approved"):
+            client.get(f"/organizations/{org_id}/applications", params={**params, "status": status})
+        client.get(f"/organizations/{org_id}/initiatives", params=params)
+        for archived in ("false", "true"):
+            client.get(f"/volunteers/{volunteer_id}/participations",
+                       params={**params, "include_archived": archived})
+
+    for user_type in (None, "volunteer", "organization"):
+        client.get("/users", params={"user_type": user_type})
+    client.get(f"/users/{volunteer_id}")
+    client.get(f"/initiatives/{1 + variant}")
+    client.get(f"/volunteers/{volunteer_id}/hours")
+    client.get(f"/volunteers/{volunteer_id}/certificates")
+    client.get("/districts")
+    client.get("/statistics")
+    for archived, inactive in itertools.product(("false", "true"), repeat=2):
+        client.get("/coordinators/18/students",
+                   params={"include_archived": archived, "include_inactive": inactive})
+        client.get("/coordinators/18/reports", params={"include_archived": archived})
+
+    for grain, dimension in itertools.product(("day", "week", "month"), ("all", "category")):
+        client.get("/analytics/timeseries", params={"grain": grain, "dimension": dimension})
+        client.get("/analytics/timeseries", params={"grain": grain, "dimension": dimension,
+                                                    "from": "2025-01-01", "to": "2026-12-31",
+                                                    "key": "Ekologia"})
+    for scope in ("volunteers", "schools", "organizations"):
+        client.get(f"/leaderboards/{scope}", params={"limit": 3 + variant, "id": 1 + variant})
+
+    # Zapisy: zgłoszenie, zatwierdzenie z godzinami i bez, lista uczniów różnej długości
+    initiative = client.post("/initiatives", json={
+        "title": f"Sprzątanie {variant}", "description": "Test", "category": "Ekologia",
+        "location": "Nowa Huta", "start_date": "2026-05-01", "end_date": "2026-05-02",
+        "hours_required": 2, "spots_available": 5, "organization_id": org_id
+    }).json()["initiative_id"]
+    participation = client.post(f"/initiatives/{initiative}/apply",
+                                json={"volunteer_id": volunteer_id, "initiative_id": initiative,
+                                      "message": "Chętnie"}).json()
+    participation_id = participation["participation_id"]
+    client.put(f"/participations/{participation_id}/approve", json={"status": "approved"})
+    client.put(f"/participations/{participation_id}/approve",
+               json={"status": "completed", "hours_completed": 2 + variant})
+    students = [{"name": f"Uczeń {number}", "email": f"uczen{number}@szkola.pl"}
+                for number in range(3 + variant * 7)]
+    client.post("/coordinators/18/roster", json={"students": students})
+    client.get("/initiatives")
+
+
+def test_statements_are_bounded():
+    with TestClient(main.app) as client:
+        # Pierwszy przebieg: ładowanie katalogu i rankingów, rozgrzewka
+        exercise(client, 0)
+        exercise(client, 1)
+        known = set(STATEMENTS)
+
+        # Inne wartości i długości list nie mogą dawać nowych tekstów SQL
+        exercise(client, 2)
+        exercise(client, 3)
+        new = STATEMENTS - known
+    assert not new, f"Nowe teksty SQL dla innych wartości: {sorted(new)}"
+
+
+def test_statement_cache_fits():
+    with TestClient(main.app) as client:
+        exercise(client, 0)
+    texts = STATEMENTS | queries.statements()
+    print(f"Teksty SQL: {len(texts)} (cached_statements = {database.CACHED_STATEMENTS})")
+    assert len(texts) <= database.CACHED_STATEMENTS
+
+
+# Fragmenty filtrów opcjonalnych - zapytania z nimi muszą pochodzić z queries.Select
+FILTER_FRAGMENTS = (".start_day <=", ".end_day >=", "u.active =")
+
+
+def test_filtered_statements_are_declared():
+    with TestClient(main.app) as client:
+        exercise(client, 0)
+    declared = queries.statements()
+    filtered = {sql for sql in STATEMENTS if any(part in sql for part in FILTER_FRAGMENTS)}
+    assert filtered, "Endpointy nie wykonały żadnego zapytania z filtrem"
+    undeclared = filtered - declared
+    assert not undeclared, f"Zapytania z filtrami spoza queries.Select: {sorted(undeclared)}"
+
+
+if __name__ == "__main__":
+    test_statements_are_bounded()
+    test_statement_cache_fits()
+    test_filtered_statements_are_declared()
+    print("✓ Zapytania SQL mieszczą się w pamięci podręcznej połączeń")
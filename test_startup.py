@@ -0,0 +1,53 @@
+"""
+Testy czasu startu aplikacji (nie wymagają uruchomionego serwera)
+Uruchom: python -m pytest test_startup.py
+"""
+
+import os
+import subprocess
+import sys
+
+# Maksymalny łączny czas importu modułu main (sekundy)
+IMPORT_BUDGET_SECONDS = float(os.environ.get("IMPORT_BUDGET_SECONDS", "1.5"))
+
+# Moduły ładowane dopiero przy pierwszym użyciu - nie mogą spowalniać startu
+LAZY_MODULES = ["smtplib"]
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def measure_import():
+    """Zaimportuj main w świeżym procesie; zwróć (czas w s, zaimportowane moduły)"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c",
+         "import sys, main; print(' '.join(sorted(sys.modules)))"],
+        cwd=HERE, capture_output=True, text=True, check=True
+    )
+
+    cumulative_us = None
+    for line in result.stderr.splitlines():
+        parts = [part.strip() for part in line.split("|")]
+        if len(parts) == 3 and parts[2] == "main":
+            cumulative_us = int(parts[1])
+
+    return cumulative_us / 1_000_000, set(result.stdout.split())
+
+
+def test_import_time_budget():
+    # Pierwszy import rozgrzewa cache bajtkodu (.pyc), liczy się drugi
+    measure_import()
+    seconds, _ = measure_import()
+    print(f"Import main: {seconds:.3f} s (budżet {IMPORT_BUDGET_SECONDS} s)")
+    assert seconds < IMPORT_BUDGET_SECONDS
+
+
+def test_optional_modules_are_lazy():
+    _, modules = measure_import()
+    loaded = [name for name in LAZY_MODULES if name in modules]
+    assert not loaded, f"Moduły importowane przy starcie: {loaded}"
+
+
+if __name__ == "__main__":
+    test_import_time_budget()
+    test_optional_modules_are_lazy()
+    print("✓ Start aplikacji mieści się w budżecie")
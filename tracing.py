@@ -0,0 +1,391 @@
+"""
+Śledzenie żądań: gdzie idzie czas obsługi jednego żądania.
+
+Każde żądanie dostaje identyfikator X-Request-ID (z nagłówka klienta albo nowy)
+zwracany w odpowiedzi. Żądanie wybrane do śledzenia ma span główny "request"
+i spany podrzędne:
+
+- handler - wykonanie funkcji endpointu (TracedRoute),
+- db.acquire - pobranie połączenia z puli (database.get_db),
+- db.execute - każde zapytanie SQL (tekst zapytania w atrybucie sql),
+- db.fetch - pobranie wierszy wyniku (krokowanie zapytania i obiekty Row),
+- serialize - od końca endpointu do wysłania nagłówków odpowiedzi
+  (zamiana wyniku na JSON),
+- własne spany endpointów (tracing.span("...")), np. konwersja wierszy.
+
+Które żądania są śledzone:
+- TRACE_SAMPLE_RATE (0-1, domyślnie 0) - losowy ułamek żądań,
+- TRACE_SLOW_MS - wszystkie żądania wolniejsze niż próg (spany są zbierane
+  dla każdego żądania, a eksportowane tylko te powyżej progu).
+
+Bez obu ustawień zbierania nie ma: middleware nadaje tylko X-Request-ID,
+a połączenia zwracają zwykłe kursory sqlite3.
+
+Gotowe ślady trafiają (w wątku w tle, bez opóźniania odpowiedzi) do:
+- TRACE_EXPORT=file:traces.jsonl (domyślnie) - jeden ślad na linię JSON,
+- TRACE_EXPORT=otlp:http://localhost:4318/v1/traces - OTLP/HTTP w formacie JSON
+  (kolektor OpenTelemetry albo jego lokalny zamiennik).
+"""
+
+import contextvars
+import functools
+import inspect
+import json
+import os
+import queue
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from fastapi.routing import APIRoute
+
+REQUEST_ID_HEADER = b"x-request-id"
+
+SAMPLE_RATE = float(os.environ.get("TRACE_SAMPLE_RATE", "0"))
+SLOW_MS = float(os.environ.get("TRACE_SLOW_MS", "0"))
+EXPORT_URL = os.environ.get("TRACE_EXPORT", "file:traces.jsonl")
+
+# Najwięcej spanów w jednym śladzie (np. pętla zapytań) i śladów czekających na eksport
+MAX_SPANS = 1000
+MAX_QUEUED = 1000
+
+# Tekst zapytania w atrybucie spanu jest skracany
+MAX_SQL_LENGTH = 500
+
+SERVICE_NAME = "volunteer-api"
+
+_trace = contextvars.ContextVar("trace", default=None)
+_span = contextvars.ContextVar("span", default=None)
+
+
+class Span:
+    __slots__ = ("span_id", "parent_id", "name", "start", "end", "attributes")
+
+    def __init__(self, name, parent_id, attributes):
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.name = name
+        self.start = time.time()
+        self.end = None
+        self.attributes = attributes
+
+    def as_dict(self):
+        return {
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start,
+            "duration_ms": round(((self.end or self.start) - self.start) * 1000, 3),
+            "attributes": self.attributes
+        }
+
+
+class Trace:
+    __slots__ = ("trace_id", "request_id", "spans", "dropped", "handler_end")
+
+    def __init__(self, request_id):
+        self.trace_id = uuid.uuid4().hex
+        self.request_id = request_id
+        self.spans = []
+        self.dropped = 0
+        self.handler_end = None
+
+    def as_dict(self):
+        return {
+            "trace_id": self.trace_id,
+            "request_id": self.request_id,
+            "spans": [span.as_dict() for span in self.spans],
+            "dropped_spans": self.dropped
+        }
+
+
+def current():
+    """Ślad bieżącego żądania albo None (śledzenie wyłączone dla tego żądania)"""
+    return _trace.get()
+
+
+def _start(trace, name, attributes):
+    parent = _span.get()
+    span = Span(name, parent.span_id if parent is not None else None, attributes)
+    if len(trace.spans) < MAX_SPANS:
+        trace.spans.append(span)
+    else:
+        trace.dropped += 1
+    return span
+
+
+@contextmanager
+def span(name, **attributes):
+    """Span podrzędny bieżącego spanu (bez śledzenia - nic nie robi)"""
+    trace = _trace.get()
+    if trace is None:
+        yield None
+        return
+    span = _start(trace, name, attributes)
+    token = _span.set(span)
+    try:
+        yield span
+    finally:
+        span.end = time.time()
+        _span.reset(token)
+
+
+# === SQLITE ===
+
+def _statement(sql):
+    return " ".join(sql.split())[:MAX_SQL_LENGTH]
+
+
+class TracedCursor(sqlite3.Cursor):
+    """Kursor zapisujący spany zapytań i pobierania wierszy"""
+
+    def execute(self, sql, *args):
+        with span("db.execute", sql=_statement(sql)):
+            return super().execute(sql, *args)
+
+    def executemany(self, sql, *args):
+        with span("db.execute", sql=_statement(sql), many=True):
+            return super().executemany(sql, *args)
+
+    def fetchone(self):
+        with span("db.fetch") as fetch:
+            row = super().fetchone()
+            fetch.attributes["rows"] = 0 if row is None else 1
+            return row
+
+    def fetchmany(self, *args):
+        with span("db.fetch") as fetch:
+            rows = super().fetchmany(*args)
+            fetch.attributes["rows"] = len(rows)
+            return rows
+
+    def fetchall(self):
+        with span("db.fetch") as fetch:
+            rows = super().fetchall()
+            fetch.attributes["rows"] = len(rows)
+            return rows
+
+
+def cursor_factory(factory):
+    """Klasa kursora dla połączenia: śledzona tylko w śledzonym żądaniu"""
+    if factory is sqlite3.Cursor and _trace.get() is not None:
+        return TracedCursor
+    return factory
+
+
+# === ENDPOINTY ===
+
+def _mark_handler_end():
+    trace = _trace.get()
+    if trace is not None:
+        trace.handler_end = time.time()
+
+
+def trace_handler(endpoint):
+    """Opakuj funkcję endpointu spanem "handler" (sygnatura bez zmian dla FastAPI)"""
+    if inspect.iscoroutinefunction(endpoint):
+        @functools.wraps(endpoint)
+        async def traced(*args, **kwargs):
+            if _trace.get() is None:
+                return await endpoint(*args, **kwargs)
+            try:
+                with span("handler"):
+                    return await endpoint(*args, **kwargs)
+            finally:
+                _mark_handler_end()
+    else:
+        @functools.wraps(endpoint)
+        def traced(*args, **kwargs):
+            if _trace.get() is None:
+                return endpoint(*args, **kwargs)
+            try:
+                with span("handler"):
+                    return endpoint(*args, **kwargs)
+            finally:
+                _mark_handler_end()
+    return traced
+
+
+class TracedRoute(APIRoute):
+    def __init__(self, path, endpoint, **kwargs):
+        super().__init__(path, trace_handler(endpoint), **kwargs)
+
+
+# === EKSPORT ===
+
+class FileExporter:
+    """Ślady jako linie JSON w pliku"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def export(self, traces):
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.writelines(json.dumps(trace, ensure_ascii=False) + "\n" for trace in traces)
+
+
+class OtlpExporter:
+    """OTLP/HTTP z ciałem JSON (resourceSpans) - jedno żądanie na partię śladów"""
+
+    def __init__(self, url):
+        self.url = url
+
+    @staticmethod
+    def _attributes(values):
+        attributes = []
+        for key, value in values.items():
+            if isinstance(value, bool):
+                typed = {"boolValue": value}
+            elif isinstance(value, int):
+                typed = {"intValue": str(value)}
+            elif isinstance(value, float):
+                typed = {"doubleValue": value}
+            else:
+                typed = {"stringValue": str(value)}
+            attributes.append({"key": key, "value": typed})
+        return attributes
+
+    def _span(self, trace, span):
+        start = int(span["start"] * 1e9)
+        return {
+            "traceId": trace["trace_id"],
+            "spanId": span["span_id"],
+            "parentSpanId": span["parent_id"] or "",
+            "name": span["name"],
+            "kind": 2 if span["parent_id"] is None else 1,
+            "startTimeUnixNano": str(start),
+            "endTimeUnixNano": str(start + int(span["duration_ms"] * 1e6)),
+            "attributes": self._attributes({**span["attributes"], "request_id": trace["request_id"]})
+        }
+
+    def export(self, traces):
+        import urllib.request
+
+        body = {"resourceSpans": [{
+            "resource": {"attributes": self._attributes({"service.name": SERVICE_NAME})},
+            "scopeSpans": [{
+                "scope": {"name": "tracing"},
+                "spans": [self._span(trace, span) for trace in traces for span in trace["spans"]]
+            }]
+        }]}
+        request = urllib.request.Request(self.url, data=json.dumps(body).encode(),
+                                         headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(request, timeout=10):
+            pass
+
+
+def exporter_from_url(url):
+    if url.startswith("file:"):
+        return FileExporter(url[len("file:"):])
+    if url.startswith("otlp:"):
+        return OtlpExporter(url[len("otlp:"):])
+    raise ValueError(f"Nieobsługiwany eksport śladów: {url}")
+
+
+class ExportQueue:
+    """Kolejka śladów zapisywanych w wątku w tle (pełna kolejka - ślad jest pomijany)"""
+
+    def __init__(self, exporter):
+        self.exporter = exporter
+        self.queue = queue.Queue(maxsize=MAX_QUEUED)
+        self.dropped = 0
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def put(self, trace):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="trace-export", daemon=True)
+                self._thread.start()
+        try:
+            self.queue.put_nowait(trace.as_dict())
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while True:
+            traces = [self.queue.get()]
+            while True:
+                try:
+                    traces.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self.exporter.export(traces)
+            except Exception:
+                # Niedostępny kolektor nie może zatrzymać eksportu kolejnych śladów
+                self.dropped += len(traces)
+
+
+# === MIDDLEWARE ===
+
+def _request_id(scope):
+    for name, value in scope.get("headers", ()):
+        if name == REQUEST_ID_HEADER:
+            value = value.decode("latin-1").strip()
+            if value and len(value) <= 200:
+                return value
+    return uuid.uuid4().hex
+
+
+class TracingMiddleware:
+    """Middleware ASGI: X-Request-ID i ślad wybranych żądań"""
+
+    def __init__(self, app, sample_rate=SAMPLE_RATE, slow_ms=SLOW_MS, exporter=None):
+        self.app = app
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+        self._exporter = exporter
+        self._queue = None
+
+    @property
+    def queue(self):
+        if self._queue is None:
+            self._queue = ExportQueue(self._exporter or exporter_from_url(EXPORT_URL))
+        return self._queue
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = _request_id(scope)
+        scope.setdefault("state", {})["request_id"] = request_id
+        sampled = self.sample_rate > 0 and random.random() < self.sample_rate
+        trace = Trace(request_id) if sampled or self.slow_ms > 0 else None
+        status = {}
+
+        async def send_with_request_id(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                message = {**message, "headers": [*message.get("headers", ()),
+                                                  (REQUEST_ID_HEADER, request_id.encode("latin-1"))]}
+                if trace is not None and trace.handler_end is not None:
+                    serialize = Span("serialize", root.span_id, {})
+                    serialize.start, serialize.end = trace.handler_end, time.time()
+                    trace.spans.append(serialize)
+            await send(message)
+
+        if trace is None:
+            await self.app(scope, receive, send_with_request_id)
+            return
+
+        token = _trace.set(trace)
+        root = _start(trace, "request", {"method": scope["method"], "path": scope["path"]})
+        span_token = _span.set(root)
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            root.end = time.time()
+            root.attributes["status"] = status.get("code")
+            # Router dopisuje do scope dopasowany endpoint
+            endpoint = scope.get("endpoint")
+            if endpoint is not None:
+                root.attributes["endpoint"] = getattr(endpoint, "__name__", str(endpoint))
+            _span.reset(span_token)
+            _trace.reset(token)
+            if sampled or (root.end - root.start) * 1000 >= self.slow_ms:
+                self.queue.put(trace)